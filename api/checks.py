@@ -0,0 +1,22 @@
+"""
+System checks for Daraja state kept in the Django cache.
+
+The circuit breaker counts failures, and ``get_access_token`` takes its
+refresh lock, in the default cache. With a process-local cache each gunicorn
+worker would trip its own breaker and fetch its own token.
+"""
+from django.core.checks import Error, Tags, register
+
+from users.checks import cache_is_shared
+
+
+@register(Tags.caches)
+def check_daraja_cache(app_configs, **kwargs):
+    if cache_is_shared():
+        return []
+    return [Error(
+        "The Daraja circuit breaker and token refresh lock need a cache shared by all worker processes; "
+        "each worker would count failures and refresh the token on its own.",
+        hint="Set CACHE_BACKEND to a shared backend such as Redis or Memcached.",
+        id='api.E001',
+    )]
@@ -0,0 +1,194 @@
+"""
+Circuit breaker for calls to Safaricom.
+
+Calls and failures are counted per ``DARAJA_BREAKER_WINDOW`` in the shared
+cache, so every worker process sees the same failure rate. The rate is taken
+over a sliding window: the previous window's counts are weighted by how much
+of it still overlaps, so a burst of failures is not forgotten at a window
+boundary. Once at least ``DARAJA_BREAKER_MIN_CALLS`` calls in a window have
+failed at ``DARAJA_BREAKER_FAILURE_RATE`` or more, the circuit opens and
+callers get a ``CircuitOpenError`` straight away instead of waiting on a
+degraded API.
+After ``DARAJA_BREAKER_COOLDOWN`` seconds a single probe call is let through;
+its outcome closes or re-opens the circuit. Calls that were already in flight
+when the circuit opened cannot close it.
+
+If the cache is unavailable the breaker stays closed rather than blocking
+payments.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FAILURE_RATE = 0.5
+DEFAULT_MIN_CALLS = 10
+DEFAULT_WINDOW = 60
+DEFAULT_COOLDOWN = 30
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """The circuit is open; the call was not made."""
+
+    def __init__(self, name, retry_after):
+        self.name = name
+        self.retry_after = max(int(retry_after), 1)
+        super().__init__(f"{name} is unavailable, retry in {self.retry_after}s")
+
+
+class CircuitBreaker:
+    def __init__(self, name):
+        self.name = name
+        self.open_key = f"circuit:{name}:open-until"
+        self.probe_key = f"circuit:{name}:probe"
+
+    @property
+    def failure_rate(self):
+        return getattr(settings, "DARAJA_BREAKER_FAILURE_RATE", DEFAULT_FAILURE_RATE)
+
+    @property
+    def min_calls(self):
+        return getattr(settings, "DARAJA_BREAKER_MIN_CALLS", DEFAULT_MIN_CALLS)
+
+    @property
+    def window(self):
+        return getattr(settings, "DARAJA_BREAKER_WINDOW", DEFAULT_WINDOW)
+
+    @property
+    def cooldown(self):
+        return getattr(settings, "DARAJA_BREAKER_COOLDOWN", DEFAULT_COOLDOWN)
+
+    def _counter_keys(self, now=None, windows_ago=0):
+        bucket = int((now or time.time()) // self.window) - windows_ago
+        return f"circuit:{self.name}:calls:{bucket}", f"circuit:{self.name}:failures:{bucket}"
+
+    def _counts(self, now):
+        """Return the ``(calls, failures)`` estimated over the sliding window ending at ``now``."""
+        current = self._counter_keys(now)
+        previous = self._counter_keys(now, windows_ago=1)
+        counts = cache.get_many([*current, *previous])
+        overlap = 1 - (now % self.window) / self.window
+        return tuple(
+            counts.get(current_key, 0) + counts.get(previous_key, 0) * overlap
+            for current_key, previous_key in zip(current, previous)
+        )
+
+    def _incr(self, key):
+        if cache.add(key, 1, self.window * 2):
+            return 1
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr().
+            cache.set(key, 1, self.window * 2)
+            return 1
+
+    def _open_until(self):
+        try:
+            return cache.get(self.open_key)
+        except Exception:
+            logger.warning("Circuit breaker cache unavailable, treating %s as closed", self.name, exc_info=True)
+            return None
+
+    def current_state(self, now=None):
+        open_until = self._open_until()
+        if open_until is None:
+            return CLOSED
+        return OPEN if (now or time.time()) < open_until else HALF_OPEN
+
+    def is_open(self):
+        """Whether calls are being refused right now, without taking the probe."""
+        return self.current_state() == OPEN
+
+    def check(self):
+        """
+        Raise ``CircuitOpenError`` while the circuit is open, without taking
+        the probe. Returns when it re-opens, or ``None`` if it is closed.
+        """
+        now = time.time()
+        open_until = self._open_until()
+        if open_until is not None and now < open_until:
+            raise CircuitOpenError(self.name, open_until - now)
+        return open_until
+
+    def before_call(self):
+        """
+        Raise ``CircuitOpenError`` unless a call may be made now. Returns
+        ``True`` when the call is the probe, which is then the only one whose
+        success closes the circuit.
+        """
+        if self.check() is None:
+            return False
+        try:
+            probing = cache.add(self.probe_key, 1, self.cooldown)
+        except Exception:
+            return False
+        if not probing:
+            raise CircuitOpenError(self.name, self.cooldown)
+        return True
+
+    def record_success(self, now=None, probe=False):
+        now = now or time.time()
+        try:
+            self._incr(self._counter_keys(now)[0])
+            if probe and self.current_state(now) == HALF_OPEN:
+                self.reset()
+                logger.info("Circuit %s closed", self.name)
+        except Exception:
+            logger.warning("Circuit breaker cache unavailable", exc_info=True)
+
+    def record_failure(self, now=None):
+        now = now or time.time()
+        calls_key, failures_key = self._counter_keys(now)
+        try:
+            self._incr(calls_key)
+            self._incr(failures_key)
+            calls, failures = self._counts(now)
+            state = self.current_state(now)
+            if state == HALF_OPEN or (
+                state == CLOSED and calls >= self.min_calls and failures / calls >= self.failure_rate
+            ):
+                self._trip(now)
+        except Exception:
+            logger.warning("Circuit breaker cache unavailable", exc_info=True)
+
+    def _trip(self, now):
+        cache.set(self.open_key, now + self.cooldown, self.cooldown + self.window)
+        cache.delete(self.probe_key)
+        logger.warning("Circuit %s opened for %ss", self.name, self.cooldown)
+
+    def reset(self):
+        now = time.time()
+        cache.delete_many([
+            self.open_key, self.probe_key, *self._counter_keys(now), *self._counter_keys(now, windows_ago=1),
+        ])
+
+    def snapshot(self):
+        now = time.time()
+        try:
+            calls, failures = self._counts(now)
+        except Exception:
+            calls = failures = 0
+        open_until = self._open_until()
+        return {
+            "name": self.name,
+            "state": self.current_state(now),
+            "calls": round(calls, 1),
+            "failures": round(failures, 1),
+            "failure_rate": round(failures / calls, 3) if calls else 0.0,
+            "retry_after": max(int(open_until - now), 0) if open_until else 0,
+            "window": self.window,
+            "min_calls": self.min_calls,
+            "threshold": self.failure_rate,
+            "cooldown": self.cooldown,
+        }
+
+
+daraja_breaker = CircuitBreaker("daraja")
@@ -1,80 +1,327 @@
-import requests
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from requests.auth import HTTPBasicAuth
+from . import http_client
+from .circuit_breaker import daraja_breaker
+from .payment_logging import track_daraja_call
 import base64
 import datetime
+import hashlib
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://sandbox.safaricom.co.ke"
+DEFAULT_TOKEN_REFRESH_MARGIN = 60
+TOKEN_REFRESH_LOCK_TIMEOUT = 10
+TOKEN_WAIT_INTERVAL = 0.05
+SERVER_ERROR = 500
+
+STK_PUSH_PATH = "/mpesa/stkpush/v1/processrequest"
+B2C_PATH = "/mpesa/b2c/v1/paymentrequest"
+OAUTH_PATH = "/oauth/v1/generate?grant_type=client_credentials"
+REQUIRED_SETTINGS = ("DARAJA_CONSUMER_KEY", "DARAJA_CONSUMER_SECRET", "DARAJA_SHORTCODE", "DARAJA_PASSKEY")
+
+_token_refresh_lock = threading.Lock()
+_local_tokens = {}
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _record_outcome(response, probe):
+    if response.status_code >= SERVER_ERROR:
+        daraja_breaker.record_failure()
+    else:
+        daraja_breaker.record_success(probe=probe)
+
 
 class DarajaAPI:
+    """
+    Daraja client. Settings are read and checked once, and the parts of each
+    request that do not change between calls are built up front, so use the
+    shared instance from ``get_daraja()`` rather than creating one per call.
+    The instance holds no per-call state and is safe to share between threads.
+    """
+
     def __init__(self):
         self.consumer_key = settings.DARAJA_CONSUMER_KEY
         self.consumer_secret = settings.DARAJA_CONSUMER_SECRET
         self.business_shortcode = settings.DARAJA_SHORTCODE
         self.passkey = settings.DARAJA_PASSKEY
-        self.base_url = "https://sandbox.safaricom.co.ke"
+        self.base_url = (getattr(settings, "DARAJA_BASE_URL", None) or DEFAULT_BASE_URL).rstrip("/")
         self.callback_url = settings.DARAJA_CALLBACK_URL
+        self.token_refresh_margin = int(getattr(settings, "DARAJA_TOKEN_REFRESH_MARGIN", DEFAULT_TOKEN_REFRESH_MARGIN))
+        self._validate()
+        credentials = f"{self.base_url}:{self.consumer_key}".encode("utf-8")
+        self.token_cache_key = f"daraja:access-token:{hashlib.sha256(credentials).hexdigest()[:16]}"
+        self.oauth_url = f"{self.base_url}{OAUTH_PATH}"
+        self.stk_push_url = f"{self.base_url}{STK_PUSH_PATH}"
+        self.b2c_url = f"{self.base_url}{B2C_PATH}"
+        self._auth = HTTPBasicAuth(self.consumer_key, self.consumer_secret)
+        self._password_prefix = f"{self.business_shortcode}{self.passkey}"
+        # The Daraja password only changes with the timestamp, once a second.
+        self._password = ("", "")
+        self._token_headers = ("", {})
+        # Key order matches the Daraja documentation; None marks per-call values.
+        self._stk_push_template = {
+            "BusinessShortCode": self.business_shortcode,
+            "Password": None,
+            "Timestamp": None,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": None,
+            "PartyA": None,
+            "PartyB": self.business_shortcode,
+            "PhoneNumber": None,
+            "CallBackURL": self.callback_url,
+            "AccountReference": None,
+            "TransactionDesc": None,
+        }
+        self._b2c_template = {
+            "InitiatorName": getattr(settings, "DARAJA_INITIATOR_NAME", None),
+            "SecurityCredential": getattr(settings, "DARAJA_SECURITY_CREDENTIAL", None),
+            "OriginatorConversationID": None,
+            "CommandID": "BusinessPayment",
+            "Amount": None,
+            "PartyA": self.business_shortcode,
+            "PartyB": None,
+            "Remarks": None,
+            "QueueTimeOutURL": getattr(settings, "DARAJA_B2C_TIMEOUT_URL", None),
+            "ResultURL": getattr(settings, "DARAJA_B2C_RESULT_URL", None),
+            "Occasion": None,
+        }
+
+    def _validate(self):
+        if not self.base_url.startswith(("http://", "https://")):
+            raise ImproperlyConfigured(f"DARAJA_BASE_URL must be an http(s) URL, got {self.base_url!r}.")
+        if self.token_refresh_margin < 0:
+            raise ImproperlyConfigured("DARAJA_TOKEN_REFRESH_MARGIN must not be negative.")
+        missing = [name for name in REQUIRED_SETTINGS if not getattr(settings, name, None)]
+        if missing:
+            logger.warning("Daraja settings not configured: %s", ", ".join(missing))
 
     def get_access_token(self):
-        url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
-        response = requests.get(
-            url, auth=HTTPBasicAuth(self.consumer_key, self.consumer_secret),
-        )
+        """
+        Return an OAuth token, reusing the cached one until shortly before it
+        expires. When the token has to be refreshed only one caller per process,
+        and one process per shared cache, fetches it; the others wait for it.
+        """
+        token = self._cached_token()
+        if token:
+            return token
+        with _token_refresh_lock:
+            token = self._cached_token()
+            if token:
+                return token
+            lock_key = f"{self.token_cache_key}:lock"
+            owner = uuid.uuid4().hex
+            acquired = self._cache_call(cache.add, lock_key, owner, TOKEN_REFRESH_LOCK_TIMEOUT, default=True)
+            if not acquired:
+                token = self._wait_for_token()
+                if token:
+                    return token
+            try:
+                token, expires_in = self._fetch_access_token()
+                self._store_token(token, expires_in)
+            finally:
+                # A caller that gave up waiting, or whose lock timed out, must
+                # not release the lock another process now holds.
+                if acquired and self._cache_call(cache.get, lock_key) == owner:
+                    self._cache_call(cache.delete, lock_key)
+            return token
+
+    def _fetch_access_token(self):
+        response = self._send(http_client.get, "oauth", self.oauth_url, auth=self._auth)
         response.raise_for_status()
         data = response.json()
         token = data.get("access_token")
         if not token:
             raise Exception(f"Failed to get access token: {data}")
-        return token
+        return token, int(data.get("expires_in", 3599))
+
+    def _send(self, method, endpoint, url, **kwargs):
+        """
+        Make one call through the circuit breaker: refused with
+        ``CircuitOpenError`` while it is open, and counted as a failure when
+        the request errors out or Safaricom answers with a 5xx.
+        """
+        probe = daraja_breaker.before_call()
+        try:
+            with track_daraja_call(endpoint) as call:
+                call.response = response = method("daraja", url, endpoint=endpoint, **kwargs)
+        except Exception:
+            daraja_breaker.record_failure()
+            raise
+        _record_outcome(response, probe)
+        return response
+
+    def _cache_call(self, func, *args, default=None):
+        try:
+            return func(*args)
+        except Exception:
+            logger.warning("Daraja token cache unavailable, using local memory", exc_info=True)
+            return default
+
+    def _cached_token(self):
+        try:
+            return cache.get(self.token_cache_key)
+        except Exception:
+            logger.warning("Daraja token cache unavailable, using local memory", exc_info=True)
+        local = _local_tokens.get(self.token_cache_key)
+        if local and local[1] > time.monotonic():
+            return local[0]
+        return None
+
+    def _store_token(self, token, expires_in):
+        ttl = max(int(expires_in) - self.token_refresh_margin, 1)
+        try:
+            cache.set(self.token_cache_key, token, ttl)
+        except Exception:
+            logger.warning("Daraja token cache unavailable, using local memory", exc_info=True)
+            _local_tokens[self.token_cache_key] = (token, time.monotonic() + ttl)
+
+    def _wait_for_token(self):
+        deadline = time.monotonic() + TOKEN_REFRESH_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(TOKEN_WAIT_INTERVAL)
+            token = self._cached_token()
+            if token:
+                return token
+        return None
+
+    def _headers(self, access_token):
+        token, headers = self._token_headers
+        if token != access_token:
+            headers = {
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json",
+            }
+            self._token_headers = (access_token, headers)
+        return headers
+
+    def _timestamp_password(self):
+        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        cached_timestamp, password = self._password
+        if cached_timestamp != timestamp:
+            data_to_encode = f"{self._password_prefix}{timestamp}"
+            password = base64.b64encode(data_to_encode.encode("utf-8")).decode("utf-8")
+            self._password = (timestamp, password)
+        return timestamp, password
+
+    def _stk_push_payload(self, buyer_phone, amount, transaction_id, transaction_desc):
+        timestamp, password = self._timestamp_password()
+        payload = self._stk_push_template.copy()
+        payload["Password"] = password
+        payload["Timestamp"] = timestamp
+        payload["Amount"] = str(int(amount))
+        payload["PartyA"] = payload["PhoneNumber"] = buyer_phone
+        payload["AccountReference"] = transaction_id
+        payload["TransactionDesc"] = transaction_desc
+        return payload
+
+    def _b2c_payload(self, artisan_phone, amount, transaction_id, transaction_desc, occassion=""):
+        payload = self._b2c_template.copy()
+        # Safaricom echoes this back in the result callback, so the payout can
+        # be matched even if the request itself timed out.
+        payload["OriginatorConversationID"] = transaction_id
+        payload["Amount"] = str(int(amount))
+        payload["PartyB"] = artisan_phone
+        payload["Remarks"] = transaction_desc
+        payload["Occasion"] = occassion
+        return payload
 
     def stk_push(self, buyer_phone, amount, transaction_id, transaction_desc):
         access_token = self.get_access_token()
-        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-        data_to_encode = f"{self.business_shortcode}{self.passkey}{timestamp}"
-        password = base64.b64encode(data_to_encode.encode("utf-8")).decode("utf-8")
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-        }
-        payload = {
-            "BusinessShortCode": self.business_shortcode,
-            "Password": password,
-            "Timestamp": timestamp,
-            "TransactionType": "CustomerPayBillOnline",
-            "Amount": str(int(amount)),
-            "PartyA": buyer_phone,
-            "PartyB": self.business_shortcode,
-            "PhoneNumber": buyer_phone,
-            "CallBackURL": self.callback_url,
-            "AccountReference": transaction_id,
-            "TransactionDesc": transaction_desc,
-        }
-        url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
-        response = requests.post(url, headers=headers, json=payload)
-        print("Daraja raw response:", response.text)
+        payload = self._stk_push_payload(buyer_phone, amount, transaction_id, transaction_desc)
+        response = self._send(http_client.post, "stk_push", self.stk_push_url, headers=self._headers(access_token), json=payload)
         response.raise_for_status()
         return response.json()
 
     def b2c_payment(self, artisan_phone, amount, transaction_id, transaction_desc, occassion=""):
         access_token = self.get_access_token()
-    
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-        }
+        payload = self._b2c_payload(artisan_phone, amount, transaction_id, transaction_desc, occassion)
+        response = self._send(http_client.post, "b2c", self.b2c_url, headers=self._headers(access_token), json=payload)
+        response.raise_for_status()
+        return response.json()
 
-        payload = {
-            "InitiatorName": settings.DARAJA_INITIATOR_NAME,
-            "SecurityCredential": settings.DARAJA_SECURITY_CREDENTIAL,
-            "CommandID": "BusinessPayment",
-            "Amount": str(int(amount)),
-            "PartyA": self.business_shortcode,
-            "PartyB": artisan_phone,
-            "Remarks": transaction_desc,
-            "QueueTimeOutURL": settings.DARAJA_B2C_TIMEOUT_URL,
-            "ResultURL": settings.DARAJA_B2C_RESULT_URL,
-            "Occasion": occassion,
-        }
-        url = f"{self.base_url}/mpesa/b2c/v1/paymentrequest"
-        response = requests.post(url, headers=headers, json=payload)
-        print("Daraja B2C raw response:", response.text)
+
+class AsyncDarajaAPI(DarajaAPI):
+    """
+    Non-blocking counterpart of ``DarajaAPI`` for async views.
+
+    Requests go through the event loop's shared ``httpx.AsyncClient``. The
+    cached token is read with the async cache API; the rare refresh reuses the
+    synchronous single-flight path in a worker thread so it coordinates with
+    sync workers sharing the same cache.
+    """
+
+    async def _asend(self, method, endpoint, url, **kwargs):
+        probe = daraja_breaker.before_call()
+        try:
+            with track_daraja_call(endpoint) as call:
+                call.response = response = await method("daraja", url, endpoint=endpoint, **kwargs)
+        except Exception:
+            daraja_breaker.record_failure()
+            raise
+        _record_outcome(response, probe)
+        return response
+
+    async def get_access_token(self):
+        try:
+            token = await cache.aget(self.token_cache_key)
+        except Exception:
+            token = None
+        if token:
+            return token
+        return await sync_to_async(super().get_access_token, thread_sensitive=False)()
+
+    async def stk_push(self, buyer_phone, amount, transaction_id, transaction_desc):
+        access_token = await self.get_access_token()
+        payload = self._stk_push_payload(buyer_phone, amount, transaction_id, transaction_desc)
+        response = await self._asend(http_client.apost, "stk_push", self.stk_push_url, headers=self._headers(access_token), json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    async def b2c_payment(self, artisan_phone, amount, transaction_id, transaction_desc, occassion=""):
+        access_token = await self.get_access_token()
+        payload = self._b2c_payload(artisan_phone, amount, transaction_id, transaction_desc, occassion)
+        response = await self._asend(http_client.apost, "b2c", self.b2c_url, headers=self._headers(access_token), json=payload)
         response.raise_for_status()
-        return response.json()
\ No newline at end of file
+        return response.json()
+
+
+def _shared(cls):
+    client = _clients.get(cls)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(cls)
+            if client is None:
+                client = _clients[cls] = cls()
+    return client
+
+
+def get_daraja():
+    """Return the process-wide ``DarajaAPI``."""
+    return _shared(DarajaAPI)
+
+
+def get_async_daraja():
+    """Return the process-wide ``AsyncDarajaAPI``."""
+    return _shared(AsyncDarajaAPI)
+
+
+def reset_clients():
+    with _clients_lock:
+        _clients.clear()
+
+
+@receiver(setting_changed)
+def reset_daraja_clients(setting, **kwargs):
+    if setting.startswith("DARAJA_"):
+        reset_clients()
@@ -0,0 +1,134 @@
+"""
+A local HTTP server that plays the Daraja endpoints used by ``DarajaAPI``.
+
+Tests and benchmarks point ``DARAJA_BASE_URL`` at ``DarajaStubServer.url`` to
+exercise the real HTTP path without reaching Safaricom.
+"""
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+OAUTH_PATH = "/oauth/v1/generate"
+STK_PUSH_PATH = "/mpesa/stkpush/v1/processrequest"
+B2C_PATH = "/mpesa/b2c/v1/paymentrequest"
+
+
+class _DarajaStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _authorized(self):
+        return self.headers.get("Authorization", "").startswith("Bearer ")
+
+    def do_GET(self):
+        stub = self.server.stub
+        path = urlparse(self.path).path
+        stub.record(path)
+        if path != OAUTH_PATH:
+            return self._send(404, {"errorMessage": "Not found"})
+        time.sleep(stub.latency)
+        status = stub.status_codes.get(path, 200)
+        if status != 200:
+            return self._send(status, {"errorMessage": "Stubbed failure"})
+        self._send(200, {
+            "access_token": f"stub-token-{stub.next_id()}",
+            "expires_in": str(stub.expires_in),
+        })
+
+    def do_POST(self):
+        stub = self.server.stub
+        path = urlparse(self.path).path
+        stub.record(path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        stub.record_payload(path, body)
+        time.sleep(stub.latency)
+        status = stub.status_codes.get(path, 200)
+        if status != 200:
+            return self._send(status, {"errorMessage": "Stubbed failure"})
+        if not self._authorized():
+            return self._send(401, {"errorMessage": "Invalid Access Token"})
+        request_id = stub.next_id()
+        if path == STK_PUSH_PATH:
+            return self._send(200, {
+                "MerchantRequestID": f"stub-merchant-{request_id}",
+                "CheckoutRequestID": f"ws_CO_stub_{request_id}",
+                "ResponseCode": "0",
+                "ResponseDescription": "Success. Request accepted for processing",
+                "CustomerMessage": "Success. Request accepted for processing",
+            })
+        if path == B2C_PATH:
+            return self._send(200, {
+                "ConversationID": f"AG_stub_{request_id}",
+                "OriginatorConversationID": body.get("OriginatorConversationID") or f"stub-originator-{request_id}",
+                "ResponseCode": "0",
+                "ResponseDescription": "Accept the service request successfully.",
+            })
+        self._send(404, {"errorMessage": "Not found"})
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class DarajaStubServer:
+    def __init__(self, latency=0.0, expires_in=3599):
+        self.latency = latency
+        self.expires_in = expires_in
+        self.status_codes = {}
+        self.calls = Counter()
+        self.payloads = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_id(self):
+        with self._lock:
+            return next(self._ids)
+
+    def record(self, path):
+        with self._lock:
+            self.calls[path] += 1
+
+    def record_payload(self, path, body):
+        with self._lock:
+            self.payloads.append((path, body))
+
+    def start(self):
+        self._server = _StubHTTPServer(("127.0.0.1", 0), _DarajaStubHandler)
+        self._server.stub = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,280 @@
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION_CACHE_KEY = "nearby:artisan-geo-index:version"
+CATEGORIES_CACHE_KEY = "nearby:artisan-categories:{}"
+DEFAULT_INDEX_MAX_AGE = 300
+
+
+def category_mask(categories):
+    """Pack a collection of Inventory category values into a bitmask."""
+    from products.models import Inventory
+
+    mask = 0
+    for position, (value, _label) in enumerate(Inventory.CATEGORY_CHOICES):
+        if value in categories:
+            mask |= 1 << position
+    return mask
+
+
+class _IndexData:
+    """Immutable snapshot of the index: parallel arrays sorted by latitude."""
+
+    __slots__ = ("ids", "lats", "lons", "verified", "ratings", "categories")
+
+    @classmethod
+    def build(cls, ids, lats, lons, verified, ratings, categories):
+        order = np.argsort(np.asarray(lats, dtype=np.float64), kind="stable")
+        return cls(
+            np.asarray(ids, dtype=np.int64)[order],
+            np.asarray(lats, dtype=np.float64)[order],
+            np.asarray(lons, dtype=np.float64)[order],
+            np.asarray(verified, dtype=bool)[order],
+            np.asarray(ratings, dtype=np.float64)[order],
+            np.asarray(categories, dtype=np.int64)[order],
+        )
+
+    def __init__(self, ids, lats, lons, verified, ratings, categories):
+        self.ids = ids
+        self.lats = lats
+        self.lons = lons
+        self.verified = verified
+        self.ratings = ratings
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, artisan_id):
+        positions = np.flatnonzero(self.ids == artisan_id)
+        return int(positions[0]) if len(positions) else None
+
+
+class ArtisanGeoIndex:
+    """
+    Process-local index of artisan user id, location, verification status,
+    average rating and the categories the artisan sells.
+
+    The index is loaded on first use and patched in place by the signals in
+    ``api.signals``. Every patch bumps a version number in the Django cache; a
+    process that sees a version it did not produce itself reloads, so with a
+    shared cache all workers converge. ``NEARBY_INDEX_MAX_AGE`` bounds how long
+    a snapshot can live when the cache is process-local.
+
+    Category changes are frequent and touch one artisan, so they do not bump
+    the version. ``refresh_categories`` writes the artisan's categories to its
+    own cache entry, and category searches overlay entries written after the
+    snapshot was loaded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self._version = None
+        self._loaded_at = 0.0
+        self._loaded_wall = 0.0
+
+    @property
+    def max_age(self):
+        return getattr(settings, "NEARBY_INDEX_MAX_AGE", DEFAULT_INDEX_MAX_AGE)
+
+    def invalidate(self):
+        with self._lock:
+            self._data = None
+            self._version = None
+
+    def _current_version(self):
+        return cache.get(INDEX_VERSION_CACHE_KEY, 0)
+
+    def _bump_version(self):
+        try:
+            return cache.incr(INDEX_VERSION_CACHE_KEY)
+        except ValueError:
+            cache.add(INDEX_VERSION_CACHE_KEY, 1, timeout=None)
+            return None
+
+    def _load(self):
+        from users.models import ArtisanProfile
+        from products.models import Inventory
+
+        cache.add(INDEX_VERSION_CACHE_KEY, 0, timeout=None)
+        version = self._current_version()
+        loaded_wall = time.time()
+        rows = list(ArtisanProfile.objects.filter(
+            user__user_type='artisan',
+            latitude__isnull=False,
+            longitude__isnull=False,
+        ).values_list('user_id', 'latitude', 'longitude', 'is_verified', 'average_rating'))
+        sold = {}
+        for artisan_id, category in Inventory.objects.filter(
+            artisan__user_type='artisan',
+        ).values_list('artisan_id', 'category').distinct():
+            sold.setdefault(artisan_id, set()).add(category)
+        data = _IndexData.build(
+            [row[0] for row in rows],
+            [row[1] for row in rows],
+            [row[2] for row in rows],
+            [row[3] for row in rows],
+            [row[4] for row in rows],
+            [category_mask(sold.get(row[0], ())) for row in rows],
+        )
+        logger.info("Loaded artisan geo index with %s entries", len(data))
+        return data, version, loaded_wall
+
+    def _is_fresh(self, data, version):
+        return (
+            data is not None
+            and time.monotonic() - self._loaded_at < self.max_age
+            and self._current_version() == version
+        )
+
+    def _snapshot(self):
+        data, version = self._data, self._version
+        if self._is_fresh(data, version):
+            return data
+        with self._lock:
+            if self._is_fresh(self._data, self._version):
+                return self._data
+            data, version, loaded_wall = self._load()
+            self._data = data
+            self._version = version
+            self._loaded_at = time.monotonic()
+            self._loaded_wall = loaded_wall
+            return data
+
+    def candidates(self, min_lat, max_lat, lon_ranges, is_verified=None, min_rating=None, categories=None):
+        """
+        Return ``(ids, lats, lons, ratings)`` arrays for entries inside the
+        bounding box that pass the verification, rating and category filters.
+        """
+        data = self._snapshot()
+        loaded_wall = self._loaded_wall
+        start = np.searchsorted(data.lats, min_lat, side="left")
+        end = np.searchsorted(data.lats, max_lat, side="right")
+        lons = data.lons[start:end]
+        mask = np.zeros(len(lons), dtype=bool)
+        for min_lon, max_lon in lon_ranges:
+            mask |= (lons >= min_lon) & (lons <= max_lon)
+        if is_verified is not None:
+            mask &= data.verified[start:end] == is_verified
+        if min_rating is not None:
+            mask &= data.ratings[start:end] >= min_rating
+        if categories:
+            in_box = np.flatnonzero(mask)
+            masks = self._current_categories(
+                data.ids[start:end][in_box], data.categories[start:end][in_box], loaded_wall,
+            )
+            mask[in_box] = (masks & category_mask(categories)) != 0
+        return (
+            data.ids[start:end][mask],
+            data.lats[start:end][mask],
+            lons[mask],
+            data.ratings[start:end][mask],
+        )
+
+    def _patch(self, apply):
+        with self._lock:
+            data = self._data
+            version = self._bump_version()
+            if data is None:
+                return
+            if version is None or version != self._version + 1:
+                self._data = None
+                self._version = None
+                return
+            self._data = apply(data)
+            self._version = version
+
+    def upsert(self, artisan_id, lat, lon, is_verified=False, rating=0):
+        if lat is None or lon is None:
+            self.remove(artisan_id)
+            return
+
+        def apply(data):
+            position = data.position(artisan_id)
+            if position is None:
+                mask = self._load_category_mask(artisan_id)
+            else:
+                mask = int(data.categories[position])
+            keep = data.ids != artisan_id
+            lats = data.lats[keep]
+            insert_at = np.searchsorted(lats, float(lat))
+            return _IndexData(
+                np.insert(data.ids[keep], insert_at, artisan_id),
+                np.insert(lats, insert_at, float(lat)),
+                np.insert(data.lons[keep], insert_at, float(lon)),
+                np.insert(data.verified[keep], insert_at, bool(is_verified)),
+                np.insert(data.ratings[keep], insert_at, float(rating)),
+                np.insert(data.categories[keep], insert_at, mask),
+            )
+
+        self._patch(apply)
+
+    def _current_categories(self, ids, masks, loaded_wall):
+        """
+        Return ``masks`` with the per-artisan entries written by
+        ``refresh_categories`` since ``loaded_wall`` applied.
+        """
+        if not len(ids):
+            return masks
+        entries = cache.get_many([CATEGORIES_CACHE_KEY.format(artisan_id) for artisan_id in ids.tolist()])
+        if not entries:
+            return masks
+        current = masks.copy()
+        for index, artisan_id in enumerate(ids.tolist()):
+            entry = entries.get(CATEGORIES_CACHE_KEY.format(artisan_id))
+            if entry is not None and entry[1] >= loaded_wall:
+                current[index] = entry[0]
+        return current
+
+    def refresh_categories(self, artisan_id):
+        """
+        Reload one artisan's categories and publish them in its cache entry,
+        which expires once every process has reloaded since.
+        """
+        written_at = time.time()
+        mask = self._load_category_mask(artisan_id)
+        cache.set(CATEGORIES_CACHE_KEY.format(artisan_id), (mask, written_at), timeout=self.max_age)
+        with self._lock:
+            data = self._data
+            position = None if data is None else data.position(artisan_id)
+            if position is None:
+                return
+            masks = data.categories.copy()
+            masks[position] = mask
+            self._data = _IndexData(data.ids, data.lats, data.lons, data.verified, data.ratings, masks)
+
+    def remove(self, artisan_id):
+        def apply(data):
+            keep = data.ids != artisan_id
+            return _IndexData(
+                data.ids[keep], data.lats[keep], data.lons[keep],
+                data.verified[keep], data.ratings[keep], data.categories[keep],
+            )
+
+        self._patch(apply)
+
+    def _load_category_mask(self, artisan_id):
+        from products.models import Inventory
+
+        return category_mask(set(
+            Inventory.objects.filter(artisan_id=artisan_id).values_list('category', flat=True)
+        ))
+
+    @property
+    def is_loaded(self):
+        return self._data is not None
+
+    def __contains__(self, artisan_id):
+        data = self._data
+        return data is not None and data.position(artisan_id) is not None
+
+
+artisan_geo_index = ArtisanGeoIndex()
@@ -0,0 +1,147 @@
+"""
+Shared outbound HTTP client.
+
+Each upstream service gets one ``requests.Session`` whose adapter keeps a
+keep-alive connection pool per host. Timeouts and retry policy come from the
+``OUTBOUND_HTTP`` setting, per service with optional per-endpoint overrides::
+
+    OUTBOUND_HTTP = {
+        "daraja": {
+            "connect_timeout": 3.05,
+            "read_timeout": 30,
+            "endpoints": {"oauth": {"read_timeout": 10}},
+        },
+    }
+
+Only idempotent methods are retried after a response or read error; any
+method is retried when the connection could not be established.
+
+Async callers use ``arequest``/``aget``/``apost``, backed by one
+``httpx.AsyncClient`` per service and event loop with the same pool size and
+timeouts. The async transport only retries failed connection attempts.
+"""
+import asyncio
+import threading
+import weakref
+
+import httpx
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_SERVICE_CONFIG = {
+    "connect_timeout": 3.05,
+    "read_timeout": 30,
+    "retries": 2,
+    "backoff_factor": 0.5,
+    "pool_connections": 4,
+    "pool_maxsize": 10,
+    "async_max_connections": 100,
+}
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def service_config(service, endpoint=None):
+    config = {**DEFAULT_SERVICE_CONFIG, **getattr(settings, "OUTBOUND_HTTP", {}).get(service, {})}
+    overrides = config.pop("endpoints", {})
+    if endpoint is not None:
+        config.update(overrides.get(endpoint, {}))
+    return config
+
+
+def get_session(service):
+    session = _sessions.get(service)
+    if session is not None:
+        return session
+    with _sessions_lock:
+        session = _sessions.get(service)
+        if session is None:
+            session = _build_session(service_config(service))
+            _sessions[service] = session
+        return session
+
+
+def _build_session(config):
+    retry = Retry(
+        total=config["retries"],
+        backoff_factor=config["backoff_factor"],
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=IDEMPOTENT_METHODS,
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=config["pool_connections"],
+        pool_maxsize=config["pool_maxsize"],
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def request(service, method, url, endpoint=None, **kwargs):
+    config = service_config(service, endpoint)
+    kwargs.setdefault("timeout", (config["connect_timeout"], config["read_timeout"]))
+    return get_session(service).request(method, url, **kwargs)
+
+
+def get(service, url, endpoint=None, **kwargs):
+    return request(service, "GET", url, endpoint=endpoint, **kwargs)
+
+
+def post(service, url, endpoint=None, **kwargs):
+    return request(service, "POST", url, endpoint=endpoint, **kwargs)
+
+
+def get_async_client(service):
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(service)
+    if client is None:
+        config = service_config(service)
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=config["async_max_connections"],
+                max_keepalive_connections=config["async_max_connections"],
+            ),
+            transport=httpx.AsyncHTTPTransport(retries=config["retries"]),
+        )
+        clients[service] = client
+    return client
+
+
+async def arequest(service, method, url, endpoint=None, **kwargs):
+    config = service_config(service, endpoint)
+    kwargs.setdefault("timeout", httpx.Timeout(config["read_timeout"], connect=config["connect_timeout"]))
+    return await get_async_client(service).request(method, url, **kwargs)
+
+
+async def aget(service, url, endpoint=None, **kwargs):
+    return await arequest(service, "GET", url, endpoint=endpoint, **kwargs)
+
+
+async def apost(service, url, endpoint=None, **kwargs):
+    return await arequest(service, "POST", url, endpoint=endpoint, **kwargs)
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+    _async_clients.clear()
+
+
+@receiver(setting_changed)
+def reset_sessions(setting, **kwargs):
+    if setting == "OUTBOUND_HTTP":
+        close_sessions()
@@ -0,0 +1,173 @@
+import base64
+import binascii
+import heapq
+import json
+from decimal import Decimal
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+
+from users.models import User
+from .geo_index import artisan_geo_index
+from .utils import bounding_box, geohash_cells
+
+NEARBY_INITIAL_RING_KM = 5
+NEARBY_DEFAULT_PAGE_SIZE = 20
+NEARBY_DEFAULT_RATING_WEIGHT = 0.5
+
+ORDER_DISTANCE = 'distance'
+ORDER_RATING = 'rating'
+ORDER_RELEVANCE = 'relevance'
+ORDERING_CHOICES = [ORDER_DISTANCE, ORDER_RATING, ORDER_RELEVANCE]
+
+
+def encode_cursor(ordering, sort_key, artisan_id):
+    raw = json.dumps([ordering, list(sort_key), artisan_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor, ordering):
+    try:
+        cursor_ordering, sort_key, artisan_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        position = (tuple(float(value) for value in sort_key), int(artisan_id))
+    except (ValueError, TypeError, UnicodeError, binascii.Error):
+        raise ValueError("Invalid cursor.")
+    if cursor_ordering != ordering:
+        raise ValueError("Cursor does not match the requested ordering.")
+    return position
+
+
+def _candidates_from_db(min_lat, max_lat, lon_ranges, is_verified=None, min_rating=None, categories=None):
+    """
+    Load the artisans inside the bounding box, narrowed by geohash cell and
+    the (latitude, longitude) index, with the filters applied in SQL.
+    """
+    cell_filter = Q()
+    for cell in geohash_cells(min_lat, max_lat, lon_ranges):
+        cell_filter |= Q(artisanprofile__geohash__startswith=cell)
+    lon_filter = Q()
+    for min_lon, max_lon in lon_ranges:
+        lon_filter |= Q(artisanprofile__longitude__range=(min_lon, max_lon))
+
+    queryset = User.objects.filter(
+        cell_filter,
+        lon_filter,
+        user_type='artisan',
+        artisanprofile__latitude__range=(min_lat, max_lat),
+    )
+    if is_verified is not None:
+        queryset = queryset.filter(artisanprofile__is_verified=is_verified)
+    if min_rating is not None:
+        queryset = queryset.filter(artisanprofile__average_rating__gte=min_rating)
+    if categories:
+        queryset = queryset.filter(inventory__category__in=categories).distinct()
+
+    rows = list(queryset.values_list(
+        'id', 'artisanprofile__latitude', 'artisanprofile__longitude', 'artisanprofile__average_rating',
+    ))
+    return (
+        np.array([row[0] for row in rows], dtype=np.int64),
+        np.array([row[1] for row in rows], dtype=np.float64),
+        np.array([row[2] for row in rows], dtype=np.float64),
+        np.array([row[3] for row in rows], dtype=np.float64),
+    )
+
+
+def fetch_candidates(lat, lon, radius, **filters):
+    """
+    Return ``(ids, lats, lons, ratings)`` arrays for artisans inside the box of
+    ``radius`` km that match ``filters``.
+    """
+    min_lat, max_lat, lon_ranges = bounding_box(lat, lon, radius)
+    if getattr(settings, 'NEARBY_ARTISANS_USE_INDEX', True):
+        return artisan_geo_index.candidates(min_lat, max_lat, lon_ranges, **filters)
+    return _candidates_from_db(min_lat, max_lat, lon_ranges, **filters)
+
+
+def _sort_keys(ordering, distances, ratings, radius):
+    if ordering == ORDER_RATING:
+        return zip((-ratings).tolist(), distances.tolist())
+    if ordering == ORDER_RELEVANCE:
+        weight = getattr(settings, 'NEARBY_RATING_WEIGHT', NEARBY_DEFAULT_RATING_WEIGHT)
+        closeness = 1 - distances / radius if radius else np.ones_like(distances)
+        score = weight * ratings / 5 + (1 - weight) * closeness
+        return zip((-score).tolist(), distances.tolist())
+    return zip(distances.tolist())
+
+
+def _matches(lat, lon, radius, ring, ordering, after, filters):
+    """
+    Return ``(sort_key, id, distance, lat, lon, rating)`` tuples for artisans
+    within ``ring`` km that sort after the ``after`` cursor position.
+    """
+    from .utils import haversine_batch
+
+    ids, lats, lons, ratings = fetch_candidates(lat, lon, ring, **filters)
+    if not len(ids):
+        return []
+    distances = haversine_batch(lat, lon, lats, lons)
+    inside = distances <= ring
+    ids, lats, lons, ratings, distances = ids[inside], lats[inside], lons[inside], ratings[inside], distances[inside]
+    return [
+        match
+        for match in zip(
+            _sort_keys(ordering, distances, ratings, radius), ids.tolist(), distances.tolist(),
+            lats.tolist(), lons.tolist(), ratings.tolist(),
+        )
+        if after is None or match[:2] > after
+    ]
+
+
+def search_nearby(lat, lon, radius, limit=None, after=None, ordering=ORDER_DISTANCE, **filters):
+    """
+    Return ``(matches, next_cursor)`` for artisans within ``radius`` km that
+    match ``filters`` (``is_verified``, ``min_rating``, ``categories``), in
+    ``ordering`` order. Each match is a
+    ``(sort_key, id, distance, lat, lon, rating)`` tuple.
+
+    With a ``limit`` only the first ``limit`` artisans after the ``after``
+    cursor position are selected with a heap, without sorting every match.
+    When ordering by distance the search starts from a small ring and doubles
+    it until enough artisans are found.
+    """
+    if limit is None:
+        matches = _matches(lat, lon, radius, radius, ordering, after, filters)
+        return sorted(matches), None
+
+    if ordering == ORDER_DISTANCE:
+        ring = min(radius, NEARBY_INITIAL_RING_KM + (after[0][0] if after else 0))
+    else:
+        ring = radius
+    while True:
+        matches = _matches(lat, lon, radius, ring, ordering, after, filters)
+        if len(matches) > limit or ring >= radius:
+            break
+        ring = min(radius, ring * 2)
+
+    page = heapq.nsmallest(limit + 1, matches)
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = encode_cursor(ordering, *page[-1][:2])
+    return page, next_cursor
+
+
+def artisan_results(matches):
+    """Build the response rows, loading names only for the artisans returned."""
+    users = User.objects.only('id', 'first_name', 'last_name').in_bulk([match[1] for match in matches])
+    results = []
+    for _sort_key, artisan_id, dist, artisan_lat, artisan_lon, rating in matches:
+        artisan = users.get(artisan_id)
+        if artisan is None:
+            continue
+        results.append({
+            "id": artisan_id,
+            "first_name": artisan.first_name,
+            "last_name": artisan.last_name,
+            "distance_km": round(dist, 2),
+            "average_rating": Decimal(f"{rating:.1f}"),
+            "latitude": Decimal(f"{artisan_lat:.6f}"),
+            "longitude": Decimal(f"{artisan_lon:.6f}"),
+        })
+    return results
@@ -0,0 +1,159 @@
+"""
+Structured logging and latency tracking for calls to Safaricom.
+
+Every Daraja call is timed and recorded in ``payment_latency``, a process-local
+histogram keyed by endpoint and result code. A one-line summary is logged at
+INFO on the ``payments.daraja`` logger and the raw response body only at DEBUG.
+``SamplingFilter`` thins out INFO and DEBUG records, and ``QueuedStreamHandler``
+hands records to a background thread so the request thread never blocks on
+log I/O.
+"""
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+
+logger = logging.getLogger("payments.daraja")
+
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a ``rate`` fraction of records below WARNING; always keep the rest."""
+
+    def __init__(self, rate=1.0, name=""):
+        super().__init__(name)
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        return random.random() < self.rate
+
+
+class QueuedStreamHandler(QueueHandler):
+    """
+    Queue records and write them to ``stream`` from a listener thread.
+    ``flush()`` blocks until every queued record has been written.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__(queue.Queue(-1))
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.listener = QueueListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        self._stopped = False
+
+    def flush(self):
+        self.queue.join()
+        self.target.flush()
+
+    def close(self):
+        # logging.shutdown() closes every handler at exit, draining the queue.
+        if not self._stopped:
+            self._stopped = True
+            self.listener.stop()
+        super().close()
+
+
+class PaymentLatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, endpoint, result_code, duration_ms):
+        with self._lock:
+            series = self._series.setdefault((endpoint, str(result_code)), {
+                "counts": [0] * (len(self.buckets) + 1),
+                "count": 0,
+                "sum_ms": 0.0,
+            })
+            position = next(
+                (index for index, bound in enumerate(self.buckets) if duration_ms <= bound),
+                len(self.buckets),
+            )
+            series["counts"][position] += 1
+            series["count"] += 1
+            series["sum_ms"] += duration_ms
+
+    def snapshot(self):
+        labels = [f"le_{bound}" for bound in self.buckets] + ["le_inf"]
+        with self._lock:
+            return [
+                {
+                    "endpoint": endpoint,
+                    "result_code": result_code,
+                    "count": series["count"],
+                    "sum_ms": round(series["sum_ms"], 3),
+                    "buckets": dict(zip(labels, series["counts"])),
+                }
+                for (endpoint, result_code), series in sorted(self._series.items())
+            ]
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+payment_latency = PaymentLatencyHistogram()
+
+
+class _DarajaCall:
+    __slots__ = ("endpoint", "response")
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.response = None
+
+
+def _result_code(response):
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    if isinstance(body, dict):
+        for key in ("ResponseCode", "errorCode", "ResultCode"):
+            if key in body:
+                return body[key]
+        if "access_token" in body:
+            return "0"
+    return f"http_{response.status_code}"
+
+
+@contextmanager
+def track_daraja_call(endpoint):
+    """
+    Time the Daraja call made inside the block. Assign the response to the
+    yielded object's ``response`` so its result code is recorded.
+    """
+    call = _DarajaCall(endpoint)
+    started = time.perf_counter()
+    try:
+        yield call
+    except Exception as exc:
+        duration_ms = (time.perf_counter() - started) * 1000
+        payment_latency.observe(endpoint, type(exc).__name__, duration_ms)
+        logger.warning(
+            "daraja call failed endpoint=%s error=%s duration_ms=%.1f",
+            endpoint, type(exc).__name__, duration_ms,
+            extra={"endpoint": endpoint, "result_code": type(exc).__name__, "duration_ms": duration_ms},
+        )
+        raise
+    duration_ms = (time.perf_counter() - started) * 1000
+    response = call.response
+    result_code = _result_code(response) if response is not None else "unknown"
+    payment_latency.observe(endpoint, result_code, duration_ms)
+    level = logging.INFO if response is None or response.status_code < 400 else logging.WARNING
+    logger.log(
+        level,
+        "daraja call endpoint=%s http_status=%s result_code=%s duration_ms=%.1f",
+        endpoint, getattr(response, "status_code", None), result_code, duration_ms,
+        extra={"endpoint": endpoint, "result_code": result_code, "duration_ms": duration_ms},
+    )
+    if response is not None and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("daraja raw response endpoint=%s body=%s", endpoint, response.text)
@@ -5,6 +5,7 @@ from django.contrib.auth.password_validation import validate_password
 from django.utils import timezone
 from datetime import timedelta
 from users.utils import send_otp_email
+from users.services import LoginError, login_user
 from rest_framework import serializers
 from rest_framework.validators import UniqueValidator
 from rest_framework.authtoken.models import Token
@@ -20,6 +21,8 @@ from orders.models import Order, Rating, OrderStatus, CustomDesignRequest,Artisa
 from orders.models import Order
 
 from .daraja import DarajaAPI
+from . import http_client
+from .nearby import decode_cursor, ORDERING_CHOICES, ORDER_DISTANCE
 from payments.models import Payment
 from orders.models import Order
 
@@ -138,7 +141,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
                 profile, _ = ArtisanProfile.objects.get_or_create(user=user)
 
         user.generate_otp()
-        send_otp_email(user.email, user.otp, purpose='verify')
+        send_otp_email(user.email, user.otp, purpose='verify', expires_at=user.otp_exp)
         return user
 
    
@@ -159,17 +162,10 @@ class LoginSerializer(serializers.Serializer):
             raise serializers.ValidationError({"non_field_errors": "Must provide password."})
 
         try:
-            if email:
-                user = User.objects.get(email=email)
-            else:
-                user = User.objects.get(phone_number=phone_number)
-        except User.DoesNotExist:
-            raise serializers.ValidationError({"non_field_errors": "Invalid email/phone or password."})
-
-        if not user.is_active or not user.check_password(password):
-            raise serializers.ValidationError({"non_field_errors": "Invalid email/phone or password."})
+            user, token = login_user(password, email=email, phone_number=phone_number)
+        except LoginError as e:
+            raise serializers.ValidationError({"non_field_errors": str(e)})
 
-        token, _ = Token.objects.get_or_create(user=user)
         data["user"] = user
         data["token"] = token.key
         return data
@@ -205,7 +201,7 @@ class ForgotPasswordSerializer(serializers.Serializer):
             raise serializers.ValidationError("User with this email does not exist.")
         try:
             user.generate_otp()
-            send_otp_email(user.email, user.otp, purpose='reset')
+            send_otp_email(user.email, user.otp, purpose='reset', expires_at=user.otp_exp)
         except Exception as e:
             raise serializers.ValidationError(f"Failed to send OTP email: {str(e)}")
         return value
@@ -241,7 +237,7 @@ class ResendOTPSerializer(serializers.Serializer):
         if user.is_active:
             raise serializers.ValidationError({"email": "This account is already verified."})
         user.generate_otp()
-        send_otp_email(user.email, user.otp, purpose='verify')
+        send_otp_email(user.email, user.otp, purpose='verify', expires_at=user.otp_exp)
         return {"message": "A new OTP has been sent to your email."}
 
 class PasswordResetSerializer(serializers.Serializer):
@@ -328,7 +324,7 @@ class UserSerializer(serializers.ModelSerializer):
             'limit': 1,
         }
         try:
-            response = requests.get(url, params=params, timeout=10)
+            response = http_client.get("locationiq", url, params=params)
             response.raise_for_status()
             data = response.json()
             if data:
@@ -341,6 +337,24 @@ class NearbyArtisanSearchSerializer(serializers.Serializer):
     latitude = serializers.DecimalField(max_digits=9, decimal_places=6)
     longitude = serializers.DecimalField(max_digits=9, decimal_places=6)
     radius = serializers.DecimalField(max_digits=5, decimal_places=2, required=False, default=50)  
+    limit = serializers.IntegerField(required=False, min_value=1, max_value=100)
+    cursor = serializers.CharField(required=False)
+    is_verified = serializers.BooleanField(required=False)
+    min_rating = serializers.DecimalField(max_digits=2, decimal_places=1, min_value=0, max_value=5, required=False)
+    categories = serializers.ListField(
+        child=serializers.ChoiceField(choices=Inventory.CATEGORY_CHOICES),
+        required=False,
+        allow_empty=False,
+    )
+    ordering = serializers.ChoiceField(choices=ORDERING_CHOICES, required=False, default=ORDER_DISTANCE)
+
+    def validate(self, data):
+        if 'cursor' in data:
+            try:
+                data['cursor'] = decode_cursor(data['cursor'], data['ordering'])
+            except ValueError as exc:
+                raise serializers.ValidationError({"cursor": str(exc)})
+        return data
 
 
 class ShoppingCartSerializer(serializers.ModelSerializer):
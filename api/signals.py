@@ -0,0 +1,56 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from users.models import User, ArtisanProfile
+from products.models import Inventory
+from .geo_index import artisan_geo_index
+
+INDEXED_PROFILE_FIELDS = {'latitude', 'longitude', 'is_verified', 'average_rating'}
+
+
+@receiver(post_save, sender=ArtisanProfile)
+def update_artisan_geo_index(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not INDEXED_PROFILE_FIELDS & set(update_fields):
+        return
+    if not User.objects.filter(pk=instance.user_id, user_type=User.ARTISAN).exists():
+        return
+    transaction.on_commit(lambda: artisan_geo_index.upsert(
+        instance.user_id,
+        instance.latitude,
+        instance.longitude,
+        is_verified=instance.is_verified,
+        rating=instance.average_rating,
+    ))
+
+
+@receiver(post_delete, sender=ArtisanProfile)
+def remove_from_artisan_geo_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: artisan_geo_index.remove(instance.user_id))
+
+
+@receiver(post_save, sender=User)
+def sync_user_type_with_geo_index(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'user_type' not in update_fields:
+        return
+    if instance.user_type != User.ARTISAN:
+        if instance.id in artisan_geo_index:
+            transaction.on_commit(lambda: artisan_geo_index.remove(instance.id))
+        return
+    if not artisan_geo_index.is_loaded or instance.id in artisan_geo_index:
+        return
+    profile = ArtisanProfile.objects.filter(user_id=instance.id).first()
+    if profile is not None:
+        transaction.on_commit(lambda: artisan_geo_index.upsert(
+            instance.id,
+            profile.latitude,
+            profile.longitude,
+            is_verified=profile.is_verified,
+            rating=profile.average_rating,
+        ))
+
+
+@receiver(post_save, sender=Inventory)
+@receiver(post_delete, sender=Inventory)
+def update_artisan_categories(sender, instance, **kwargs):
+    artisan_id = instance.artisan_id
+    transaction.on_commit(lambda: artisan_geo_index.refresh_categories(artisan_id))
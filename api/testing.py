@@ -0,0 +1,39 @@
+"""
+Test helpers for code that calls Daraja.
+"""
+from django.core.cache import cache
+from django.test import override_settings
+
+from .daraja_stub import DarajaStubServer
+
+
+class DarajaStubMixin:
+    """
+    Start one ``DarajaStubServer`` per test class and point ``DARAJA_BASE_URL``
+    at it for every test, with the cache, call counts and stubbed failures
+    cleared. ``daraja_settings`` are overridden alongside the base URL.
+    """
+    stub_latency = 0.0
+    daraja_settings = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = DarajaStubServer(latency=cls.stub_latency).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.stub.calls.clear()
+        self.stub.latency = self.stub_latency
+        self.stub.status_codes.clear()
+        self.addCleanup(self.stub.status_codes.clear)
+        override = override_settings(DARAJA_BASE_URL=self.stub.url, **self.daraja_settings)
+        override.enable()
+        self.addCleanup(override.disable)
@@ -26,6 +26,34 @@ from users.models import User, ArtisanProfile, ArtisanPortfolio, PortfolioImage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from unittest.mock import patch
 from decimal import Decimal
+from django.db import connection
+from django.test import override_settings
+from api.geo_index import artisan_geo_index, ArtisanGeoIndex, INDEX_VERSION_CACHE_KEY
+from products.models import Inventory
+from django.core.cache import cache
+from concurrent.futures import ThreadPoolExecutor
+import time
+from api import http_client
+from api.daraja import AsyncDarajaAPI, get_daraja, get_async_daraja
+import base64
+from django.core.exceptions import ImproperlyConfigured
+import logging
+from io import StringIO
+from api.payment_logging import payment_latency, SamplingFilter, QueuedStreamHandler
+from api.circuit_breaker import daraja_breaker, CircuitOpenError
+from api.checks import check_daraja_cache
+from payments.models import Payment, PaymentJob, Payout
+from payments.transitions import confirm_delivery
+from payments import jobs as payment_jobs
+import asyncio
+import subprocess
+from django.conf import settings
+import sys
+from api.daraja_stub import OAUTH_PATH, STK_PUSH_PATH, B2C_PATH
+from api.testing import DarajaStubMixin
+from payments.testing import PaymentFixturesMixin
+from django.test.utils import CaptureQueriesContext
+from api.utils import haversine, haversine_batch, geohash_encode, bounding_box, geohash_cells
 
 
 def test_get_access_token():
@@ -259,6 +287,7 @@ class UserRegistrationViewTest(APITestCase):
 
 class LoginViewTest(APITestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.url = reverse("login")
         self.user = User.objects.create(
@@ -291,9 +320,32 @@ class LoginViewTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn("non_field_errors", response.data)
 
+    def test_login_query_count(self):
+        data = {"email": "test@example.com", "password": "TestPassword123"}
+        # User and token lookup, token insert (in a savepoint), last_login update.
+        with self.assertNumQueries(5):
+            first = self.client.post(self.url, data, format="json")
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+        # A repeat login within LAST_LOGIN_UPDATE_INTERVAL is one SELECT.
+        with self.assertNumQueries(1):
+            second = self.client.post(self.url, {"phone_number": "1234567890", "password": "TestPassword123"}, format="json")
+        self.assertEqual(second.data["token"], first.data["token"])
+
+    def test_last_login_refreshed_after_interval(self):
+        data = {"email": "test@example.com", "password": "TestPassword123"}
+        self.client.post(self.url, data, format="json")
+        User.objects.filter(pk=self.user.pk).update(last_login=timezone.now() - timedelta(hours=1))
+        with self.assertNumQueries(2):
+            self.client.post(self.url, data, format="json")
+        self.user.refresh_from_db()
+        self.assertGreater(self.user.last_login, timezone.now() - timedelta(minutes=1))
+
 
 class OTPVerificationViewTest(APITestCase):
     def setUp(self):
+        cache.clear()
         self.client = APIClient()
         self.url = reverse("verify-otp")  
         self.user = User.objects.create(
@@ -336,6 +388,7 @@ class OTPVerificationViewTest(APITestCase):
 
 class NearbyArtisansViewTests(TestCase):
     def setUp(self):
+        artisan_geo_index.invalidate()
         self.client = APIClient()
         self.artisan = User.objects.create(
             email="wanjikumwangi@gmail.com",
@@ -380,6 +433,298 @@ class NearbyArtisansViewTests(TestCase):
         response = self.client.post(reverse('nearby-artisans'), data, format='json')
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data['artisans']), 0)
+    def test_artisan_profile_geohash_synced_on_save(self):
+        profile = self.artisan.artisanprofile
+        self.assertEqual(profile.geohash, geohash_encode(-1.286389, 36.817223))
+        profile.latitude = Decimal('-4.043477')
+        profile.longitude = Decimal('39.668206')
+        profile.save(update_fields=['latitude', 'longitude'])
+        profile.refresh_from_db()
+        self.assertEqual(profile.geohash, geohash_encode(-4.043477, 39.668206))
+        profile.latitude = None
+        profile.save()
+        self.assertIsNone(profile.geohash)
+    def test_nearby_artisans_across_cell_boundary(self):
+        neighbour = User.objects.create(
+            email="akinyiotieno@gmail.com",
+            user_type="artisan",
+            first_name="Akinyi",
+            last_name="Otieno",
+            phone_number="0711111111"
+        )
+        ArtisanProfile.objects.create(user=neighbour, latitude=-1.310000, longitude=36.830000)
+        far_away = User.objects.create(
+            email="chebetkoech@gmail.com",
+            user_type="artisan",
+            first_name="Chebet",
+            last_name="Koech",
+            phone_number="0722222222"
+        )
+        ArtisanProfile.objects.create(user=far_away, latitude=-4.043477, longitude=39.668206)
+        data = {"latitude": -1.300000, "longitude": 36.820000, "radius": 5}
+        response = self.client.post(reverse('nearby-artisans'), data, format='json')
+        self.assertEqual(response.status_code, 200)
+        ids = [artisan['id'] for artisan in response.data['artisans']]
+        self.assertEqual(sorted(ids), sorted([self.artisan.id, neighbour.id]))
+    @override_settings(NEARBY_ARTISANS_USE_INDEX=False)
+    def test_nearby_artisans_prefilters_bounding_box_in_sql(self):
+        data = {"latitude": -1.286389, "longitude": 36.817223, "radius": 10}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('nearby-artisans'), data, format='json')
+        self.assertEqual(len(response.data['artisans']), 1)
+        sql = queries.captured_queries[0]['sql']
+        self.assertIn('"users_artisanprofile"."latitude" BETWEEN', sql)
+        self.assertIn('"users_artisanprofile"."longitude" BETWEEN', sql)
+    def test_nearby_artisans_across_antimeridian(self):
+        fiji = User.objects.create(
+            email="mereanaivalu@gmail.com",
+            user_type="artisan",
+            first_name="Merea",
+            last_name="Naivalu",
+            phone_number="0733333333"
+        )
+        ArtisanProfile.objects.create(user=fiji, latitude=-16.500000, longitude=179.950000)
+        data = {"latitude": -16.500000, "longitude": -179.950000, "radius": 20}
+        response = self.client.post(reverse('nearby-artisans'), data, format='json')
+        self.assertEqual([artisan['id'] for artisan in response.data['artisans']], [fiji.id])
+
+
+    def test_nearby_artisans_uses_index_for_distance_pass(self):
+        data = {"latitude": -1.286389, "longitude": 36.817223, "radius": 10}
+        self.client.post(reverse('nearby-artisans'), data, format='json')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('nearby-artisans'), data, format='json')
+        self.assertEqual([artisan['id'] for artisan in response.data['artisans']], [self.artisan.id])
+        self.assertEqual(response.data['artisans'][0]['latitude'], Decimal('-1.286389'))
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('users_artisanprofile', queries[0]['sql'])
+    def test_geo_index_patched_on_profile_save_and_delete(self):
+        data = {"latitude": -1.286389, "longitude": 36.817223, "radius": 10}
+        self.client.post(reverse('nearby-artisans'), data, format='json')
+        newcomer = User.objects.create(
+            email="wambuikariuki@gmail.com",
+            user_type="artisan",
+            first_name="Wambui",
+            last_name="Kariuki",
+            phone_number="0744444444"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = ArtisanProfile.objects.create(user=newcomer, latitude=-1.290000, longitude=36.820000)
+        with self.assertNumQueries(1):
+            response = self.client.post(reverse('nearby-artisans'), data, format='json')
+        self.assertIn(newcomer.id, [artisan['id'] for artisan in response.data['artisans']])
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.delete()
+        self.assertNotIn(newcomer.id, artisan_geo_index)
+        response = self.client.post(reverse('nearby-artisans'), data, format='json')
+        self.assertNotIn(newcomer.id, [artisan['id'] for artisan in response.data['artisans']])
+
+    def test_geo_index_follows_user_type_changes(self):
+        data = {"latitude": -1.286389, "longitude": 36.817223, "radius": 10}
+        self.client.post(reverse('nearby-artisans'), data, format='json')
+        convert = User.objects.create(
+            email="otienoachieng@gmail.com",
+            user_type="buyer",
+            first_name="Otieno",
+            last_name="Achieng",
+            phone_number="0733333333"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            ArtisanProfile.objects.create(user=convert, latitude=-1.290000, longitude=36.820000)
+        self.assertNotIn(convert.id, artisan_geo_index)
+        convert.user_type = "artisan"
+        with self.captureOnCommitCallbacks(execute=True):
+            convert.save()
+        self.assertIn(convert.id, artisan_geo_index)
+        convert.user_type = "buyer"
+        with self.captureOnCommitCallbacks(execute=True):
+            convert.save()
+        self.assertNotIn(convert.id, artisan_geo_index)
+
+
+class NearbyArtisansPaginationTests(TestCase):
+    def setUp(self):
+        artisan_geo_index.invalidate()
+        self.client = APIClient()
+        self.artisans = []
+        for index, offset in enumerate([0.01, 0.03, 0.05, 0.2, 0.4]):
+            artisan = User.objects.create(
+                email=f"fundi{index}@gmail.com",
+                user_type="artisan",
+                first_name="Fundi",
+                last_name=str(index),
+                phone_number=f"070000000{index}"
+            )
+            ArtisanProfile.objects.create(user=artisan, latitude=-1.286389 + offset, longitude=36.817223)
+            self.artisans.append(artisan)
+
+    def search(self, **extra):
+        data = {"latitude": -1.286389, "longitude": 36.817223, "radius": 100, **extra}
+        return self.client.post(reverse('nearby-artisans'), data, format='json')
+
+    def test_unbounded_search_has_no_cursor(self):
+        response = self.search()
+        self.assertEqual(len(response.data['artisans']), 5)
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_k_nearest_pages_follow_cursor(self):
+        seen = []
+        response = self.search(limit=2)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(artisan['id'] for artisan in response.data['artisans'])
+            if response.data['next_cursor'] is None:
+                break
+            self.assertEqual(len(response.data['artisans']), 2)
+            response = self.search(limit=2, cursor=response.data['next_cursor'])
+        self.assertEqual(seen, [artisan.id for artisan in self.artisans])
+
+    def test_k_nearest_expands_ring_to_find_distant_artisans(self):
+        response = self.search(limit=5)
+        self.assertEqual(len(response.data['artisans']), 5)
+        self.assertAlmostEqual(response.data['artisans'][-1]['distance_km'], 44.48, places=1)
+
+    def test_invalid_cursor(self):
+        response = self.search(limit=2, cursor="not-a-cursor")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.data)
+
+
+
+class NearbyArtisansFilterTests(TestCase):
+    def setUp(self):
+        artisan_geo_index.invalidate()
+        self.client = APIClient()
+        self.verified_potter = self.make_artisan("potter", "0755000001", 0.02, rating="4.8", verified=True, category="pottery")
+        self.unverified_potter = self.make_artisan("newpotter", "0755000002", 0.01, rating="3.0", verified=False, category="pottery")
+        self.verified_weaver = self.make_artisan("weaver", "0755000003", 0.03, rating="4.2", verified=True, category="weaving")
+
+    def make_artisan(self, name, phone_number, offset, rating, verified, category):
+        artisan = User.objects.create(
+            email=f"{name}@gmail.com",
+            user_type="artisan",
+            first_name=name.title(),
+            last_name="Fundi",
+            phone_number=phone_number
+        )
+        ArtisanProfile.objects.create(
+            user=artisan,
+            latitude=-1.286389 + offset,
+            longitude=36.817223,
+            average_rating=Decimal(rating),
+            is_verified=verified,
+        )
+        Inventory.objects.create(
+            artisan=artisan,
+            product_name=f"{name} goods",
+            description="Handmade",
+            category=category,
+            price=Decimal("500.00"),
+            stock_quantity=3,
+        )
+        return artisan
+
+    def search(self, **extra):
+        data = {"latitude": -1.286389, "longitude": 36.817223, "radius": 10, **extra}
+        response = self.client.post(reverse('nearby-artisans'), data, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        return [artisan['id'] for artisan in response.data['artisans']]
+
+    def test_verified_potters(self):
+        self.assertEqual(self.search(is_verified=True, categories=["pottery"]), [self.verified_potter.id])
+
+    @override_settings(NEARBY_ARTISANS_USE_INDEX=False)
+    def test_verified_potters_without_index(self):
+        self.assertEqual(self.search(is_verified=True, categories=["pottery"]), [self.verified_potter.id])
+
+    def test_min_rating(self):
+        self.assertEqual(self.search(min_rating="4.0"), [self.verified_potter.id, self.verified_weaver.id])
+
+    def test_order_by_rating(self):
+        self.assertEqual(
+            self.search(ordering="rating"),
+            [self.verified_potter.id, self.verified_weaver.id, self.unverified_potter.id],
+        )
+
+    def test_order_by_relevance_pages_with_cursor(self):
+        response = self.client.post(reverse('nearby-artisans'), {
+            "latitude": -1.286389, "longitude": 36.817223, "radius": 10, "ordering": "relevance", "limit": 1,
+        }, format='json')
+        self.assertEqual(response.data['artisans'][0]['id'], self.verified_potter.id)
+        cursor = response.data['next_cursor']
+        self.assertEqual(
+            self.search(ordering="relevance", limit=5, cursor=cursor),
+            [self.verified_weaver.id, self.unverified_potter.id],
+        )
+        response = self.client.post(reverse('nearby-artisans'), {
+            "latitude": -1.286389, "longitude": 36.817223, "ordering": "distance", "cursor": cursor,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_category_index_refreshed_on_inventory_save(self):
+        self.assertEqual(self.search(categories=["basketry"]), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Inventory.objects.create(
+                artisan=self.verified_weaver,
+                product_name="Kiondo",
+                description="Sisal basket",
+                category="basketry",
+                price=Decimal("800.00"),
+                stock_quantity=2,
+            )
+        self.assertEqual(self.search(categories=["basketry"]), [self.verified_weaver.id])
+
+    def test_category_change_reaches_other_processes_without_reload(self):
+        other_worker = ArtisanGeoIndex()
+        other_worker.candidates(-2, -1, [(36, 37)])
+        version = cache.get(INDEX_VERSION_CACHE_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            Inventory.objects.create(
+                artisan=self.verified_weaver, product_name="Kiondo", description="Sisal basket",
+                category="basketry", price=Decimal("800.00"), stock_quantity=2,
+            )
+        self.assertEqual(cache.get(INDEX_VERSION_CACHE_KEY), version)
+        with self.assertNumQueries(0):
+            ids = other_worker.candidates(-2, -1, [(36, 37)], categories=["basketry"])[0]
+        self.assertEqual(ids.tolist(), [self.verified_weaver.id])
+
+    def test_invalid_category(self):
+        response = self.client.post(reverse('nearby-artisans'), {
+            "latitude": -1.286389, "longitude": 36.817223, "categories": ["plumbing"],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('categories', response.data)
+
+
+class GeoUtilsTests(TestCase):
+    def test_geohash_encode(self):
+        self.assertEqual(geohash_encode(57.64911, 10.40744, precision=11), "u4pruydqqvj")
+    def test_bounding_box_crosses_antimeridian(self):
+        min_lat, max_lat, lon_ranges = bounding_box(0, 179.9, 50)
+        self.assertLess(min_lat, 0)
+        self.assertGreater(max_lat, 0)
+        self.assertEqual(len(lon_ranges), 2)
+        self.assertEqual(lon_ranges[0][1], 180.0)
+        self.assertEqual(lon_ranges[1][0], -180.0)
+    def test_haversine_batch_matches_scalar(self):
+        lats = [Decimal('-1.286389'), Decimal('-4.043477'), Decimal('0.514277')]
+        lons = [Decimal('36.817223'), Decimal('39.668206'), Decimal('35.269779')]
+        distances = haversine_batch(-1.300000, 36.820000, lats, lons)
+        for lat, lon, dist in zip(lats, lons, distances):
+            self.assertAlmostEqual(dist, haversine(-1.300000, 36.820000, lat, lon), places=6)
+    def test_geohash_cells_cover_point(self):
+        min_lat, max_lat, lon_ranges = bounding_box(-1.286389, 36.817223, 10)
+        cells = geohash_cells(min_lat, max_lat, lon_ranges)
+        self.assertLessEqual(len(cells), 16)
+        point_hash = geohash_encode(-1.25, 36.85)
+        self.assertTrue(any(point_hash.startswith(cell) for cell in cells))
+    def test_geo_utils_import_without_numpy(self):
+        # users.models imports api.utils, so it must load without numpy.
+        result = subprocess.run(
+            [sys.executable, "-c", "import sys, api.utils; assert 'numpy' not in sys.modules"],
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
 class UserViewSetTests(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -412,7 +757,7 @@ class UserViewSetTests(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['email'], "muthoniwafula@gmail.com")
         self.assertEqual(response.data['latitude'], "-1.286389")
-    @patch('requests.get')
+    @patch('api.http_client.get')
     def test_create_user_with_address(self, mock_get):
         mock_get.return_value.json.return_value = [{'lat': '-1.286389', 'lon': '36.817223'}]
         mock_get.return_value.status_code = 200
@@ -444,3 +789,329 @@ class UserViewSetTests(TestCase):
 
 
 
+
+
+class DarajaAccessTokenCacheTests(DarajaStubMixin, TestCase):
+    stub_latency = 0.05
+    daraja_settings = {
+        "DARAJA_CONSUMER_KEY": "key",
+        "DARAJA_CONSUMER_SECRET": "secret",
+        "DARAJA_SHORTCODE": "174379",
+        "DARAJA_PASSKEY": "passkey",
+        "DARAJA_CALLBACK_URL": "https://example.com/api/daraja/callback/",
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.stub.expires_in = 3599
+
+    def test_token_reused_across_calls(self):
+        DarajaAPI().stk_push("254708374149", 10, "tx-1", "Test payment")
+        DarajaAPI().b2c_payment("254708374149", 5, "tx-2", "Test payout")
+        self.assertEqual(self.stub.calls[OAUTH_PATH], 1)
+        self.assertEqual(self.stub.calls[STK_PUSH_PATH], 1)
+        self.assertEqual(self.stub.calls[B2C_PATH], 1)
+
+    def test_token_refreshed_before_expiry(self):
+        self.stub.expires_in = 61
+        with override_settings(DARAJA_TOKEN_REFRESH_MARGIN=60):
+            first = DarajaAPI().get_access_token()
+            self.assertEqual(DarajaAPI().get_access_token(), first)
+            time.sleep(1.1)
+            self.assertNotEqual(DarajaAPI().get_access_token(), first)
+        self.assertEqual(self.stub.calls[OAUTH_PATH], 2)
+
+    def test_concurrent_callers_share_one_refresh(self):
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            tokens = list(pool.map(lambda _: DarajaAPI().get_access_token(), range(10)))
+        self.assertEqual(len(set(tokens)), 1)
+        self.assertEqual(self.stub.calls[OAUTH_PATH], 1)
+
+    def test_waiter_that_gives_up_leaves_the_other_lock(self):
+        api = DarajaAPI()
+        lock_key = f"{api.token_cache_key}:lock"
+        cache.set(lock_key, "other-process", 60)
+        with patch.object(DarajaAPI, '_wait_for_token', return_value=None):
+            self.assertTrue(api.get_access_token())
+        self.assertEqual(cache.get(lock_key), "other-process")
+
+    def test_falls_back_to_local_memory_when_cache_fails(self):
+        with patch('api.daraja.cache.get', side_effect=ConnectionError), \
+                patch('api.daraja.cache.set', side_effect=ConnectionError):
+            first = DarajaAPI().get_access_token()
+            self.assertEqual(DarajaAPI().get_access_token(), first)
+        self.assertEqual(self.stub.calls[OAUTH_PATH], 1)
+
+
+class OutboundHttpClientTests(DarajaStubMixin, TestCase):
+    daraja_settings = {"OUTBOUND_HTTP": {"daraja": {"retries": 2, "backoff_factor": 0, "read_timeout": 2}}}
+
+    def test_connections_are_pooled_and_kept_alive(self):
+        for index in range(3):
+            DarajaAPI().stk_push("254708374149", 10, f"tx-{index}", "Test payment")
+        session = http_client.get_session("daraja")
+        self.assertIs(session, http_client.get_session("daraja"))
+        pools = session.get_adapter(self.stub.url).poolmanager.pools
+        self.assertEqual(len(pools), 1)
+        self.assertEqual(pools[next(iter(pools.keys()))].num_connections, 1)
+
+    def test_idempotent_get_is_retried(self):
+        self.stub.status_codes[OAUTH_PATH] = 503
+        with self.assertRaises(requests.HTTPError):
+            DarajaAPI().get_access_token()
+        self.assertEqual(self.stub.calls[OAUTH_PATH], 3)
+
+    def test_post_is_not_retried(self):
+        self.stub.status_codes[STK_PUSH_PATH] = 503
+        with self.assertRaises(requests.HTTPError):
+            DarajaAPI().stk_push("254708374149", 10, "tx-1", "Test payment")
+        self.assertEqual(self.stub.calls[STK_PUSH_PATH], 1)
+
+    def test_endpoint_read_timeout(self):
+        DarajaAPI().get_access_token()
+        self.stub.latency = 0.5
+        with override_settings(OUTBOUND_HTTP={"daraja": {"retries": 0, "endpoints": {"stk_push": {"read_timeout": 0.1}}}}):
+            with self.assertRaises(requests.Timeout):
+                DarajaAPI().stk_push("254708374149", 10, "tx-1", "Test payment")
+
+
+class AsyncDarajaTests(DarajaStubMixin, PaymentFixturesMixin, TestCase):
+    stub_latency = 0.2
+
+    async def test_concurrent_stk_pushes_overlap(self):
+        daraja = AsyncDarajaAPI()
+        await daraja.get_access_token()
+        started = time.monotonic()
+        responses = await asyncio.gather(*[
+            daraja.stk_push("254708374149", 10, f"tx-{index}", "Test payment") for index in range(20)
+        ])
+        self.assertLess(time.monotonic() - started, 20 * 0.2 / 2)
+        self.assertEqual(len({response["CheckoutRequestID"] for response in responses}), 20)
+
+    async def test_async_stk_push_route_queues_payment(self):
+        response = await self.async_client.post(reverse('daraja-async-stk-push'), {
+            "order_id": self.order.id,
+            "amount": "1500.00",
+            "transaction_code": "ORDER-1",
+            "transaction_desc": "Order payment",
+        }, content_type="application/json")
+        self.assertEqual(response.status_code, 202)
+        payment = await Payment.objects.aget(id=response.json()["payment_id"])
+        self.assertEqual(payment.status, Payment.PENDING)
+        self.assertIsNone(payment.paid_at)
+        self.assertTrue(await PaymentJob.objects.filter(payment=payment, kind=PaymentJob.STK_PUSH).aexists())
+        self.assertEqual(self.stub.calls[STK_PUSH_PATH], 0)
+
+    async def test_async_b2c_view_validates_input(self):
+        response = await self.async_client.post(reverse('daraja-async-b2c-payment'), {
+            "amount": "100.00",
+        }, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("artisan_phone", response.json())
+
+
+class PaymentLoggingTests(DarajaStubMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        payment_latency.reset()
+
+    def test_calls_recorded_in_latency_histogram(self):
+        DarajaAPI().stk_push("254708374149", 10, "tx-1", "Test payment")
+        DarajaAPI().stk_push("254708374149", 10, "tx-2", "Test payment")
+        series = {(row["endpoint"], row["result_code"]): row for row in payment_latency.snapshot()}
+        self.assertEqual(series[("oauth", "0")]["count"], 1)
+        self.assertEqual(series[("stk_push", "0")]["count"], 2)
+        self.assertEqual(sum(series[("stk_push", "0")]["buckets"].values()), 2)
+
+    def test_failed_call_recorded_with_http_status(self):
+        DarajaAPI().get_access_token()
+        self.stub.status_codes[STK_PUSH_PATH] = 500
+        with self.assertLogs("payments.daraja", level="WARNING"):
+            with self.assertRaises(requests.HTTPError):
+                DarajaAPI().stk_push("254708374149", 10, "tx-1", "Test payment")
+        self.assertIn(("stk_push", "http_500"), {
+            (row["endpoint"], row["result_code"]) for row in payment_latency.snapshot()
+        })
+
+    def test_raw_body_only_logged_at_debug(self):
+        with self.assertLogs("payments.daraja", level="INFO") as logs:
+            DarajaAPI().stk_push("254708374149", 10, "tx-1", "Test payment")
+        self.assertFalse(any("raw response" in line for line in logs.output))
+        with self.assertLogs("payments.daraja", level="DEBUG") as logs:
+            DarajaAPI().stk_push("254708374149", 10, "tx-2", "Test payment")
+        self.assertTrue(any("CheckoutRequestID" in line for line in logs.output))
+
+    def test_sampling_filter_keeps_warnings(self):
+        sampling = SamplingFilter(rate=0)
+        info = logging.LogRecord("payments", logging.INFO, __file__, 1, "ok", None, None)
+        warning = logging.LogRecord("payments", logging.WARNING, __file__, 1, "failed", None, None)
+        self.assertFalse(sampling.filter(info))
+        self.assertTrue(sampling.filter(warning))
+
+    def test_queued_handler_writes_from_listener_thread(self):
+        stream = StringIO()
+        handler = QueuedStreamHandler(stream)
+        self.addCleanup(handler.close)
+        test_logger = logging.getLogger("payments.tests.queue")
+        test_logger.addHandler(handler)
+        self.addCleanup(test_logger.removeHandler, handler)
+        test_logger.warning("queued %s", "record")
+        handler.flush()
+        self.assertIn("queued record", stream.getvalue())
+
+
+class DarajaCircuitBreakerTests(DarajaStubMixin, PaymentFixturesMixin, TestCase):
+    daraja_settings = {"DARAJA_BREAKER_MIN_CALLS": 3, "DARAJA_BREAKER_FAILURE_RATE": 0.5}
+
+    def b2c(self):
+        return self.client.post(reverse('daraja-b2c-payment'), {
+            "artisan_phone": "254708374149", "amount": "100.00", "transaction_id": "tx-1",
+        }, format='json')
+
+    def trip(self):
+        self.stub.status_codes[B2C_PATH] = 503
+        with self.assertLogs("api.circuit_breaker", level="WARNING"):
+            for _ in range(2):
+                self.assertEqual(self.b2c().status_code, 500)
+        self.stub.status_codes.clear()
+
+    @override_settings(DARAJA_BREAKER_WINDOW=60)
+    def test_failures_spanning_a_window_boundary_trip(self):
+        start = 6000.0
+        daraja_breaker.record_success(now=start + 50)
+        daraja_breaker.record_failure(now=start + 55)
+        daraja_breaker.record_failure(now=start + 65)
+        self.assertEqual(daraja_breaker.current_state(now=start + 65), "closed")
+        # The new window alone has 2 calls, under MIN_CALLS; 5/6 of the last one still counts.
+        with self.assertLogs("api.circuit_breaker", level="WARNING"):
+            daraja_breaker.record_failure(now=start + 70)
+        self.assertEqual(daraja_breaker.current_state(now=start + 70), "open")
+
+    def test_open_circuit_fails_fast(self):
+        self.trip()
+        self.assertEqual(daraja_breaker.snapshot()["state"], "open")
+        response = self.b2c()
+        self.assertEqual(response.status_code, 503)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.stub.calls[B2C_PATH], 2)
+
+    def test_client_errors_do_not_open_circuit(self):
+        self.stub.status_codes[B2C_PATH] = 400
+        for _ in range(3):
+            self.assertEqual(self.b2c().status_code, 500)
+        self.assertEqual(daraja_breaker.snapshot()["state"], "closed")
+
+    def test_stk_push_is_shed_while_open(self):
+        self.trip()
+        response = self.client.post(reverse('daraja-stk-push'), {
+            "order_id": self.order.id, "buyer_phone": "254708374149", "amount": "1500.00",
+            "transaction_desc": "Order payment",
+        }, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_payout_deferred_while_open(self):
+        self.create_payment()
+        payout = confirm_delivery(self.order.id)
+        self.trip()
+        with self.assertLogs("payments.jobs", level="INFO"):
+            self.assertEqual(payment_jobs.run_pending(), 1)
+        job = payout.jobs.get()
+        payout.refresh_from_db()
+        self.assertEqual(job.status, PaymentJob.QUEUED)
+        self.assertEqual(job.attempts, 0)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(payout.status, Payout.QUEUED)
+        self.assertEqual(self.stub.calls[B2C_PATH], 2)
+        self.assertEqual(payment_jobs.run_pending(), 0)
+
+    def test_probe_after_cooldown_closes_circuit(self):
+        self.trip()
+        cache.set(daraja_breaker.open_key, time.time() - 1)
+        self.assertEqual(daraja_breaker.snapshot()["state"], "half_open")
+        self.assertEqual(self.b2c().status_code, 200)
+        self.assertEqual(daraja_breaker.snapshot()["state"], "closed")
+
+    def test_only_the_probe_closes_circuit(self):
+        self.trip()
+        cache.set(daraja_breaker.open_key, time.time() - 1)
+        # A call that was already in flight when the circuit opened.
+        daraja_breaker.record_success()
+        self.assertEqual(daraja_breaker.snapshot()["state"], "half_open")
+        self.assertTrue(daraja_breaker.before_call())
+        with self.assertRaises(CircuitOpenError):
+            daraja_breaker.before_call()
+        daraja_breaker.record_success(probe=True)
+        self.assertEqual(daraja_breaker.snapshot()["state"], "closed")
+
+    def test_process_local_cache_fails_check_with_several_workers(self):
+        self.assertEqual(check_daraja_cache(None), [])
+        with override_settings(WEB_CONCURRENCY=4):
+            self.assertEqual([error.id for error in check_daraja_cache(None)], ["api.E001"])
+            shared = {"default": {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "cache"}}
+            with override_settings(CACHES=shared):
+                self.assertEqual(check_daraja_cache(None), [])
+
+    def test_failed_probe_reopens_circuit(self):
+        self.trip()
+        cache.set(daraja_breaker.open_key, time.time() - 1)
+        self.stub.status_codes[B2C_PATH] = 503
+        with self.assertLogs("api.circuit_breaker", level="WARNING"):
+            self.assertEqual(self.b2c().status_code, 500)
+        self.assertEqual(daraja_breaker.snapshot()["state"], "open")
+        with self.assertRaises(CircuitOpenError):
+            daraja_breaker.before_call()
+
+    def test_metrics_endpoint(self):
+        self.trip()
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get(reverse('daraja-metrics')).status_code, 403)
+        admin = User.objects.create(email="admin@example.com", phone_number="0711000003", user_type=User.ADMIN)
+        self.client.force_authenticate(admin)
+        response = self.client.get(reverse('daraja-metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["circuit"]["state"], "open")
+        self.assertEqual(response.data["circuit"]["failures"], 2)
+        self.assertIn("b2c", {series["endpoint"] for series in response.data["latency"]})
+
+
+class SharedDarajaClientTests(TestCase):
+    def setUp(self):
+        override = override_settings(
+            DARAJA_SHORTCODE="174379",
+            DARAJA_PASSKEY="passkey",
+            DARAJA_CALLBACK_URL="https://example.com/api/daraja/callback/",
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_one_client_per_process(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            clients = set(map(id, pool.map(lambda _: get_daraja(), range(32))))
+        self.assertEqual(clients, {id(get_daraja())})
+        self.assertIsInstance(get_async_daraja(), AsyncDarajaAPI)
+        self.assertIsNot(get_async_daraja(), get_daraja())
+
+    def test_settings_change_replaces_client(self):
+        client = get_daraja()
+        with override_settings(DARAJA_BASE_URL="http://127.0.0.1:9/"):
+            self.assertEqual(get_daraja().stk_push_url, "http://127.0.0.1:9/mpesa/stkpush/v1/processrequest")
+        self.assertIsNot(get_daraja(), client)
+
+    def test_invalid_base_url_is_rejected(self):
+        with override_settings(DARAJA_BASE_URL="sandbox.safaricom.co.ke"):
+            with self.assertRaises(ImproperlyConfigured):
+                get_daraja()
+
+    def test_stk_push_payload(self):
+        payload = get_daraja()._stk_push_payload("254708374149", Decimal("10.50"), "tx-1", "Test payment")
+        second = get_daraja()._stk_push_payload("254708374150", 20, "tx-2", "Other")
+        self.assertEqual(base64.b64decode(payload["Password"]).decode(), f"174379passkey{payload['Timestamp']}")
+        self.assertEqual(payload["Amount"], "10")
+        self.assertEqual(payload["PartyA"], "254708374149")
+        self.assertEqual(payload["PhoneNumber"], "254708374149")
+        self.assertEqual(payload["PartyB"], "174379")
+        self.assertEqual(payload["CallBackURL"], "https://example.com/api/daraja/callback/")
+        self.assertEqual(second["AccountReference"], "tx-2")
+        self.assertEqual(payload["AccountReference"], "tx-1")
+        self.assertNotIn(None, payload.values())
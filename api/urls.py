@@ -5,9 +5,14 @@ from rest_framework.routers import DefaultRouter
 from .views import (
     UserRegistrationView, LoginView, ForgotPasswordView,OTPVerificationView, PasswordResetView,AdminListUsersView, 
     UserViewSet, ArtisanPortfolioViewSet, UserProfileView,NearbyArtisansView, UserViewSet,OrderViewSet, RatingViewSet,
-    OrderStatusViewSet, CustomDesignRequestViewSet,ShoppingCartViewSet,InventoryViewSet,ItemViewSet,PaymentViewSet, daraja_callback,
+    OrderStatusViewSet, CustomDesignRequestViewSet,ShoppingCartViewSet,InventoryViewSet,ItemViewSet,PaymentViewSet, daraja_callback, daraja_metrics,
     STKPushView,
+    DeliveryConfirmView,
+    RefundPaymentView,
+    b2c_result_callback,
+    b2c_timeout_callback,
     B2CPaymentView,
+    b2c_payment_async,
 
 )
 
@@ -33,6 +38,14 @@ urlpatterns = [
     path('daraja/stk-push/', STKPushView.as_view(), name='daraja-stk-push'),
     path('daraja/callback/', daraja_callback, name='daraja-callback'),
     path('daraja/b2c-payment/', B2CPaymentView.as_view(), name='daraja-b2c-payment'),
+    path('daraja/b2c/result/', b2c_result_callback, name='daraja-b2c-result'),
+    path('daraja/b2c/timeout/', b2c_timeout_callback, name='daraja-b2c-timeout'),
+    path('daraja/delivery-confirm/', DeliveryConfirmView.as_view(), name='daraja-delivery-confirm'),
+    path('daraja/refund/', RefundPaymentView.as_view(), name='daraja-refund'),
+    path('daraja/metrics/', daraja_metrics, name='daraja-metrics'),
+    # STK pushes are queued, so there is nothing to await; kept for existing clients.
+    path('daraja/async/stk-push/', STKPushView.as_view(), name='daraja-async-stk-push'),
+    path('daraja/async/b2c-payment/', b2c_payment_async, name='daraja-async-b2c-payment'),
     path('nearby-artisans/', NearbyArtisansView.as_view(), name='nearby-artisans'), 
     path('register/', UserRegistrationView.as_view(), name='register'),
     path('login/', LoginView.as_view(), name='login'),
@@ -1,7 +1,15 @@
 import math
 
+EARTH_RADIUS_KM = 6371
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 8
+GEOHASH_MAX_QUERY_PRECISION = 6
+GEOHASH_MAX_QUERY_CELLS = 16
+
+
 def haversine(lat1, lon1, lat2, lon2):
-    R = 6371 
+    R = EARTH_RADIUS_KM
     phi1 = math.radians(float(lat1))
     phi2 = math.radians(float(lat2))
     d_phi = math.radians(float(lat2) - float(lat1))
@@ -9,4 +17,114 @@ def haversine(lat1, lon1, lat2, lon2):
 
     a = math.sin(d_phi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(d_lambda/2)**2
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R * c
\ No newline at end of file
+    return R * c
+
+
+def haversine_batch(lat, lon, lats, lons):
+    """
+    Distance in km from one point to every point in ``lats``/``lons``,
+    computed in a single vectorized pass. numpy is imported here so that
+    ``users.models``, which imports this module, does not need it.
+    """
+    import numpy as np
+
+    phi1 = np.radians(float(lat))
+    phi2 = np.radians(np.asarray(lats, dtype=np.float64))
+    d_phi = phi2 - phi1
+    d_lambda = np.radians(np.asarray(lons, dtype=np.float64) - float(lon))
+
+    a = np.sin(d_phi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    lat, lon = float(lat), float(lon)
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits = bits << 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Return ``(min_lat, max_lat, lon_ranges)`` for the box enclosing a circle of
+    ``radius_km`` around a point. ``lon_ranges`` holds two ranges when the box
+    crosses the antimeridian and spans the whole globe when it reaches a pole.
+    """
+    lat, lon = float(lat), float(lon)
+    angular = float(radius_km) / EARTH_RADIUS_KM
+    d_lat = math.degrees(angular)
+    min_lat = lat - d_lat
+    max_lat = lat + d_lat
+    if min_lat <= -90 or max_lat >= 90 or angular >= math.pi / 2:
+        clamp = lambda value: min(max(value, -90.0), 90.0)
+        return clamp(min_lat), clamp(max_lat), [(-180.0, 180.0)]
+
+    d_lon = math.degrees(math.asin(min(1.0, math.sin(angular) / math.cos(math.radians(lat)))))
+    min_lon = lon - d_lon
+    max_lon = lon + d_lon
+    if min_lon < -180:
+        return min_lat, max_lat, [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    if max_lon > 180:
+        return min_lat, max_lat, [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    return min_lat, max_lat, [(min_lon, max_lon)]
+
+
+def _geohash_cell_size(precision):
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = (5 * precision) // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits), lat_bits, lon_bits
+
+
+def _geohash_cell_indices(low, high, origin, size, bits):
+    last = (1 << bits) - 1
+    first = min(int((low - origin) // size), last)
+    end = min(int((high - origin) // size), last)
+    return range(max(first, 0), end + 1)
+
+
+def _geohash_cells_at(min_lat, max_lat, lon_ranges, precision):
+    cell_h, cell_w, lat_bits, lon_bits = _geohash_cell_size(precision)
+    rows = _geohash_cell_indices(min_lat, max_lat, -90.0, cell_h, lat_bits)
+    cols = []
+    for min_lon, max_lon in lon_ranges:
+        cols.extend(_geohash_cell_indices(min_lon, max_lon, -180.0, cell_w, lon_bits))
+    return [
+        geohash_encode(-90.0 + (row + 0.5) * cell_h, -180.0 + (col + 0.5) * cell_w, precision)
+        for row in rows
+        for col in sorted(set(cols))
+    ]
+
+
+def geohash_cells(min_lat, max_lat, lon_ranges):
+    """
+    Return the geohash prefixes covering a bounding box, using the finest
+    precision that keeps the number of cells under GEOHASH_MAX_QUERY_CELLS.
+    """
+    for precision in range(GEOHASH_MAX_QUERY_PRECISION, 0, -1):
+        cell_h, cell_w, lat_bits, lon_bits = _geohash_cell_size(precision)
+        rows = len(_geohash_cell_indices(min_lat, max_lat, -90.0, cell_h, lat_bits))
+        cols = sum(
+            len(_geohash_cell_indices(min_lon, max_lon, -180.0, cell_w, lon_bits))
+            for min_lon, max_lon in lon_ranges
+        )
+        if rows * cols <= GEOHASH_MAX_QUERY_CELLS or precision == 1:
+            return _geohash_cells_at(min_lat, max_lat, lon_ranges, precision)
@@ -22,14 +22,15 @@ from .serializers import (
     ArtisanPortfolioSerializer,
 )
 from users.permissions import AdminPermission, ArtisanPermission
+from users.throttling import LoginThrottle, ForgotPasswordThrottle, OTPVerificationThrottle, PasswordResetThrottle
 
 from rest_framework.views import APIView
-from .utils import haversine
+from .nearby import search_nearby, artisan_results, NEARBY_DEFAULT_PAGE_SIZE
 from users.models import User, ArtisanPortfolio, ArtisanProfile
 from api.serializers import UserSerializer, NearbyArtisanSearchSerializer
 import logging
 
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from .serializers import (
     STKPushSerializer,
     PaymentSerializer,
@@ -39,11 +40,25 @@ from .serializers import (
     OrderSerializer, RatingSerializer,
     OrderStatusSerializer, CustomDesignRequestSerializer,ShoppingCartSerializer, ItemSerializer
 )
-from payments.models import Payment
+from payments.models import Payment, PaymentJob, DarajaCallback
+from payments.callbacks import checkout_request_id, originator_conversation_id
+from payments.transitions import TransitionError, confirm_delivery, refund_order, confirm_order_payment
+from payments import jobs as payment_jobs
+from payments import ledger
+from django.db import transaction
+from rest_framework.decorators import action
+from rest_framework.reverse import reverse
 from orders.models import Order
 from django.utils import timezone
 import datetime
-from .daraja import DarajaAPI
+from .daraja import get_daraja, get_async_daraja
+from .circuit_breaker import CircuitOpenError, daraja_breaker
+from .payment_logging import payment_latency
+import json
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from .serializers import ShoppingCartSerializer,InventorySerializer
 from products.models import Inventory
 from cart.models import ShoppingCart, Item
@@ -75,6 +90,7 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
 class LoginView(generics.GenericAPIView):
     serializer_class = LoginSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [LoginThrottle]
 
     def post(self, request, *args, **kwargs):
         logger.debug("Login request received")
@@ -84,16 +100,16 @@ class LoginView(generics.GenericAPIView):
         if not user:
             logger.error("Authentication returned no user.")
             return Response({"error": "User authentication failed"}, status=status.HTTP_400_BAD_REQUEST)
-        token, _ = Token.objects.get_or_create(user=user)
-        user.last_login = timezone.now()
-        user.save(update_fields=['last_login'])
         user_serializer = CustomUserSerializer(user, context={'request': request})
         logger.info("Login successful for user: %s", getattr(user, 'email', 'unknown'))
-        return Response({"token": token.key, "user": user_serializer.data}, status=status.HTTP_200_OK)
+        return Response(
+            {"token": serializer.validated_data['token'], "user": user_serializer.data}, status=status.HTTP_200_OK,
+        )
 
 class ForgotPasswordView(generics.GenericAPIView):
     serializer_class = ForgotPasswordSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [ForgotPasswordThrottle]
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -103,6 +119,7 @@ class ForgotPasswordView(generics.GenericAPIView):
 class OTPVerificationView(generics.GenericAPIView):
     serializer_class = OTPVerificationSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [OTPVerificationThrottle]
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -112,6 +129,7 @@ class OTPVerificationView(generics.GenericAPIView):
 class PasswordResetView(generics.GenericAPIView):
     serializer_class = PasswordResetSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [PasswordResetThrottle]
 
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -163,37 +181,29 @@ class NearbyArtisansView(APIView):
         lat = float(serializer.validated_data['latitude'])  
         lon = float(serializer.validated_data['longitude'])
         radius = float(serializer.validated_data.get('radius', 50))
-
-        artisans = User.objects.filter(
-            user_type='artisan',
-            artisanprofile__latitude__isnull=False,
-            artisanprofile__longitude__isnull=False,
-        ).select_related('artisanprofile')
-
-        results = []
-        for artisan in artisans:
-            try:
-                artisan_profile = artisan.artisanprofile
-                if artisan_profile.latitude is None or artisan_profile.longitude is None:
-                    continue
-                dist = haversine(lat, lon, float(artisan_profile.latitude), float(artisan_profile.longitude))
-                if dist <= radius:
-                    results.append({
-                        "id": artisan.id,
-                        "first_name": artisan.first_name,
-                        "last_name": artisan.last_name,
-                        "distance_km": round(dist, 2),
-                        "latitude": artisan_profile.latitude,
-                        "longitude": artisan_profile.longitude,
-                        
-                    })
-            except ArtisanProfile.DoesNotExist:
-                logger.warning(f"Artisan {artisan.email} has no ArtisanProfile")
-                continue
-
-        results = sorted(results, key=lambda x: x['distance_km'])
+        limit = serializer.validated_data.get('limit')
+        after = serializer.validated_data.get('cursor')
+        if after is not None and limit is None:
+            limit = NEARBY_DEFAULT_PAGE_SIZE
+
+        filters = {
+            'is_verified': serializer.validated_data.get('is_verified'),
+            'min_rating': serializer.validated_data.get('min_rating'),
+            'categories': serializer.validated_data.get('categories'),
+        }
+        if filters['min_rating'] is not None:
+            filters['min_rating'] = float(filters['min_rating'])
+
+        matches, next_cursor = search_nearby(
+            lat, lon, radius,
+            limit=limit,
+            after=after,
+            ordering=serializer.validated_data['ordering'],
+            **filters,
+        )
+        results = artisan_results(matches)
         logger.info(f"Returning {len(results)} artisans within radius")
-        return Response({"artisans": results})
+        return Response({"artisans": results, "next_cursor": next_cursor})
 
 
 class UserViewSet(viewsets.ModelViewSet):
@@ -235,16 +245,16 @@ class OrderViewSet(viewsets.ModelViewSet):
             return Order.objects.filter(artisan_id=user)
         return Order.objects
 
+    @action(detail=True, methods=['post'], url_path='confirm-payment')
     def confirm_payment(self, request, pk=None):
         order = self.get_object()
-        if order.payment_status != 'pending':
-            raise ValidationError("Payment is not pending.")
         if self.request.user.user_type != 'buyer':
             raise PermissionDenied("Only buyers can confirm payment.")
-        order.payment_status = 'completed'
-        order.status = 'confirmed'
-        order.save()
-        return Response({"message": "Payment confirmed", "payment_status": order.payment_status})
+        try:
+            confirm_order_payment(order.id)
+        except TransitionError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"message": "Payment confirmed", "payment_status": "completed"})
 
 class RatingViewSet(viewsets.ModelViewSet):
     queryset = Rating.objects.all()
@@ -263,146 +273,199 @@ class PaymentViewSet(viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
 
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            payment = serializer.save()
+            ledger.record_payment(payment)
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            previous = Payment.objects.select_for_update().values('status', 'amount').get(pk=serializer.instance.pk)
+            payment = serializer.save()
+            ledger.record_payment(payment, previous['status'], previous['amount'])
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def balance(self, request):
+        """
+        What the platform holds for an artisan, read from the precomputed
+        balance row. Admins pass ``?artisan=<id>``; artisans get their own.
+        """
+        user = request.user
+        if user.user_type.lower() == "admin":
+            artisan_id = request.query_params.get('artisan', user.id)
+        elif user.user_type.lower() == "artisan":
+            artisan_id = user.id
+        else:
+            raise PermissionDenied("Only artisans have a balance.")
+        try:
+            artisan_id = int(artisan_id)
+        except (TypeError, ValueError):
+            return Response({"artisan": ["A valid integer is required."]}, status=status.HTTP_400_BAD_REQUEST)
+        held, released, refunded, updated_at = ledger.balance_for(artisan_id)
+        return Response({
+            "artisan": artisan_id,
+            "held": held,
+            "released": released,
+            "refunded": refunded,
+            "updated_at": updated_at,
+        })
+
+    @action(detail=True, methods=['get'], url_path='status')
+    def job_status(self, request, pk=None):
+        """Result of the queued work for a payment, for clients to poll."""
+        payment = self.get_object()
+        job = payment.jobs.order_by('-id').first()
+        body = {
+            "payment_id": payment.id,
+            "status": payment.status,
+            "checkout_request_id": payment.checkout_request_id,
+            "job": None,
+        }
+        if job is not None:
+            body["job"] = {
+                "kind": job.kind,
+                "status": job.status,
+                "attempts": job.attempts,
+                "last_error": job.last_error,
+            }
+        headers = {"Retry-After": "2"} if payment.status == Payment.PENDING else {}
+        return Response(body, headers=headers)
+
+def _circuit_open_response(exc, response_class=Response):
+    response = response_class({"detail": str(exc)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    response['Retry-After'] = str(exc.retry_after)
+    return response
+
+
 class STKPushView(APIView):
     def post(self, request):
+        """
+        Record a pending payment and queue the STK push; the
+        ``run_payment_jobs`` worker sends it. Poll ``status_url`` for the result.
+        While the Daraja circuit is open no prompt could be sent, so the
+        request is refused with 503 instead.
+        """
+        try:
+            daraja_breaker.check()
+        except CircuitOpenError as e:
+            return _circuit_open_response(e)
         serializer = STKPushSerializer(data=request.data)
         if serializer.is_valid():
             data = serializer.validated_data
-            daraja = DarajaAPI()
-            try:
-                response = daraja.stk_push(
-                    buyer_phone=data["buyer_phone"],
-                    amount=data["amount"],
-                    transaction_id=data["transaction_code"],
-                    transaction_desc=data["transaction_desc"],
-                )
-                checkout_request_id = response.get('CheckoutRequestID', None)
-                if checkout_request_id:
-                    order = data['order_obj']
-                    artisan = data['artisan_obj']
-                    Payment.objects.create(
-                        order=order,
-                        artisan=artisan,
-                        amount=data['amount'],
-                        transaction_code=data['transaction_code'],
-                        status='held',
-                        paid_at=timezone.now(),
-                    )
-                    return Response(response, status=status.HTTP_200_OK)
-                return Response(response, status=status.HTTP_400_BAD_REQUEST)
-            except Exception as e:
-                return Response(
-                    {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            with transaction.atomic():
+                payment = Payment.objects.create(
+                    order=data['order_obj'],
+                    artisan=data['artisan_obj'],
+                    amount=data['amount'],
+                    transaction_code=data['transaction_code'],
+                    status=Payment.PENDING,
                 )
+                payment_jobs.enqueue(PaymentJob.STK_PUSH, {
+                    "buyer_phone": data["buyer_phone"],
+                    "amount": str(data["amount"]),
+                    "transaction_code": data["transaction_code"],
+                    "transaction_desc": data["transaction_desc"],
+                }, payment=payment)
+            return Response({
+                "payment_id": payment.id,
+                "status": payment.status,
+                "status_url": reverse('payments-job-status', args=[payment.id], request=request),
+            }, status=status.HTTP_202_ACCEPTED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def _store_callback(kind, reference, payload):
+    DarajaCallback.objects.create(kind=kind, reference=reference, payload=payload)
+    return Response({"ResultCode": 0, "ResultDesc": "Accepted"})
+
+
 @api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
 def daraja_callback(request):
-    callback_data = request.data
-    try:
-        stk_callback = callback_data['Body']['stkCallback']
-        checkout_request_id = stk_callback['CheckoutRequestID']
-        result_code = stk_callback['ResultCode']
-        result_desc = stk_callback['ResultDesc']
-        payment = Payment.objects.get(transaction_code=checkout_request_id)
-        if result_code == 0:
-            payment.status = 'held'
-            items = stk_callback.get('CallbackMetadata', {}).get('Item', [])
-            item_dict = {item['Name']: item.get('Value') for item in items}
-            payment.amount = item_dict.get('Amount', payment.amount)
-            payment.paid_at = timezone.now()
-            payment.save()
-        elif result_code == 1:
-            payment.status = 'refunded'
-            payment.save()
-    except Payment.DoesNotExist:
-        pass
-    except Exception:
-        pass
-    return Response({"status": "callback processed"})
+    """
+    Store the callback as received and acknowledge it straight away; the
+    ``process_daraja_callbacks`` worker applies it to the payment.
+    """
+    return _store_callback(DarajaCallback.STK_PUSH, checkout_request_id(request.data), request.data)
+
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def b2c_result_callback(request):
+    """B2C result (``DARAJA_B2C_RESULT_URL``), applied to the payout by the callback worker."""
+    return _store_callback(DarajaCallback.B2C_RESULT, originator_conversation_id(request.data), request.data)
+
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def b2c_timeout_callback(request):
+    """B2C queue timeout (``DARAJA_B2C_TIMEOUT_URL``); the payout is marked failed."""
+    return _store_callback(DarajaCallback.B2C_TIMEOUT, originator_conversation_id(request.data), request.data)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, AdminPermission])
+def daraja_metrics(request):
+    """Circuit breaker state, deferred payouts and Daraja call latency."""
+    deferred = PaymentJob.objects.filter(
+        kind=PaymentJob.B2C_PAYOUT, status=PaymentJob.QUEUED, run_after__gt=timezone.now(),
+    ).count()
+    return Response({
+        "circuit": daraja_breaker.snapshot(),
+        "deferred_payouts": deferred,
+        "latency": payment_latency.snapshot(),
+    })
+
 
 class DeliveryConfirmView(APIView):
     def post(self, request):
+        """
+        Confirm delivery and queue the artisan's payout. The payment stays
+        ``releasing`` until the B2C result callback settles the payout.
+        """
         serializer = DeliveryConfirmSerializer(data=request.data)
         if serializer.is_valid():
-            data = serializer.validated_data
             try:
-                order = Order.objects.get(id=data['order_id'])
-                payment = Payment.objects.get(order=order)
-                if order.delivery_confirmed:
-                    return Response({"detail": "Already confirmed."}, status=400)
-                order.delivery_confirmed = True
-                order.status = 'completed'
-                order.save()
-                daraja = DarajaAPI()
-                response = daraja.b2c_payment(
-                    artisan_phone=order.artisan.phone_number,
-                    amount=payment.amount,
-                    transaction_id=payment.transaction_code,
-                    transaction_desc="Delivery confirmed"
-                )
-                payment.status = "released"
-                payment.released_at = timezone.now()
-                payment.held_by_platform = False
-                payment.save()
+                payout = confirm_delivery(serializer.validated_data['order_id'])
+            except Order.DoesNotExist:
+                return Response({"detail": "Order not found."}, status=status.HTTP_404_NOT_FOUND)
+            except TransitionError as e:
+                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            if payout is None:
                 return Response(
-                    {
-                        "detail": "Delivery confirmed and payout released.",
-                        "b2c_response": response,
-                    }
-                )
-            except Exception as e:
-                return Response(
-                    {"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                    {"detail": "Delivery confirmed; payment will be included in the next payout batch."},
+                    status=status.HTTP_202_ACCEPTED,
                 )
+            return Response(
+                {
+                    "detail": "Delivery confirmed and payout queued.",
+                    "payout_id": payout.id,
+                    "payout_status": payout.status,
+                },
+                status=status.HTTP_202_ACCEPTED,
+            )
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class RefundPaymentView(APIView):
     def post(self, request):
         serializer = RefundSerializer(data=request.data)
         if serializer.is_valid():
-            data = serializer.validated_data
             try:
-                order = Order.objects.get(id=data['order_id'])
-                payment = Payment.objects.get(order=order)
-                payment.status = "refunded"
-                payment.held_by_platform = False
-                payment.released_at = timezone.now()
-                payment.save()
-                return Response({"detail": "Refund processed."})
-            except Exception as e:
-                return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                refund_order(serializer.validated_data['order_id'])
+            except Order.DoesNotExist:
+                return Response({"detail": "Order not found."}, status=status.HTTP_404_NOT_FOUND)
+            except TransitionError as e:
+                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({"detail": "Refund processed."})
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-def auto_release_payments():
-    now = timezone.now()
-    payments = Payment.objects.filter(status="held")
-    for payment in payments:
-        order = payment.order
-        if hasattr(order, 'delivery_confirmed') and order.delivery_confirmed:
-            continue
-        if payment.paid_at and (now - payment.paid_at).total_seconds() > 86400:
-            daraja = DarajaAPI()
-            try:
-                response = daraja.b2c_payment(
-                    artisan_phone=order.artisan.phone_number,
-                    amount=payment.amount,
-                    transaction_id=payment.transaction_code,
-                    transaction_desc="Auto-release after 24hr"
-                )
-                payment.status = "released"
-                payment.released_at = now
-                payment.held_by_platform = False
-                payment.save()
-            except Exception:
-                continue
-
 class B2CPaymentView(APIView):
     def post(self, request):
         serializer = B2CPaymentSerializer(data=request.data)
         if serializer.is_valid():
             data = serializer.validated_data
-            daraja = DarajaAPI()
+            daraja = get_daraja()
             try:
                 response = daraja.b2c_payment(
                     artisan_phone=data["artisan_phone"],
@@ -412,6 +475,41 @@ class B2CPaymentView(APIView):
                     occassion=data.get("occassion", ""),
                 )
                 return Response(response, status=status.HTTP_200_OK)
+            except CircuitOpenError as e:
+                return _circuit_open_response(e)
             except Exception as e:
                 return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+async def _read_json(request):
+    try:
+        return json.loads(request.body or b"{}")
+    except ValueError:
+        return None
+
+
+@csrf_exempt
+@require_POST
+async def b2c_payment_async(request):
+    data = await _read_json(request)
+    if data is None:
+        return JsonResponse({"detail": "Malformed JSON."}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = B2CPaymentSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    data = serializer.validated_data
+    daraja = get_async_daraja()
+    try:
+        response = await daraja.b2c_payment(
+            artisan_phone=data["artisan_phone"],
+            amount=data["amount"],
+            transaction_id=data["transaction_id"],
+            transaction_desc=data.get("transaction_desc", ""),
+            occassion=data.get("occassion", ""),
+        )
+        return JsonResponse(response, status=status.HTTP_200_OK)
+    except CircuitOpenError as e:
+        return _circuit_open_response(e, JsonResponse)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
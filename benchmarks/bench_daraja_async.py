@@ -0,0 +1,105 @@
+"""
+Compare sync and async Daraja clients against the local stub server.
+
+A gunicorn sync worker handles one request at a time, so N sync workers are
+modelled as a pool of N threads each blocking on ``DarajaAPI.stk_push``. The
+async worker is one event loop issuing every call through
+``AsyncDarajaAPI.stk_push``. Both sides see the same number of concurrent
+client requests and the same simulated upstream latency.
+
+Run from the project root:
+
+    python benchmarks/bench_daraja_async.py --requests 400 --concurrency 200 --workers 4
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "craftcrest.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+
+from api.daraja import DarajaAPI, AsyncDarajaAPI  # noqa: E402
+from api.daraja_stub import DarajaStubServer  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(label, elapsed, latencies):
+    print(
+        f"{label:<28} {len(latencies) / elapsed:>9.1f} req/s "
+        f"p50 {statistics.median(latencies) * 1000:>8.1f} ms "
+        f"p99 {percentile(latencies, 99) * 1000:>8.1f} ms"
+    )
+
+
+def run_sync(requests, concurrency, workers):
+    # Requests beyond the worker count queue, as they would in gunicorn's backlog.
+    def call(index, queued):
+        DarajaAPI().stk_push("254708374149", 10, f"sync-{index}", "Benchmark")
+        return time.monotonic() - queued
+
+    latencies = []
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=min(workers, concurrency)) as pool:
+        for batch_start in range(0, requests, concurrency):
+            batch = range(batch_start, min(batch_start + concurrency, requests))
+            futures = [pool.submit(call, index, time.monotonic()) for index in batch]
+            latencies.extend(future.result() for future in futures)
+    return time.monotonic() - started, latencies
+
+
+async def run_async(requests, concurrency):
+    daraja = AsyncDarajaAPI()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def call(index):
+        queued = time.monotonic()
+        async with limit:
+            await daraja.stk_push("254708374149", 10, f"async-{index}", "Benchmark")
+        return time.monotonic() - queued
+
+    await daraja.get_access_token()
+    started = time.monotonic()
+    latencies = await asyncio.gather(*[call(index) for index in range(requests)])
+    return time.monotonic() - started, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn sync workers to model")
+    parser.add_argument("--latency", type=float, default=0.25, help="simulated Safaricom latency in seconds")
+    args = parser.parse_args()
+
+    with DarajaStubServer(latency=args.latency) as stub:
+        settings.DARAJA_BASE_URL = stub.url
+        settings.DARAJA_CALLBACK_URL = "https://example.com/api/daraja/callback/"
+        DarajaAPI().get_access_token()
+
+        print(
+            f"{args.requests} STK pushes, {args.concurrency} concurrent clients, "
+            f"{args.latency * 1000:.0f} ms upstream latency"
+        )
+        elapsed, latencies = run_sync(args.requests, args.concurrency, args.workers)
+        report(f"sync, {args.workers} workers", elapsed, latencies)
+        elapsed, latencies = asyncio.run(run_async(args.requests, args.concurrency))
+        report("async, 1 worker", elapsed, latencies)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Measure the per-call overhead of the Daraja client with the network stubbed out.
+
+"per call" builds a new ``DarajaAPI`` for every STK push and assembles the
+payload from scratch, the way views used the client before it was shared.
+"shared" goes through ``get_daraja()``, which reuses the validated settings,
+the prebuilt payload template and the password for the current second.
+``http_client.post`` is replaced with a function returning a canned response,
+so the numbers are the client's own cost plus the token cache lookup and the
+circuit breaker check.
+
+Run from the project root:
+
+    python benchmarks/bench_daraja_client.py --calls 20000
+"""
+import argparse
+import base64
+import datetime
+import logging
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "craftcrest.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.core.cache import cache  # noqa: E402
+
+from api.daraja import DarajaAPI, get_daraja, reset_clients  # noqa: E402
+
+
+class StubResponse:
+    status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"ResponseCode": "0", "CheckoutRequestID": "ws_CO_1"}
+
+
+def stub_post(service, url, endpoint=None, **kwargs):
+    return StubResponse()
+
+
+class PerCallDarajaAPI(DarajaAPI):
+    """The payload construction the client used before templates were prebuilt."""
+
+    def _headers(self, access_token):
+        return {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json",
+        }
+
+    def _stk_push_payload(self, buyer_phone, amount, transaction_id, transaction_desc):
+        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        data_to_encode = f"{self.business_shortcode}{self.passkey}{timestamp}"
+        password = base64.b64encode(data_to_encode.encode("utf-8")).decode("utf-8")
+        return {
+            "BusinessShortCode": self.business_shortcode,
+            "Password": password,
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": str(int(amount)),
+            "PartyA": buyer_phone,
+            "PartyB": self.business_shortcode,
+            "PhoneNumber": buyer_phone,
+            "CallBackURL": self.callback_url,
+            "AccountReference": transaction_id,
+            "TransactionDesc": transaction_desc,
+        }
+
+
+def measure(label, get_client, calls, rounds):
+    results = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for index in range(calls):
+            get_client().stk_push("254708374149", 10, f"tx-{index}", "Benchmark")
+        results.append((time.perf_counter() - started) / calls * 1e6)
+    print(f"{label:<10} {statistics.median(results):>8.2f} us/call (best {min(results):.2f})")
+    return statistics.median(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    settings.DARAJA_SHORTCODE = settings.DARAJA_SHORTCODE or "174379"
+    settings.DARAJA_PASSKEY = settings.DARAJA_PASSKEY or "passkey"
+    settings.DARAJA_CONSUMER_KEY = settings.DARAJA_CONSUMER_KEY or "key"
+    settings.DARAJA_CONSUMER_SECRET = settings.DARAJA_CONSUMER_SECRET or "secret"
+    settings.DARAJA_CALLBACK_URL = "https://example.com/api/daraja/callback/"
+    reset_clients()
+    client = get_daraja()
+    cache.set(client.token_cache_key, "benchmark-token", 3600)
+
+    # Per-call INFO logging would dominate the numbers and flood the terminal.
+    logging.disable(logging.INFO)
+    print(f"{args.calls} STK pushes x {args.rounds} rounds, network stubbed")
+    with patch("api.http_client.post", stub_post):
+        before = measure("per call", PerCallDarajaAPI, args.calls, args.rounds)
+        after = measure("shared", get_daraja, args.calls, args.rounds)
+    print(f"overhead saved: {before - after:.2f} us/call ({(1 - after / before) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Micro-benchmark of the scalar and vectorized haversine kernels.
+
+The vectorized column includes converting the Decimal coordinates the ORM
+returns; the float64 column measures the kernel alone on prepared arrays.
+
+Run from the project root:
+
+    python benchmarks/bench_haversine.py
+"""
+import random
+import sys
+import timeit
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+
+from api.utils import haversine, haversine_batch  # noqa: E402
+
+ORIGIN = (-1.286389, 36.817223)
+SIZES = (1_000, 10_000, 100_000)
+
+
+def make_points(count, seed=42):
+    rng = random.Random(seed)
+    lats = [Decimal(f"{rng.uniform(-4.5, 4.5):.6f}") for _ in range(count)]
+    lons = [Decimal(f"{rng.uniform(34.0, 41.5):.6f}") for _ in range(count)]
+    return lats, lons
+
+
+def scalar(lats, lons):
+    return [haversine(ORIGIN[0], ORIGIN[1], lat, lon) for lat, lon in zip(lats, lons)]
+
+
+def vectorized(lats, lons):
+    return haversine_batch(ORIGIN[0], ORIGIN[1], lats, lons)
+
+
+def best_of(func, *args, repeat=5):
+    return min(timeit.repeat(lambda: func(*args), number=1, repeat=repeat))
+
+
+def main():
+    print(
+        f"{'points':>8} {'scalar ms':>12} {'vectorized ms':>15} "
+        f"{'float64 ms':>12} {'speedup':>9}"
+    )
+    for size in SIZES:
+        lats, lons = make_points(size)
+        lat_array = np.asarray(lats, dtype=np.float64)
+        lon_array = np.asarray(lons, dtype=np.float64)
+        scalar_time = best_of(scalar, lats, lons)
+        vector_time = best_of(vectorized, lats, lons)
+        array_time = best_of(vectorized, lat_array, lon_array)
+        print(
+            f"{size:>8} {scalar_time * 1000:>12.2f} {vector_time * 1000:>15.2f} "
+            f"{array_time * 1000:>12.2f} {scalar_time / vector_time:>8.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Login latency under each PASSWORD_HASH_PROFILE.
+
+Builds a throwaway SQLite database, stores one user's password with the
+profile's preferred hasher and times ``users.services.login_user`` (lookup,
+password check, token) for every profile in ``PASSWORD_HASH_PROFILES``.
+
+Run from the project root:
+
+    python benchmarks/bench_password_hashing.py --logins 50 --pbkdf2-iterations 600000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "craftcrest.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+
+from users.models import User  # noqa: E402
+from users.services import login_user  # noqa: E402
+
+PASSWORD = "TestPassword123"
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def measure(label, user, logins, **overrides):
+    with override_settings(**overrides):
+        user.set_password(PASSWORD)
+        user.save(update_fields=["password"])
+        login_user(PASSWORD, email=user.email)
+        samples = []
+        for _ in range(logins):
+            started = time.perf_counter()
+            login_user(PASSWORD, email=user.email)
+            samples.append(time.perf_counter() - started)
+    print(
+        f"{label:<24} p50 {statistics.median(samples) * 1000:>8.2f} ms "
+        f"p99 {percentile(samples, 99) * 1000:>8.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--pbkdf2-iterations", type=int, default=600_000, help="tuned PBKDF2 iteration count")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        user = User.objects.create(email="buyer@example.com", phone_number="0711000001", user_type=User.BUYER)
+        print(f"{args.logins} logins per profile")
+        profiles = settings.PASSWORD_HASH_PROFILES
+        measure("argon2", user, args.logins, PASSWORD_HASHERS=profiles["argon2"])
+        measure("pbkdf2 (Django default)", user, args.logins, PASSWORD_HASHERS=profiles["pbkdf2"])
+        measure(
+            f"pbkdf2 ({args.pbkdf2_iterations})", user, args.logins,
+            PASSWORD_HASHERS=profiles["pbkdf2"], PASSWORD_PBKDF2_ITERATIONS=args.pbkdf2_iterations,
+        )
+        measure("fast (tests only)", user, args.logins, PASSWORD_HASHERS=profiles["fast"])
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
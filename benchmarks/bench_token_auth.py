@@ -0,0 +1,77 @@
+"""
+Compare DRF's TokenAuthentication with CachedTokenAuthentication on the
+authenticated order list.
+
+Builds a throwaway SQLite database with one buyer and a few orders, then
+requests ``/api/orders/`` repeatedly with each authentication class,
+reporting queries per request and mean latency.
+
+Run from the project root:
+
+    python benchmarks/bench_token_auth.py --requests 500
+"""
+import argparse
+import os
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "craftcrest.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.core.cache import cache  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import CaptureQueriesContext, setup_test_environment  # noqa: E402
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication  # noqa: E402
+from rest_framework.authtoken.models import Token  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+
+from api.views import OrderViewSet  # noqa: E402
+from orders.models import Order  # noqa: E402
+from users.authentication import CachedTokenAuthentication  # noqa: E402
+from users.models import User  # noqa: E402
+
+
+def measure(label, auth_class, client, requests):
+    OrderViewSet.authentication_classes = [auth_class, SessionAuthentication]
+    cache.clear()
+    client.get("/api/orders/")
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        for _ in range(requests):
+            response = client.get("/api/orders/")
+            assert response.status_code == 200, response.status_code
+        elapsed = time.perf_counter() - started
+    print(f"{label:<26} {len(queries) / requests:>5.1f} queries/request {elapsed / requests * 1000:>8.3f} ms/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=5)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        buyer = User.objects.create(email="buyer@example.com", phone_number="0711000001", user_type=User.BUYER)
+        artisan = User.objects.create(email="artisan@example.com", phone_number="0711000002", user_type=User.ARTISAN)
+        for _ in range(args.orders):
+            Order.objects.create(buyer=buyer, artisan=artisan, order_type="ready-made", total_amount=Decimal("1500.00"))
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=buyer).key}")
+
+        print(f"{args.requests} GET /api/orders/ as a buyer with {args.orders} orders")
+        measure("TokenAuthentication", TokenAuthentication, client, args.requests)
+        measure("CachedTokenAuthentication", CachedTokenAuthentication, client, args.requests)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
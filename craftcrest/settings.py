@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 import dj_database_url
 import os
+import sys
 from pathlib import Path
 import os
 from dotenv import load_dotenv
@@ -25,6 +26,9 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 
 LOCATIONIQ_API_KEY = os.getenv('LOCATIONIQ_API_KEY')
 
+NEARBY_ARTISANS_USE_INDEX = os.getenv('NEARBY_ARTISANS_USE_INDEX', 'True') == 'True'
+NEARBY_INDEX_MAX_AGE = int(os.getenv('NEARBY_INDEX_MAX_AGE', 300))
+
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv('DJANGO_SECRET_KEY')
@@ -40,6 +44,46 @@ DARAJA_INITIATOR_NAME = os.getenv("DARAJA_INITIATOR_NAME")
 DARAJA_SECURITY_CREDENTIAL = os.getenv("DARAJA_SECURITY_CREDENTIAL")
 DARAJA_B2C_TIMEOUT_URL = os.getenv("DARAJA_B2C_TIMEOUT_URL")
 DARAJA_B2C_RESULT_URL = os.getenv("DARAJA_B2C_RESULT_URL")
+DARAJA_BASE_URL = os.getenv("DARAJA_BASE_URL", "https://sandbox.safaricom.co.ke")
+DARAJA_TOKEN_REFRESH_MARGIN = int(os.getenv("DARAJA_TOKEN_REFRESH_MARGIN", 60))
+
+PAYMENT_JOB_MAX_ATTEMPTS = int(os.getenv("PAYMENT_JOB_MAX_ATTEMPTS", 5))
+PAYMENT_JOB_RETRY_DELAY = float(os.getenv("PAYMENT_JOB_RETRY_DELAY", 5))
+PAYMENT_JOB_LOCK_TIMEOUT = int(os.getenv("PAYMENT_JOB_LOCK_TIMEOUT", 300))
+PAYMENT_JOB_POLL_INTERVAL = float(os.getenv("PAYMENT_JOB_POLL_INTERVAL", 1.0))
+DARAJA_CALLBACK_POLL_INTERVAL = float(os.getenv("DARAJA_CALLBACK_POLL_INTERVAL", 1.0))
+DARAJA_CALLBACK_MATCH_GRACE = int(os.getenv("DARAJA_CALLBACK_MATCH_GRACE", 60))
+DARAJA_CALLBACK_MATCH_RETRY = int(os.getenv("DARAJA_CALLBACK_MATCH_RETRY", 5))
+PAYMENT_AUTO_RELEASE_AFTER = int(os.getenv("PAYMENT_AUTO_RELEASE_AFTER", 24 * 60 * 60))
+PAYMENT_AUTO_RELEASE_CHUNK_SIZE = int(os.getenv("PAYMENT_AUTO_RELEASE_CHUNK_SIZE", 100))
+PAYMENT_AUTO_RELEASE_WORKERS = int(os.getenv("PAYMENT_AUTO_RELEASE_WORKERS", 4))
+# Seconds to collect an artisan's confirmed payments into one B2C payout; 0 pays out per order.
+PAYOUT_BATCH_WINDOW = int(os.getenv("PAYOUT_BATCH_WINDOW", 0))
+# Open the Daraja circuit when this share of calls in a window fail (5xx or no response).
+DARAJA_BREAKER_FAILURE_RATE = float(os.getenv("DARAJA_BREAKER_FAILURE_RATE", 0.5))
+DARAJA_BREAKER_MIN_CALLS = int(os.getenv("DARAJA_BREAKER_MIN_CALLS", 10))
+DARAJA_BREAKER_WINDOW = int(os.getenv("DARAJA_BREAKER_WINDOW", 60))
+DARAJA_BREAKER_COOLDOWN = int(os.getenv("DARAJA_BREAKER_COOLDOWN", 30))
+
+OUTBOUND_HTTP = {
+    "daraja": {
+        "connect_timeout": float(os.getenv("DARAJA_CONNECT_TIMEOUT", 3.05)),
+        "read_timeout": float(os.getenv("DARAJA_READ_TIMEOUT", 30)),
+        "retries": 2,
+        "backoff_factor": 0.5,
+        "pool_maxsize": 20,
+        "async_max_connections": 200,
+        "endpoints": {
+            "oauth": {"read_timeout": 10},
+        },
+    },
+    "locationiq": {
+        "connect_timeout": 3.05,
+        "read_timeout": 10,
+        "retries": 2,
+        "backoff_factor": 0.3,
+    },
+}
 
 
 
@@ -77,7 +121,7 @@ INSTALLED_APPS = [
     'django_filters',
     'corsheaders',
     'users.apps.UsersConfig',
-    'api',
+    'api.apps.ApiConfig',
     'payments',
     'products',
     'orders',
@@ -129,6 +173,52 @@ if not os.getenv("DATABASE_URL"):
             "NAME": BASE_DIR / "db.sqlite3",
         }
     }
+# CachedTokenAuthentication, the account throttles, the Daraja circuit
+# breaker and the Daraja token refresh lock keep state in this cache, so it
+# must be shared by every gunicorn worker (Redis, Memcached or the database
+# cache) when WEB_CONCURRENCY is above 1. The users and api system checks
+# fail otherwise.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
+PAYMENT_LOG_LEVEL = os.getenv("PAYMENT_LOG_LEVEL", "INFO")
+PAYMENT_LOG_SAMPLE_RATE = float(os.getenv("PAYMENT_LOG_SAMPLE_RATE", 1.0))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "filters": {
+        "payment_sampling": {
+            "()": "api.payment_logging.SamplingFilter",
+            "rate": PAYMENT_LOG_SAMPLE_RATE,
+        },
+    },
+    "formatters": {
+        "payment": {
+            "format": "%(asctime)s %(levelname)s %(name)s %(message)s",
+        },
+    },
+    "handlers": {
+        "payment_queue": {
+            "()": "api.payment_logging.QueuedStreamHandler",
+            "filters": ["payment_sampling"],
+            "formatter": "payment",
+        },
+    },
+    "loggers": {
+        "payments": {
+            "handlers": ["payment_queue"],
+            "level": PAYMENT_LOG_LEVEL,
+            "propagate": False,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -149,6 +239,38 @@ AUTH_PASSWORD_VALIDATORS = [
 
 AUTH_USER_MODEL = 'users.User'
 
+# The first hasher of the chosen profile hashes new passwords; the others only
+# verify existing hashes, which are rehashed on the next successful login.
+# "fast" (MD5) is for the test suite only.
+PASSWORD_HASH_PROFILES = {
+    "argon2": [
+        "users.hashers.TunedArgon2PasswordHasher",
+        "users.hashers.TunedPBKDF2PasswordHasher",
+        "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+        "django.contrib.auth.hashers.ScryptPasswordHasher",
+    ],
+    "pbkdf2": [
+        "users.hashers.TunedPBKDF2PasswordHasher",
+        "users.hashers.TunedArgon2PasswordHasher",
+        "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+        "django.contrib.auth.hashers.ScryptPasswordHasher",
+    ],
+    "fast": [
+        "django.contrib.auth.hashers.MD5PasswordHasher",
+        "users.hashers.TunedPBKDF2PasswordHasher",
+        "users.hashers.TunedArgon2PasswordHasher",
+    ],
+}
+PASSWORD_HASH_PROFILE = os.getenv(
+    "PASSWORD_HASH_PROFILE", "fast" if sys.argv[1:2] == ["test"] else "argon2"
+)
+PASSWORD_HASHERS = PASSWORD_HASH_PROFILES[PASSWORD_HASH_PROFILE]
+# 0 keeps Django's defaults.
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", 0))
+PASSWORD_ARGON2_TIME_COST = int(os.getenv("PASSWORD_ARGON2_TIME_COST", 0))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv("PASSWORD_ARGON2_MEMORY_COST", 0))
+PASSWORD_ARGON2_PARALLELISM = int(os.getenv("PASSWORD_ARGON2_PARALLELISM", 0))
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -176,12 +298,33 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'users.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
-    'DEFAULT_PERMISSION_CLASSES': []
-
+    'DEFAULT_PERMISSION_CLASSES': [],
+    # X-Forwarded-For entries added by trusted proxies in front of the app
+    # (1 behind a single load balancer). With 0 the client IP used by the
+    # throttles is REMOTE_ADDR, so a client cannot pick its own address.
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 0)),
+    # Sliding-window limits for users.throttling: "<scope>" per email or
+    # phone number, "<scope>_ip" per client address. Enforced per cache, so
+    # several workers need a shared CACHES backend.
+    'DEFAULT_THROTTLE_RATES': {
+        'login': os.getenv('THROTTLE_LOGIN', '10/min'),
+        'login_ip': os.getenv('THROTTLE_LOGIN_IP', '60/min'),
+        'otp_verify': os.getenv('THROTTLE_OTP_VERIFY', '5/min'),
+        'otp_verify_ip': os.getenv('THROTTLE_OTP_VERIFY_IP', '30/min'),
+        'forgot_password': os.getenv('THROTTLE_FORGOT_PASSWORD', '3/min'),
+        'forgot_password_ip': os.getenv('THROTTLE_FORGOT_PASSWORD_IP', '20/min'),
+        'password_reset': os.getenv('THROTTLE_PASSWORD_RESET', '5/min'),
+        'password_reset_ip': os.getenv('THROTTLE_PASSWORD_RESET_IP', '20/min'),
+    },
 }
+# Seconds an authenticated token and its user stay cached; 0 turns the cache
+# off. Needs a shared CACHES backend when running several workers.
+AUTH_TOKEN_CACHE_TTL = int(os.getenv("AUTH_TOKEN_CACHE_TTL", 60))
+# Write last_login at most this often (seconds) per user.
+LAST_LOGIN_UPDATE_INTERVAL = int(os.getenv("LAST_LOGIN_UPDATE_INTERVAL", 5 * 60))
 
 
 EMAIL_BACKEND = os.getenv('EMAIL_BACKEND')
@@ -192,6 +335,10 @@ EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True') == 'True'
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", 5))
+EMAIL_OUTBOX_RETRY_DELAY = float(os.getenv("EMAIL_OUTBOX_RETRY_DELAY", 30))
+EMAIL_OUTBOX_LOCK_TIMEOUT = int(os.getenv("EMAIL_OUTBOX_LOCK_TIMEOUT", 300))
+EMAIL_OUTBOX_POLL_INTERVAL = float(os.getenv("EMAIL_OUTBOX_POLL_INTERVAL", 2.0))
 
 CORS_ALLOW_ALL_ORIGINS = True
 CORS_ALLOW_HEADERS = [
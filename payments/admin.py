@@ -1,5 +1,57 @@
 from django.contrib import admin
+from django.db import transaction
 
-from .models import Payment
+from . import ledger
+from .models import Payment, PaymentJob, DarajaCallback, Payout, ReconciliationRun, LedgerEntry, ArtisanBalance
 
-admin.site.register(Payment)
+
+@admin.register(Payment)
+class PaymentAdmin(admin.ModelAdmin):
+    """
+    Status and amount only change through ``payments.transitions``, which keeps
+    the ledger in step; new payments are recorded in the ledger as they are added.
+    """
+    list_display = ('id', 'order', 'artisan', 'amount', 'status', 'paid_at')
+    list_filter = ('status',)
+    search_fields = ('transaction_code', 'mpesa_receipt_number', 'checkout_request_id')
+
+    def get_readonly_fields(self, request, obj=None):
+        return ('status', 'amount') if obj else ()
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            if not change:
+                ledger.record_payment(obj)
+
+
+class ReadOnlyAdmin(admin.ModelAdmin):
+    """Shown for inspection only; the rows are written by ``payments.ledger``."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LedgerEntry)
+class LedgerEntryAdmin(ReadOnlyAdmin):
+    list_display = ('created_at', 'artisan', 'entry_type', 'amount', 'payment')
+    list_filter = ('entry_type',)
+    search_fields = ('artisan__email',)
+
+
+@admin.register(ArtisanBalance)
+class ArtisanBalanceAdmin(ReadOnlyAdmin):
+    list_display = ('artisan', 'held', 'released', 'refunded', 'updated_at')
+    search_fields = ('artisan__email',)
+
+
+admin.site.register(PaymentJob)
+admin.site.register(DarajaCallback)
+admin.site.register(Payout)
+admin.site.register(ReconciliationRun)
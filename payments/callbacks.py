@@ -0,0 +1,214 @@
+"""
+Apply stored Daraja callbacks to payments and payouts.
+
+The callback views only insert a ``DarajaCallback`` row. ``apply_callbacks``
+takes a batch of unprocessed rows and loads the payments (by the unique
+``checkout_request_id``) and payouts (by the unique
+``originator_conversation_id``) they refer to in one query each.
+
+STK callbacks confirm or fail a pending payment, as ``PAYMENT_TRANSITIONS``
+allows; a confirmation for a different amount than the payment's is left for
+a person as ``amount_mismatch``. B2C result and timeout callbacks
+settle or fail a submitted payout. Records that have already moved on are left
+alone, so duplicate and replayed callbacks are recorded as ``duplicate``. The
+exception is a successful B2C result for a failed payout: the payout is
+settled and logged as an error, since its payments may be paid out again.
+A callback that arrives before the worker has stored the CheckoutRequestID or
+conversation id is kept unprocessed for ``DARAJA_CALLBACK_MATCH_GRACE``
+seconds. It is looked at again every ``DARAJA_CALLBACK_MATCH_RETRY`` seconds
+and skipped by the batch query in between, so early callbacks cannot crowd
+out newer ones.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import DarajaCallback, Payment, Payout
+from .transitions import PAYMENT_TRANSITIONS, return_failed_payouts, transition_payments
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MATCH_GRACE = 60
+DEFAULT_MATCH_RETRY = 5
+
+
+def checkout_request_id(payload):
+    """Return the CheckoutRequestID of an STK callback body, or ``""``."""
+    try:
+        return str(payload['Body']['stkCallback']['CheckoutRequestID'])[:100]
+    except (KeyError, TypeError):
+        return ""
+
+
+def originator_conversation_id(payload):
+    """Return the OriginatorConversationID of a B2C result body, or ``""``."""
+    try:
+        return str(payload['Result']['OriginatorConversationID'])[:100]
+    except (KeyError, TypeError):
+        return ""
+
+
+def _parse_stk_callback(payload):
+    stk_callback = payload['Body']['stkCallback']
+    items = stk_callback.get('CallbackMetadata', {}).get('Item', [])
+    metadata = {item['Name']: item.get('Value') for item in items}
+    return int(stk_callback['ResultCode']), metadata
+
+
+def _parse_b2c_result(payload):
+    result = payload['Result']
+    return int(result['ResultCode']), result
+
+
+def _match_grace():
+    return timedelta(seconds=getattr(settings, 'DARAJA_CALLBACK_MATCH_GRACE', DEFAULT_MATCH_GRACE))
+
+
+def _within_grace(callback, now):
+    return now - callback.received_at < _match_grace()
+
+
+def _apply_stk(callback, payment, now):
+    """
+    Update ``payment`` from an STK callback; return the outcome, or ``None``
+    to look at the callback again later.
+    """
+    try:
+        result_code, metadata = _parse_stk_callback(callback.payload)
+    except (KeyError, TypeError, ValueError):
+        logger.warning("Invalid Daraja callback %s", callback.pk, exc_info=True)
+        return DarajaCallback.INVALID
+    if payment is None:
+        if _within_grace(callback, now):
+            return None
+        logger.warning("Daraja callback %s matches no payment", callback.pk)
+        return DarajaCallback.UNMATCHED
+    target = Payment.HELD if result_code == 0 else Payment.FAILED
+    if target not in PAYMENT_TRANSITIONS[payment.status]:
+        return DarajaCallback.DUPLICATE
+    if result_code == 0 and metadata.get('Amount') is not None:
+        paid = Decimal(str(metadata['Amount']))
+        # The STK push asks for whole shillings, so compare against that.
+        if paid != int(payment.amount):
+            logger.error(
+                "Daraja callback %s paid %s for payment %s of %s (receipt %s)",
+                callback.pk, paid, payment.pk, payment.amount, metadata.get('MpesaReceiptNumber'),
+            )
+            return DarajaCallback.AMOUNT_MISMATCH
+    payment.status = target
+    if result_code == 0:
+        payment.mpesa_receipt_number = metadata.get('MpesaReceiptNumber')
+    return DarajaCallback.APPLIED
+
+
+def _apply_b2c(callback, payout, now):
+    """
+    Update ``payout`` from a B2C result or timeout; return the outcome, or
+    ``None`` to look at the callback again later.
+    """
+    try:
+        result_code, result = _parse_b2c_result(callback.payload)
+    except (KeyError, TypeError, ValueError):
+        logger.warning("Invalid Daraja callback %s", callback.pk, exc_info=True)
+        return DarajaCallback.INVALID
+    if payout is None:
+        if _within_grace(callback, now):
+            return None
+        logger.warning("Daraja callback %s matches no payout", callback.pk)
+        return DarajaCallback.UNMATCHED
+    succeeded = callback.kind == DarajaCallback.B2C_RESULT and result_code == 0
+    if payout.status == Payout.FAILED and succeeded:
+        # The money went out after all, but the payments were already handed
+        # back for another payout; settle this one and leave the rest to a person.
+        logger.error(
+            "B2C payout %s succeeded after it was failed; its payments may be paid out again", payout.pk,
+        )
+    elif payout.status not in (Payout.QUEUED, Payout.SUBMITTED):
+        return DarajaCallback.DUPLICATE
+    payout.result_code = str(result_code)
+    payout.result_desc = str(result.get('ResultDesc', ''))[:255]
+    payout.conversation_id = payout.conversation_id or str(result.get('ConversationID', ''))[:100]
+    if succeeded:
+        payout.status = Payout.SETTLED
+        payout.transaction_id = str(result.get('TransactionID', ''))[:30]
+        payout.settled_at = now
+    else:
+        payout.status = Payout.FAILED
+    return DarajaCallback.APPLIED
+
+
+def _apply_payments(payments, now):
+    Payment.objects.bulk_update(payments, ['mpesa_receipt_number'])
+    paid = [payment.pk for payment in payments if payment.status == Payment.HELD]
+    failed = [payment.pk for payment in payments if payment.status == Payment.FAILED]
+    if paid:
+        transition_payments(Payment.objects.filter(id__in=paid), Payment.HELD, paid_at=now)
+    if failed:
+        transition_payments(Payment.objects.filter(id__in=failed), Payment.FAILED)
+
+
+def _apply_payouts(payouts, now):
+    settled = [payout.pk for payout in payouts if payout.status == Payout.SETTLED]
+    failed = [payout.pk for payout in payouts if payout.status == Payout.FAILED]
+    Payout.objects.bulk_update(
+        payouts, ['status', 'result_code', 'result_desc', 'conversation_id', 'transaction_id', 'settled_at'],
+    )
+    if settled:
+        transition_payments(
+            Payment.objects.filter(payout__in=settled, status=Payment.RELEASING), Payment.RELEASED,
+            released_at=now, held_by_platform=False,
+        )
+    if failed:
+        # The money is still with the platform; pay it out again later.
+        return_failed_payouts(failed)
+
+
+def apply_callbacks(batch_size=100, now=None):
+    """Apply one batch of due callbacks; return how many were handled."""
+    now = now or timezone.now()
+    retry = timedelta(seconds=getattr(settings, 'DARAJA_CALLBACK_MATCH_RETRY', DEFAULT_MATCH_RETRY))
+    with transaction.atomic():
+        callbacks = list(
+            DarajaCallback.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True, apply_after__lte=now)
+            .order_by('apply_after', 'id')[:batch_size]
+        )
+        if not callbacks:
+            return 0
+        stk_refs = {c.reference for c in callbacks if c.kind == DarajaCallback.STK_PUSH and c.reference}
+        b2c_refs = {c.reference for c in callbacks if c.kind != DarajaCallback.STK_PUSH and c.reference}
+        payments = Payment.objects.select_for_update().in_bulk(stk_refs, field_name='checkout_request_id')
+        payouts = Payout.objects.select_for_update().in_bulk(b2c_refs, field_name='originator_conversation_id')
+
+        changed_payments = {}
+        changed_payouts = {}
+        handled = []
+        deferred = []
+        for callback in callbacks:
+            if callback.kind == DarajaCallback.STK_PUSH:
+                target = payments.get(callback.reference)
+                outcome = _apply_stk(callback, target, now)
+                changed = changed_payments
+            else:
+                target = payouts.get(callback.reference)
+                outcome = _apply_b2c(callback, target, now)
+                changed = changed_payouts
+            if outcome is None:
+                callback.apply_after = min(now + retry, callback.received_at + _match_grace())
+                deferred.append(callback)
+                continue
+            if outcome == DarajaCallback.APPLIED:
+                changed[target.pk] = target
+            callback.outcome = outcome
+            callback.processed_at = now
+            handled.append(callback)
+
+        _apply_payments(list(changed_payments.values()), now)
+        _apply_payouts(list(changed_payouts.values()), now)
+        DarajaCallback.objects.bulk_update(handled, ['outcome', 'processed_at'])
+        DarajaCallback.objects.bulk_update(deferred, ['apply_after'])
+    return len(handled)
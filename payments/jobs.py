@@ -0,0 +1,225 @@
+"""
+Database-backed queue for payment work that talks to Safaricom.
+
+Views enqueue a ``PaymentJob`` and return; the ``run_payment_jobs`` management
+command claims due jobs with a conditional UPDATE, so several workers can share
+the table without a broker, and runs the handler registered for the job kind.
+While the Daraja circuit breaker is open, jobs are put back in the queue until
+it may close, without using up an attempt.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.db.models import F, Q
+from django.dispatch import Signal
+from django.utils import timezone
+
+from api.circuit_breaker import CircuitOpenError
+from .models import Payment, PaymentJob, Payout
+from .transitions import return_failed_payouts, transition_payments
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 5
+DEFAULT_LOCK_TIMEOUT = 300
+
+# Sent with ``job`` once a job has succeeded or failed for good.
+payment_job_finished = Signal()
+
+_handlers = {}
+
+
+class RetryableJobError(Exception):
+    """Raised by a handler when the job can safely be attempted again."""
+
+
+def handler(kind):
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, payload, payment=None, payout=None, run_after=None):
+    return PaymentJob.objects.create(
+        kind=kind,
+        payment=payment,
+        payout=payout,
+        payload=payload,
+        run_after=run_after or timezone.now(),
+    )
+
+
+def claim_jobs(batch_size=10):
+    """
+    Mark up to ``batch_size`` due jobs as running and return them. Jobs left
+    running longer than ``PAYMENT_JOB_LOCK_TIMEOUT`` by a dead worker are
+    claimed again.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'PAYMENT_JOB_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT))
+    due = (
+        Q(status=PaymentJob.QUEUED, run_after__lte=now)
+        | Q(status=PaymentJob.RUNNING, locked_at__lt=stale)
+    )
+    claimed = []
+    for job_id, job_status, locked_at in PaymentJob.objects.filter(due).order_by('run_after', 'id').values_list(
+        'id', 'status', 'locked_at',
+    )[:batch_size]:
+        updated = PaymentJob.objects.filter(id=job_id, status=job_status, locked_at=locked_at).update(
+            status=PaymentJob.RUNNING,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+        if updated:
+            claimed.append(job_id)
+    return list(PaymentJob.objects.filter(id__in=claimed).select_related('payment', 'payout__artisan').order_by('run_after', 'id'))
+
+
+def _finish(job, status, result=None, error=""):
+    job.status = status
+    job.result = result
+    job.last_error = error
+    job.locked_at = None
+    job.save(update_fields=['status', 'result', 'last_error', 'locked_at', 'updated_at'])
+    payment_job_finished.send(sender=PaymentJob, job=job)
+
+
+def run_job(job):
+    func = _handlers.get(job.kind)
+    if func is None:
+        _finish(job, PaymentJob.FAILED, error=f"No handler for job kind {job.kind!r}")
+        return
+    max_attempts = getattr(settings, 'PAYMENT_JOB_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    try:
+        result = func(job)
+    except CircuitOpenError as exc:
+        _requeue(job, exc.retry_after, str(exc), count_attempt=False)
+        logger.info("Payment job %s deferred %ss: %s", job.pk, exc.retry_after, exc)
+    except RetryableJobError as exc:
+        if job.attempts < max_attempts:
+            delay = getattr(settings, 'PAYMENT_JOB_RETRY_DELAY', DEFAULT_RETRY_DELAY) * 2 ** (job.attempts - 1)
+            _requeue(job, delay, str(exc))
+            logger.warning("Payment job %s failed, retrying in %ss: %s", job.pk, delay, exc)
+            return
+        _fail_targets(job)
+        _finish(job, PaymentJob.FAILED, error=str(exc))
+    except Exception as exc:
+        logger.exception("Payment job %s failed", job.pk)
+        _fail_targets(job)
+        _finish(job, PaymentJob.FAILED, error=str(exc))
+    else:
+        _finish(job, PaymentJob.SUCCEEDED, result=result)
+
+
+def _requeue(job, delay, error, count_attempt=True):
+    job.status = PaymentJob.QUEUED
+    job.last_error = error
+    job.locked_at = None
+    job.run_after = timezone.now() + timedelta(seconds=delay)
+    fields = ['status', 'last_error', 'locked_at', 'run_after', 'updated_at']
+    if not count_attempt:
+        job.attempts -= 1
+        fields.append('attempts')
+    job.save(update_fields=fields)
+
+
+def run_pending(batch_size=10):
+    """Claim and run one batch of due jobs; return how many were run."""
+    jobs = claim_jobs(batch_size)
+    for job in jobs:
+        run_job(job)
+    return len(jobs)
+
+
+def _fail_targets(job):
+    if job.payment_id:
+        transition_payments(Payment.objects.filter(id=job.payment_id, status=Payment.PENDING), Payment.FAILED)
+    if job.payout_id and Payout.objects.filter(id=job.payout_id, status=Payout.QUEUED).update(status=Payout.FAILED):
+        return_failed_payouts([job.payout_id])
+
+
+@handler(PaymentJob.STK_PUSH)
+def initiate_stk_push(job):
+    from api.daraja import get_daraja
+
+    payload = job.payload
+    try:
+        response = get_daraja().stk_push(
+            buyer_phone=payload['buyer_phone'],
+            amount=Decimal(payload['amount']),
+            transaction_id=payload['transaction_code'],
+            transaction_desc=payload['transaction_desc'],
+        )
+    except requests.ConnectionError as exc:
+        # The request never reached Safaricom, so no prompt was sent.
+        raise RetryableJobError(str(exc))
+    checkout_request_id = response.get('CheckoutRequestID')
+    if not checkout_request_id:
+        raise ValueError(f"STK push rejected: {response}")
+    # The buyer has only been prompted; the STK callback confirms the payment.
+    Payment.objects.filter(id=job.payment_id, status=Payment.PENDING).update(checkout_request_id=checkout_request_id)
+    return response
+
+
+def is_rejection(exc):
+    """
+    Whether a failed Daraja request was definitely refused. Only a 4xx answer
+    says so; after a timeout, a 5xx or an unreadable body Safaricom may still
+    have accepted the request.
+    """
+    response = getattr(exc, 'response', None)
+    return isinstance(exc, requests.HTTPError) and response is not None and 400 <= response.status_code < 500
+
+
+@handler(PaymentJob.B2C_PAYOUT)
+def submit_payout(job):
+    """
+    Send the B2C request for a queued payout. The payout stays ``submitted``
+    until the result callback settles or fails it. When the outcome of the
+    request is unknown it is marked ``submitted`` under the reference that was
+    sent, for the callback or a status query to resolve; failing it would let
+    the payments be paid out a second time.
+    """
+    from api.daraja import get_daraja
+
+    payout = job.payout
+    if payout.status != Payout.QUEUED:
+        return {"skipped": payout.status}
+    reference = f"payout-{payout.pk}"
+    try:
+        response = get_daraja().b2c_payment(
+            artisan_phone=payout.artisan.phone_number,
+            amount=payout.amount,
+            transaction_id=reference,
+            transaction_desc=job.payload.get('transaction_desc', ''),
+        )
+    except requests.ConnectionError as exc:
+        # The request never reached Safaricom, so nothing was paid.
+        raise RetryableJobError(str(exc))
+    except (requests.RequestException, ValueError) as exc:
+        if is_rejection(exc):
+            raise ValueError(f"B2C request rejected: {exc}")
+        logger.warning("B2C payout %s outcome unknown, leaving it submitted: %s", payout.pk, exc)
+        Payout.objects.filter(id=payout.pk, status=Payout.QUEUED).update(
+            status=Payout.SUBMITTED,
+            originator_conversation_id=reference,
+            result_desc=f"Outcome unknown: {exc}"[:255],
+            submitted_at=timezone.now(),
+        )
+        return {"outcome": "unknown", "error": str(exc)}
+    originator_id = response.get('OriginatorConversationID')
+    if str(response.get('ResponseCode')) != '0':
+        raise ValueError(f"B2C request rejected: {response}")
+    Payout.objects.filter(id=payout.pk, status=Payout.QUEUED).update(
+        status=Payout.SUBMITTED,
+        originator_conversation_id=originator_id or reference,
+        conversation_id=response.get('ConversationID', ''),
+        submitted_at=timezone.now(),
+    )
+    return response
@@ -0,0 +1,98 @@
+"""
+Per-artisan earnings ledger.
+
+Every payment status or amount change is passed to ``record_changes`` inside
+the transaction that makes it. It appends ``LedgerEntry`` rows and applies
+their totals to the artisan's ``ArtisanBalance`` with ``F()`` updates, so the
+balance always equals the sum of the ledger and can be read by primary key.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ArtisanBalance, LedgerEntry, Payment
+
+# Statuses in which the platform still holds the buyer's money.
+HELD_STATUSES = {Payment.HELD, Payment.RELEASABLE, Payment.RELEASING}
+
+ZERO = Decimal("0")
+
+
+def entries_for(artisan_id, payment_id, old_status, old_amount, new_status, new_amount):
+    """Return the unsaved ledger entries for one payment change."""
+    was_held = old_status in HELD_STATUSES
+    is_held = new_status in HELD_STATUSES
+    if is_held and not was_held:
+        return [LedgerEntry(artisan_id=artisan_id, payment_id=payment_id, entry_type=LedgerEntry.HOLD, amount=new_amount)]
+    if was_held and not is_held:
+        if new_status == Payment.RELEASED:
+            entry_type = LedgerEntry.RELEASE
+        elif new_status == Payment.REFUNDED:
+            entry_type = LedgerEntry.REFUND
+        else:
+            entry_type = LedgerEntry.REVERSAL
+        return [LedgerEntry(artisan_id=artisan_id, payment_id=payment_id, entry_type=entry_type, amount=-old_amount)]
+    if is_held and new_amount != old_amount:
+        return [LedgerEntry(
+            artisan_id=artisan_id, payment_id=payment_id, entry_type=LedgerEntry.ADJUSTMENT,
+            amount=new_amount - old_amount,
+        )]
+    return []
+
+
+def record_changes(changes):
+    """
+    Record ``(artisan_id, payment_id, old_status, old_amount, new_status,
+    new_amount)`` changes. ``old_status`` is ``None`` for a new payment.
+    """
+    entries = [entry for change in changes for entry in entries_for(*change)]
+    if not entries:
+        return []
+    totals = defaultdict(lambda: {"held": ZERO, "released": ZERO, "refunded": ZERO})
+    for entry in entries:
+        total = totals[entry.artisan_id]
+        total["held"] += entry.amount
+        if entry.entry_type == LedgerEntry.RELEASE:
+            total["released"] -= entry.amount
+        elif entry.entry_type == LedgerEntry.REFUND:
+            total["refunded"] -= entry.amount
+    with transaction.atomic():
+        LedgerEntry.objects.bulk_create(entries)
+        ArtisanBalance.objects.bulk_create(
+            [ArtisanBalance(artisan_id=artisan_id) for artisan_id in totals], ignore_conflicts=True,
+        )
+        now = timezone.now()
+        for artisan_id, total in totals.items():
+            ArtisanBalance.objects.filter(artisan_id=artisan_id).update(
+                held=F('held') + total["held"],
+                released=F('released') + total["released"],
+                refunded=F('refunded') + total["refunded"],
+                updated_at=now,
+            )
+    return entries
+
+
+def record_payment(payment, old_status=None, old_amount=ZERO):
+    """Record the change of a single payment saved with ``save()``."""
+    return record_changes([
+        (payment.artisan_id, payment.pk, old_status, old_amount, payment.status, payment.amount),
+    ])
+
+
+def create_payment(**fields):
+    """Create a payment and its ledger entry in one transaction."""
+    with transaction.atomic():
+        payment = Payment.objects.create(**fields)
+        record_payment(payment)
+    return payment
+
+
+def balance_for(artisan_id):
+    """Return ``(held, released, refunded, updated_at)`` for an artisan."""
+    balance = ArtisanBalance.objects.filter(artisan_id=artisan_id).first()
+    if balance is None:
+        return ZERO, ZERO, ZERO, None
+    return balance.held, balance.released, balance.refunded, balance.updated_at
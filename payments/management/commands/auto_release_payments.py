@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from payments.services import auto_release_payments
+
+
+class Command(BaseCommand):
+    help = (
+        "Release held payments to artisans once the release window has passed. "
+        "Meant to be run on a schedule, e.g. every few minutes from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--workers', type=int, default=None, help="Concurrent B2C requests.")
+
+    def handle(self, *args, **options):
+        submitted, failed = auto_release_payments(
+            chunk_size=options['chunk_size'],
+            max_workers=options['workers'],
+        )
+        self.stdout.write(f"Submitted payouts for {submitted} payment(s), {failed} failed.")
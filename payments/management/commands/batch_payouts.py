@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from payments.models import Payment
+from payments.services import batch_payouts
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue one payout per artisan for payments confirmed more than "
+        "PAYOUT_BATCH_WINDOW seconds ago. This also retries failed payouts, "
+        "so run it on a schedule even when batching is disabled."
+    )
+
+    def handle(self, *args, **options):
+        payouts = batch_payouts()
+        payments = Payment.objects.filter(payout__in=payouts).count()
+        self.stdout.write(f"Queued {len(payouts)} payout(s) covering {payments} payment(s).")
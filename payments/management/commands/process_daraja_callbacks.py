@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.callbacks import apply_callbacks
+
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+class Command(BaseCommand):
+    help = "Apply stored Daraja callbacks to payments in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the callbacks stored so far, then exit.")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=getattr(settings, 'DARAJA_CALLBACK_POLL_INTERVAL', DEFAULT_POLL_INTERVAL),
+            help="Seconds to wait when there is nothing to apply.",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = apply_callbacks(options['batch_size'])
+            total += processed
+            if options['once']:
+                if processed:
+                    continue
+                break
+            if not processed:
+                time.sleep(options['sleep'])
+        self.stdout.write(f"Applied {total} Daraja callback(s).")
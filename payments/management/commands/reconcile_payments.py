@@ -0,0 +1,28 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from payments.reconciliation import DEFAULT_CHUNK_SIZE, reconcile
+
+
+class Command(BaseCommand):
+    help = "Reconcile payments against an M-Pesa statement CSV and write the mismatches to a report."
+
+    def add_arguments(self, parser):
+        parser.add_argument('statement', help="Path to the statement CSV export.")
+        parser.add_argument('--report', help="Mismatch report path (default: <statement>.mismatches.csv).")
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--keep-lines', action='store_true', help="Keep the loaded statement lines.")
+
+    def handle(self, *args, **options):
+        statement = options['statement']
+        report = options['report'] or f"{os.path.splitext(statement)[0]}.mismatches.csv"
+        with open(statement, newline='', encoding='utf-8-sig') as statement_file, \
+                open(report, 'w', newline='', encoding='utf-8') as report_file:
+            run = reconcile(
+                statement_file, report_file,
+                statement_name=os.path.basename(statement),
+                chunk_size=options['chunk_size'],
+                keep_lines=options['keep_lines'],
+            )
+        self.stdout.write(f"Checked {run.lines} statement line(s); {run.mismatches} mismatch(es) written to {report}.")
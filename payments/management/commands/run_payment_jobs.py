@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from payments.jobs import run_pending
+
+DEFAULT_POLL_INTERVAL = 1.0
+
+
+class Command(BaseCommand):
+    help = "Run queued payment jobs such as STK push initiation."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run the jobs that are due now, then exit.")
+        parser.add_argument('--batch-size', type=int, default=10)
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=getattr(settings, 'PAYMENT_JOB_POLL_INTERVAL', DEFAULT_POLL_INTERVAL),
+            help="Seconds to wait when the queue is empty.",
+        )
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = run_pending(options['batch_size'])
+            total += processed
+            if options['once']:
+                if processed:
+                    continue
+                break
+            if not processed:
+                time.sleep(options['sleep'])
+        self.stdout.write(f"Ran {total} payment job(s).")
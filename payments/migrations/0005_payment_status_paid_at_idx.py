@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0009_order_custom_request"),
+        ("payments", "0004_payment_jobs"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="payment",
+            index=models.Index(
+                fields=["status", "paid_at"], name="payment_status_paid_at_idx"
+            ),
+        ),
+    ]
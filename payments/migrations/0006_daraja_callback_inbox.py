@@ -0,0 +1,58 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0005_payment_status_paid_at_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="payment",
+            name="mpesa_receipt_number",
+            field=models.CharField(blank=True, max_length=30, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="payment",
+            name="checkout_request_id",
+            field=models.CharField(blank=True, max_length=100, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name="DarajaCallback",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "kind",
+                    models.CharField(choices=[("stk_push", "STK push")], max_length=30),
+                ),
+                (
+                    "checkout_request_id",
+                    models.CharField(blank=True, db_index=True, max_length=100),
+                ),
+                ("payload", models.JSONField()),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+                ("processed_at", models.DateTimeField(blank=True, null=True)),
+                ("outcome", models.CharField(blank=True, max_length=20)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("processed_at__isnull", True)),
+                        fields=["id"],
+                        name="daraja_callback_unprocessed",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,113 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0006_daraja_callback_inbox"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name="darajacallback",
+            old_name="checkout_request_id",
+            new_name="reference",
+        ),
+        migrations.AlterField(
+            model_name="darajacallback",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("stk_push", "STK push"),
+                    ("b2c_result", "B2C result"),
+                    ("b2c_timeout", "B2C timeout"),
+                ],
+                max_length=30,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="paymentjob",
+            name="kind",
+            field=models.CharField(
+                choices=[("stk_push", "STK push"), ("b2c_payout", "B2C payout")],
+                max_length=30,
+            ),
+        ),
+        migrations.CreateModel(
+            name="Payout",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("amount", models.DecimalField(decimal_places=2, max_digits=10)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("submitted", "Submitted"),
+                            ("settled", "Settled"),
+                            ("failed", "Failed"),
+                        ],
+                        default="queued",
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "originator_conversation_id",
+                    models.CharField(
+                        blank=True, max_length=100, null=True, unique=True
+                    ),
+                ),
+                ("conversation_id", models.CharField(blank=True, max_length=100)),
+                ("transaction_id", models.CharField(blank=True, max_length=30)),
+                ("result_code", models.CharField(blank=True, max_length=20)),
+                ("result_desc", models.CharField(blank=True, max_length=255)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("submitted_at", models.DateTimeField(blank=True, null=True)),
+                ("settled_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "artisan",
+                    models.ForeignKey(
+                        limit_choices_to={"user_type": "artisan"},
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="payouts",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="payment",
+            name="payout",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="payments",
+                to="payments.payout",
+            ),
+        ),
+        migrations.AddField(
+            model_name="paymentjob",
+            name="payout",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="jobs",
+                to="payments.payout",
+            ),
+        ),
+    ]
@@ -0,0 +1,137 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+HELD_STATUSES = ("held", "releasable", "releasing")
+
+
+def backfill_ledger(apps, schema_editor):
+    """Open the ledger with one entry per existing held, released or refunded payment."""
+    Payment = apps.get_model("payments", "Payment")
+    LedgerEntry = apps.get_model("payments", "LedgerEntry")
+    ArtisanBalance = apps.get_model("payments", "ArtisanBalance")
+    entry_types = {"released": "release", "refunded": "refund"}
+    balances = {}
+    entries = []
+    for payment in Payment.objects.filter(
+        status__in=HELD_STATUSES + tuple(entry_types)
+    ).iterator():
+        balance = balances.setdefault(
+            payment.artisan_id, ArtisanBalance(artisan_id=payment.artisan_id)
+        )
+        entries.append(
+            LedgerEntry(
+                artisan_id=payment.artisan_id,
+                payment_id=payment.id,
+                entry_type="hold",
+                amount=payment.amount,
+            )
+        )
+        if payment.status in HELD_STATUSES:
+            balance.held += payment.amount
+            continue
+        entries.append(
+            LedgerEntry(
+                artisan_id=payment.artisan_id,
+                payment_id=payment.id,
+                entry_type=entry_types[payment.status],
+                amount=-payment.amount,
+            )
+        )
+        if payment.status == "released":
+            balance.released += payment.amount
+        else:
+            balance.refunded += payment.amount
+    LedgerEntry.objects.bulk_create(entries, batch_size=1000)
+    ArtisanBalance.objects.bulk_create(balances.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0009_reconciliation"),
+        ("users", "0004_artisanprofile_lat_lon_idx"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArtisanBalance",
+            fields=[
+                (
+                    "artisan",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="balance",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "held",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                (
+                    "released",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                (
+                    "refunded",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=12),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="LedgerEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "entry_type",
+                    models.CharField(
+                        choices=[
+                            ("hold", "Hold"),
+                            ("release", "Release"),
+                            ("refund", "Refund"),
+                            ("reversal", "Reversal"),
+                            ("adjustment", "Adjustment"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("amount", models.DecimalField(decimal_places=2, max_digits=12)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "artisan",
+                    models.ForeignKey(
+                        limit_choices_to={"user_type": "artisan"},
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ledger_entries",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "payment",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="ledger_entries",
+                        to="payments.payment",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
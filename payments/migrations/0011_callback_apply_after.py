@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:03
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0010_earnings_ledger"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="darajacallback",
+            name="daraja_callback_unprocessed",
+        ),
+        migrations.AddField(
+            model_name="darajacallback",
+            name="apply_after",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name="darajacallback",
+            index=models.Index(
+                condition=models.Q(("processed_at__isnull", True)),
+                fields=["apply_after", "id"],
+                name="daraja_callback_unprocessed",
+            ),
+        ),
+    ]
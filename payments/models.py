@@ -1,9 +1,56 @@
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from orders.models import Order
 from users.models import User
 
+class Payout(models.Model):
+    """
+    A B2C transfer to an artisan. It is ``queued`` until the worker sends it,
+    ``submitted`` once Safaricom accepts the request, and ``settled`` or
+    ``failed`` when the result (or timeout) callback arrives.
+    """
+    QUEUED = 'queued'
+    SUBMITTED = 'submitted'
+    SETTLED = 'settled'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (SUBMITTED, 'Submitted'),
+        (SETTLED, 'Settled'),
+        (FAILED, 'Failed'),
+    ]
+
+    artisan = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        limit_choices_to={'user_type': 'artisan'},
+        related_name='payouts'
+    )
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    originator_conversation_id = models.CharField(max_length=100, null=True, blank=True, unique=True)
+    conversation_id = models.CharField(max_length=100, blank=True)
+    transaction_id = models.CharField(max_length=30, blank=True)
+    result_code = models.CharField(max_length=20, blank=True)
+    result_desc = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    submitted_at = models.DateTimeField(null=True, blank=True)
+    settled_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Payout of {self.amount} to {self.artisan} ({self.status})"
+
+
 class Payment(models.Model):
+    PENDING = 'pending'
+    HELD = 'held'
+    RELEASABLE = 'releasable'
+    RELEASING = 'releasing'
+    RELEASED = 'released'
+    REFUNDED = 'refunded'
+    FAILED = 'failed'
+
     artisan = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -18,10 +65,208 @@ class Payment(models.Model):
     )
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     transaction_code = models.CharField(max_length=50)
+    checkout_request_id = models.CharField(max_length=100, null=True, blank=True, unique=True)
+    mpesa_receipt_number = models.CharField(max_length=30, null=True, blank=True, unique=True)
     status = models.CharField(max_length=20)
-    paid_at = models.DateTimeField()
+    paid_at = models.DateTimeField(null=True, blank=True)
+    releasable_at = models.DateTimeField(null=True, blank=True)
     released_at = models.DateTimeField(null=True, blank=True)
     held_by_platform = models.BooleanField(default=True)
+    payout = models.ForeignKey(
+        Payout,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='payments'
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'paid_at'], name='payment_status_paid_at_idx'),
+            models.Index(fields=['status', 'artisan', 'releasable_at'], name='payment_releasable_idx'),
+        ]
 
     def __str__(self):
         return f"Payment of {self.amount} by {self.artisan}"
+
+
+class PaymentJob(models.Model):
+    """
+    A unit of payment work (such as initiating an STK push) queued in the
+    database and executed by the ``run_payment_jobs`` worker command.
+    """
+    STK_PUSH = 'stk_push'
+    B2C_PAYOUT = 'b2c_payout'
+    KIND_CHOICES = [
+        (STK_PUSH, 'STK push'),
+        (B2C_PAYOUT, 'B2C payout'),
+    ]
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    payment = models.ForeignKey(
+        Payment,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='jobs'
+    )
+    payout = models.ForeignKey(
+        Payout,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='jobs'
+    )
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='payment_job_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
+
+
+class DarajaCallback(models.Model):
+    """
+    Raw callback from Safaricom, stored as received. Rows are only ever
+    inserted by the callback view; ``process_daraja_callbacks`` applies them
+    to payments and stamps ``processed_at`` and ``outcome``. A callback that
+    arrives before its payment or payout is recorded is looked at again from
+    ``apply_after``.
+    """
+    STK_PUSH = 'stk_push'
+    B2C_RESULT = 'b2c_result'
+    B2C_TIMEOUT = 'b2c_timeout'
+    KIND_CHOICES = [
+        (STK_PUSH, 'STK push'),
+        (B2C_RESULT, 'B2C result'),
+        (B2C_TIMEOUT, 'B2C timeout'),
+    ]
+
+    APPLIED = 'applied'
+    DUPLICATE = 'duplicate'
+    UNMATCHED = 'unmatched'
+    INVALID = 'invalid'
+    AMOUNT_MISMATCH = 'amount_mismatch'
+
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    # CheckoutRequestID for STK callbacks, OriginatorConversationID for B2C.
+    reference = models.CharField(max_length=100, blank=True, db_index=True)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    apply_after = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    outcome = models.CharField(max_length=20, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['apply_after', 'id'],
+                name='daraja_callback_unprocessed',
+                condition=models.Q(processed_at__isnull=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} callback {self.reference}"
+
+
+class ReconciliationRun(models.Model):
+    """One ``reconcile_payments`` run against a Safaricom statement export."""
+    statement = models.CharField(max_length=255)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    lines = models.PositiveIntegerField(default=0)
+    mismatches = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Reconciliation of {self.statement} ({self.mismatches} mismatches)"
+
+
+class StatementLine(models.Model):
+    """
+    A paid-in line of a statement, loaded in chunks so matching against
+    payments can run as indexed queries instead of in memory.
+    """
+    run = models.ForeignKey(ReconciliationRun, on_delete=models.CASCADE, related_name='statement_lines')
+    line_number = models.PositiveIntegerField()
+    receipt_number = models.CharField(max_length=30)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    status = models.CharField(max_length=30, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['run', 'receipt_number'], name='statement_line_receipt_idx'),
+        ]
+
+
+class LedgerEntry(models.Model):
+    """
+    Append-only record of every change to the money the platform holds for
+    an artisan. ``amount`` is the signed change to the held balance.
+    """
+    HOLD = 'hold'
+    RELEASE = 'release'
+    REFUND = 'refund'
+    REVERSAL = 'reversal'
+    ADJUSTMENT = 'adjustment'
+    ENTRY_TYPE_CHOICES = [
+        (HOLD, 'Hold'),
+        (RELEASE, 'Release'),
+        (REFUND, 'Refund'),
+        (REVERSAL, 'Reversal'),
+        (ADJUSTMENT, 'Adjustment'),
+    ]
+
+    artisan = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        limit_choices_to={'user_type': 'artisan'},
+        related_name='ledger_entries'
+    )
+    payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, related_name='ledger_entries')
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPE_CHOICES)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.entry_type} {self.amount} for {self.artisan}"
+
+
+class ArtisanBalance(models.Model):
+    """Running totals of an artisan's ledger, updated with each entry."""
+    artisan = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='balance'
+    )
+    held = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    released = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    refunded = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.artisan} holds {self.held}"
@@ -0,0 +1,162 @@
+"""
+Reconcile payments against an M-Pesa statement export.
+
+The statement is streamed row by row and loaded into ``StatementLine`` in
+chunks, so memory use does not depend on its size. Matching then runs as
+indexed queries joining statement lines to payments on the M-Pesa receipt
+number, and mismatches are streamed out to a CSV report.
+"""
+import csv
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db.models import Exists, Max, Min, OuterRef, Subquery
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Payment, ReconciliationRun, StatementLine
+
+RECEIPT_COLUMN = "Receipt No."
+AMOUNT_COLUMN = "Paid In"
+STATUS_COLUMN = "Transaction Status"
+COMPLETED_COLUMN = "Completion Time"
+COMPLETED_STATUS = "Completed"
+DEFAULT_CHUNK_SIZE = 5000
+
+MISSING_PAYMENT = 'missing_payment'
+AMOUNT_MISMATCH = 'amount_mismatch'
+STATUS_MISMATCH = 'status_mismatch'
+MISSING_FROM_STATEMENT = 'missing_from_statement'
+
+Mismatch = namedtuple('Mismatch', [
+    'kind', 'line_number', 'receipt_number', 'statement_amount', 'payment_id', 'payment_amount', 'payment_status',
+])
+
+
+def read_statement(file):
+    """
+    Yield ``(line_number, row)`` for each line after the header row, skipping
+    the account summary Safaricom puts above it.
+    """
+    header = None
+    for line_number, cells in enumerate(csv.reader(file), start=1):
+        cells = [cell.strip() for cell in cells]
+        if header is None:
+            if RECEIPT_COLUMN in cells:
+                header = cells
+            continue
+        if any(cells):
+            yield line_number, dict(zip(header, cells))
+
+
+def _parse_amount(value):
+    try:
+        return Decimal((value or "").replace(",", ""))
+    except InvalidOperation:
+        return None
+
+
+def _parse_time(value):
+    try:
+        parsed = parse_datetime(value or "")
+    except ValueError:
+        return None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def statement_lines(rows, run):
+    """Turn statement rows into unsaved ``StatementLine`` objects for money paid in."""
+    for line_number, row in rows:
+        receipt_number = row.get(RECEIPT_COLUMN, "")
+        amount = _parse_amount(row.get(AMOUNT_COLUMN))
+        if not receipt_number or amount is None or amount <= 0:
+            continue
+        yield StatementLine(
+            run=run,
+            line_number=line_number,
+            receipt_number=receipt_number[:30],
+            amount=amount,
+            status=row.get(STATUS_COLUMN, "")[:30],
+            completed_at=_parse_time(row.get(COMPLETED_COLUMN)),
+        )
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def load_statement(run, file, chunk_size=DEFAULT_CHUNK_SIZE):
+    loaded = 0
+    for chunk in _chunks(statement_lines(read_statement(file), run), chunk_size):
+        StatementLine.objects.bulk_create(chunk)
+        loaded += len(chunk)
+    return loaded
+
+
+def find_mismatches(run, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield ``Mismatch`` tuples: statement lines with no payment, a different
+    amount or a payment we consider unpaid, then payments with a receipt from
+    the statement's period that the statement does not contain.
+    """
+    payment = Payment.objects.filter(mpesa_receipt_number=OuterRef('receipt_number'))
+    lines = run.statement_lines.annotate(
+        payment_id=Subquery(payment.values('id')[:1]),
+        payment_amount=Subquery(payment.values('amount')[:1]),
+        payment_status=Subquery(payment.values('status')[:1]),
+    ).order_by('line_number')
+    for line in lines.iterator(chunk_size=chunk_size):
+        if line.payment_id is None:
+            kind = MISSING_PAYMENT
+        elif line.payment_amount != line.amount:
+            kind = AMOUNT_MISMATCH
+        elif line.status == COMPLETED_STATUS and line.payment_status in (Payment.PENDING, Payment.FAILED):
+            kind = STATUS_MISMATCH
+        else:
+            continue
+        yield Mismatch(
+            kind, line.line_number, line.receipt_number, line.amount,
+            line.payment_id, line.payment_amount, line.payment_status,
+        )
+
+    period = run.statement_lines.aggregate(start=Min('completed_at'), end=Max('completed_at'))
+    if period['start'] is None:
+        return
+    on_statement = run.statement_lines.filter(receipt_number=OuterRef('mpesa_receipt_number'))
+    missing = Payment.objects.filter(
+        ~Exists(on_statement),
+        mpesa_receipt_number__isnull=False,
+        paid_at__range=(period['start'], period['end']),
+    ).order_by('id')
+    for payment in missing.only('id', 'mpesa_receipt_number', 'amount', 'status').iterator(chunk_size=chunk_size):
+        yield Mismatch(
+            MISSING_FROM_STATEMENT, None, payment.mpesa_receipt_number, None,
+            payment.id, payment.amount, payment.status,
+        )
+
+
+def reconcile(statement_file, report_file, statement_name="", chunk_size=DEFAULT_CHUNK_SIZE, keep_lines=False):
+    """
+    Load ``statement_file``, write every mismatch to ``report_file`` as CSV
+    and return the finished ``ReconciliationRun``.
+    """
+    run = ReconciliationRun.objects.create(statement=statement_name[:255])
+    run.lines = load_statement(run, statement_file, chunk_size)
+    writer = csv.writer(report_file)
+    writer.writerow(Mismatch._fields)
+    for mismatch in find_mismatches(run, chunk_size):
+        writer.writerow(mismatch)
+        run.mismatches += 1
+    if not keep_lines:
+        run.statement_lines.all().delete()
+    run.finished_at = timezone.now()
+    run.save(update_fields=['lines', 'mismatches', 'finished_at'])
+    return run
@@ -0,0 +1,206 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from api.circuit_breaker import CircuitOpenError, daraja_breaker
+from api.daraja import get_daraja
+from . import jobs
+from .models import Payment, PaymentJob, Payout
+from .transitions import TransitionError, return_failed_payouts, transition_payments
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AUTO_RELEASE_AFTER = 24 * 60 * 60
+DEFAULT_AUTO_RELEASE_CHUNK_SIZE = 100
+DEFAULT_AUTO_RELEASE_WORKERS = 4
+
+NOT_SENT = (requests.ConnectionError, CircuitOpenError)
+
+
+def releasable_payments(now=None):
+    """
+    Held payments older than ``PAYMENT_AUTO_RELEASE_AFTER`` seconds whose
+    delivery has not been confirmed, served by the (status, paid_at) index.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=getattr(settings, 'PAYMENT_AUTO_RELEASE_AFTER', DEFAULT_AUTO_RELEASE_AFTER))
+    return (
+        Payment.objects.filter(status=Payment.HELD, paid_at__lt=cutoff)
+        .exclude(order__delivery_confirmed=True)
+        .select_related('artisan')
+        .order_by('id')
+    )
+
+
+def queue_payout(artisan, payments, transaction_desc=""):
+    """
+    Create a queued payout to ``artisan`` for ``payments``, which must be
+    ``held`` or ``releasable``, and enqueue the job that submits it. The
+    payments are ``releasing`` until the payout settles.
+    """
+    with transaction.atomic():
+        payout = Payout.objects.create(artisan=artisan, amount=sum(payment.amount for payment in payments))
+        moved = transition_payments(
+            Payment.objects.filter(
+                id__in=[payment.id for payment in payments],
+                status__in=[Payment.HELD, Payment.RELEASABLE],
+            ),
+            Payment.RELEASING, payout=payout,
+        )
+        if moved != len(payments):
+            raise TransitionError("Payment can no longer be released.")
+        jobs.enqueue(PaymentJob.B2C_PAYOUT, {"transaction_desc": transaction_desc}, payout=payout)
+    return payout
+
+
+def _pay_out(daraja, payment):
+    """Send the B2C request for ``payment.payout``; return the response, or the error raised."""
+    try:
+        return daraja.b2c_payment(
+            artisan_phone=payment.artisan.phone_number,
+            amount=payment.amount,
+            transaction_id=f"payout-{payment.payout.pk}",
+            transaction_desc="Auto-release after 24hr",
+        )
+    except Exception as exc:
+        return exc
+
+
+def sweep_interrupted_payouts(now=None):
+    """
+    Mark auto-release payouts that were recorded but never got an outcome,
+    because the run died while sending them, as ``submitted``. The request may
+    have reached Safaricom, so the result callback or a person settles them
+    rather than another payout. Returns how many were found.
+    """
+    now = now or timezone.now()
+    stale = now - timedelta(seconds=getattr(settings, 'PAYMENT_JOB_LOCK_TIMEOUT', jobs.DEFAULT_LOCK_TIMEOUT))
+    interrupted = list(
+        Payout.objects.filter(status=Payout.QUEUED, jobs__isnull=True, created_at__lt=stale).values_list('id', flat=True)
+    )
+    for payout_id in interrupted:
+        logger.warning("Auto-release payout %s was interrupted, leaving it submitted", payout_id)
+        Payout.objects.filter(id=payout_id, status=Payout.QUEUED).update(
+            status=Payout.SUBMITTED,
+            originator_conversation_id=f"payout-{payout_id}",
+            result_desc="Outcome unknown: auto-release was interrupted",
+            submitted_at=now,
+        )
+    return len(interrupted)
+
+
+def auto_release_payments(now=None, chunk_size=None, max_workers=None):
+    """
+    Pay artisans for held payments that are past the release window.
+
+    Payments are claimed in id-ordered chunks: in one transaction they are
+    locked, moved to ``releasing`` (so a concurrent delivery confirmation
+    cannot pay them out too) and given a queued ``Payout`` each. The B2C
+    requests go out through a bounded thread pool sharing one Daraja client,
+    and the outcomes are written with one ``bulk_update`` per chunk. Rejected
+    payouts fail and their payments go back on hold; a payout whose outcome
+    is unknown (a timeout or a 5xx) stays ``submitted``, like an accepted one,
+    and the B2C result callback completes the release. No further chunks are
+    claimed while the Daraja circuit breaker is open; those payments stay held
+    for the next run. Returns ``(submitted, failed)``.
+    """
+    now = now or timezone.now()
+    chunk_size = chunk_size or getattr(settings, 'PAYMENT_AUTO_RELEASE_CHUNK_SIZE', DEFAULT_AUTO_RELEASE_CHUNK_SIZE)
+    max_workers = max_workers or getattr(settings, 'PAYMENT_AUTO_RELEASE_WORKERS', DEFAULT_AUTO_RELEASE_WORKERS)
+    sweep_interrupted_payouts(now)
+    queryset = releasable_payments(now)
+    daraja = get_daraja()
+    submitted = failed = 0
+    last_id = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            if daraja_breaker.is_open():
+                logger.warning("Daraja circuit open, stopping auto-release until the next run")
+                break
+            with transaction.atomic():
+                chunk = list(
+                    queryset.select_for_update(skip_locked=True, of=('self',)).filter(id__gt=last_id)[:chunk_size]
+                )
+                if not chunk:
+                    break
+                transition_payments(Payment.objects.filter(id__in=[payment.id for payment in chunk]), Payment.RELEASING)
+                payouts = Payout.objects.bulk_create([
+                    Payout(artisan_id=payment.artisan_id, amount=payment.amount) for payment in chunk
+                ])
+                for payment, payout in zip(chunk, payouts):
+                    payment.payout = payout
+                Payment.objects.bulk_update(chunk, ['payout'])
+            last_id = chunk[-1].id
+            rejected = []
+            for payment, response in zip(chunk, pool.map(lambda payment: _pay_out(daraja, payment), chunk)):
+                payout = payment.payout
+                payout.submitted_at = now
+                reference = f"payout-{payout.pk}"
+                if isinstance(response, Exception):
+                    # Refused, or never sent at all: the payments can be paid out again later.
+                    if isinstance(response, NOT_SENT) or jobs.is_rejection(response):
+                        logger.error("Auto-release payout failed for payment %s: %s", payment.pk, response)
+                        payout.status = Payout.FAILED
+                        rejected.append(payout.pk)
+                        continue
+                    logger.warning("Auto-release payout for payment %s outcome unknown: %s", payment.pk, response)
+                    payout.status = Payout.SUBMITTED
+                    payout.originator_conversation_id = reference
+                    payout.result_desc = f"Outcome unknown: {response}"[:255]
+                elif str(response.get('ResponseCode')) != '0':
+                    logger.error("Auto-release payout rejected for payment %s: %s", payment.pk, response)
+                    payout.status = Payout.FAILED
+                    rejected.append(payout.pk)
+                    continue
+                else:
+                    payout.status = Payout.SUBMITTED
+                    payout.originator_conversation_id = response.get('OriginatorConversationID') or reference
+                    payout.conversation_id = response.get('ConversationID', '')
+            with transaction.atomic():
+                Payout.objects.bulk_update(
+                    [payment.payout for payment in chunk],
+                    ['status', 'originator_conversation_id', 'conversation_id', 'result_desc', 'submitted_at'],
+                )
+                return_failed_payouts(rejected)
+            submitted += len(chunk) - len(rejected)
+            failed += len(rejected)
+    return submitted, failed
+
+
+def batch_payouts(now=None):
+    """
+    Queue one payout per artisan for their ``releasable`` payments once the
+    oldest of them has waited ``PAYOUT_BATCH_WINDOW`` seconds. A failed payout
+    returns the payments of confirmed orders to ``releasable``, so they are
+    retried here. Returns the payouts queued.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=getattr(settings, 'PAYOUT_BATCH_WINDOW', 0))
+    due = (
+        Payment.objects.filter(status=Payment.RELEASABLE)
+        .values('artisan_id')
+        .annotate(oldest=Min('releasable_at'))
+        .filter(oldest__lte=cutoff)
+        .values_list('artisan_id', flat=True)
+    )
+    payouts = []
+    for artisan_id in list(due):
+        with transaction.atomic():
+            payments = list(
+                Payment.objects.select_for_update(skip_locked=True, of=('self',))
+                .filter(artisan_id=artisan_id, status=Payment.RELEASABLE)
+                .select_related('artisan')
+            )
+            if not payments:
+                continue
+            payouts.append(queue_payout(
+                payments[0].artisan, payments,
+                transaction_desc=f"Payout for {len(payments)} order(s)",
+            ))
+    return payouts
@@ -0,0 +1,45 @@
+"""
+Test fixtures for code that moves payments.
+"""
+import uuid
+from decimal import Decimal
+
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from orders.models import Order
+from users.models import User
+
+from .ledger import create_payment
+from .models import Payment
+
+
+class PaymentFixturesMixin:
+    """
+    A buyer, an artisan and one order between them, plus factories for more
+    orders and for payments recorded through the ledger.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.buyer = User.objects.create(
+            email="buyer@example.com", phone_number="0711000001", user_type=User.BUYER,
+        )
+        self.artisan = User.objects.create(
+            email="artisan@example.com", phone_number="0711000002", user_type=User.ARTISAN,
+        )
+        self.order = self.create_order()
+
+    def create_order(self, artisan=None, total_amount="1500.00", **fields):
+        return Order.objects.create(
+            buyer=self.buyer, artisan=artisan or self.artisan, order_type="ready-made",
+            total_amount=Decimal(total_amount), **fields,
+        )
+
+    def create_payment(self, order=None, amount="1500.00", status=Payment.HELD, **fields):
+        order = order or self.order
+        if status != Payment.PENDING:
+            fields.setdefault('paid_at', timezone.now())
+        fields.setdefault('transaction_code', f"ORDER-{uuid.uuid4().hex[:8]}")
+        return create_payment(order=order, artisan=order.artisan, amount=Decimal(amount), status=status, **fields)
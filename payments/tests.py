@@ -0,0 +1,782 @@
+import csv
+import datetime
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+import requests
+from django.contrib import admin
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.models import Sum
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from api.daraja import DarajaAPI
+from api.daraja_stub import B2C_PATH, OAUTH_PATH, STK_PUSH_PATH
+from api.testing import DarajaStubMixin
+from users.models import User
+
+from . import jobs as payment_jobs
+from .callbacks import apply_callbacks
+from .models import ArtisanBalance, DarajaCallback, LedgerEntry, Payment, PaymentJob, Payout, ReconciliationRun, StatementLine
+from .reconciliation import load_statement, read_statement
+from .services import auto_release_payments, batch_payouts, releasable_payments
+from .testing import PaymentFixturesMixin
+from .transitions import TransitionError, confirm_delivery, refund_order, transition_payments
+
+
+class PaymentJobQueueTests(DarajaStubMixin, PaymentFixturesMixin, TestCase):
+    daraja_settings = {"PAYMENT_JOB_RETRY_DELAY": 0}
+
+    def queue_stk_push(self):
+        response = self.client.post(reverse('daraja-stk-push'), {
+            "order_id": self.order.id,
+            "amount": "1500.00",
+            "transaction_code": "ORDER-1",
+            "transaction_desc": "Order payment",
+        }, format='json')
+        self.assertEqual(response.status_code, 202)
+        return Payment.objects.get(id=response.data["payment_id"])
+
+    def test_view_queues_job_without_calling_daraja(self):
+        payment = self.queue_stk_push()
+        self.assertEqual(payment.status, Payment.PENDING)
+        self.assertIsNone(payment.paid_at)
+        job = payment.jobs.get()
+        self.assertEqual(job.kind, PaymentJob.STK_PUSH)
+        self.assertEqual(job.status, PaymentJob.QUEUED)
+        self.assertEqual(job.payload["buyer_phone"], "0711000001")
+        self.assertEqual(sum(self.stub.calls.values()), 0)
+
+    def test_worker_runs_stk_push(self):
+        payment = self.queue_stk_push()
+        call_command('run_payment_jobs', '--once', stdout=StringIO())
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.PENDING)
+        self.assertTrue(payment.checkout_request_id.startswith("ws_CO_stub_"))
+        self.assertIsNone(payment.paid_at)
+        self.assertEqual(payment.jobs.get().status, PaymentJob.SUCCEEDED)
+        self.assertEqual(self.stub.calls[STK_PUSH_PATH], 1)
+        # Only the buyer's confirmation, through the STK callback, holds the money.
+        DarajaCallback.objects.create(
+            kind=DarajaCallback.STK_PUSH, reference=payment.checkout_request_id,
+            payload=stk_callback_body(payment.checkout_request_id),
+        )
+        apply_callbacks()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.HELD)
+        self.assertIsNotNone(payment.paid_at)
+        self.assertEqual(LedgerEntry.objects.get(payment=payment).entry_type, LedgerEntry.HOLD)
+
+    def test_rejected_stk_push_fails_payment(self):
+        payment = self.queue_stk_push()
+        DarajaAPI().get_access_token()
+        self.stub.status_codes[STK_PUSH_PATH] = 400
+        with self.assertLogs("payments.jobs", level="ERROR"):
+            call_command('run_payment_jobs', '--once', stdout=StringIO())
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.FAILED)
+        self.assertEqual(payment.jobs.get().status, PaymentJob.FAILED)
+
+    def test_connection_error_is_retried(self):
+        payment = self.queue_stk_push()
+        with patch('api.daraja.DarajaAPI.stk_push', side_effect=requests.ConnectionError("refused")):
+            with self.assertLogs("payments.jobs", level="WARNING"):
+                self.assertEqual(payment_jobs.run_pending(), 1)
+        job = payment.jobs.get()
+        self.assertEqual(job.status, PaymentJob.QUEUED)
+        self.assertEqual(job.attempts, 1)
+        payment_jobs.run_pending()
+        payment.refresh_from_db()
+        self.assertTrue(payment.checkout_request_id)
+        self.assertEqual(payment.jobs.get().attempts, 2)
+
+    def test_job_claimed_only_once(self):
+        self.queue_stk_push()
+        self.assertEqual(len(payment_jobs.claim_jobs()), 1)
+        self.assertEqual(payment_jobs.claim_jobs(), [])
+
+    def test_stale_running_job_is_reclaimed(self):
+        payment = self.queue_stk_push()
+        payment_jobs.claim_jobs()
+        PaymentJob.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        claimed = payment_jobs.claim_jobs()
+        self.assertEqual([job.payment_id for job in claimed], [payment.id])
+        self.assertEqual(claimed[0].attempts, 2)
+
+    def test_status_endpoint_reports_progress(self):
+        payment = self.queue_stk_push()
+        url = reverse('payments-job-status', args=[payment.id])
+        response = self.client.get(url)
+        self.assertEqual(response.data["status"], Payment.PENDING)
+        self.assertEqual(response.data["job"]["status"], PaymentJob.QUEUED)
+        self.assertEqual(response["Retry-After"], "2")
+        payment_jobs.run_pending()
+        response = self.client.get(url)
+        self.assertEqual(response.data["status"], Payment.PENDING)
+        self.assertEqual(response.data["job"]["status"], PaymentJob.SUCCEEDED)
+
+
+class AutoReleasePaymentsTests(DarajaStubMixin, PaymentFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.old = timezone.now() - timedelta(days=2)
+
+    def old_payment(self, paid_at=None, delivery_confirmed=False, status=Payment.HELD):
+        order = self.create_order(total_amount="100.00", delivery_confirmed=delivery_confirmed)
+        return self.create_payment(order=order, amount="100.00", status=status, paid_at=paid_at or self.old)
+
+    def test_releases_only_eligible_payments(self):
+        eligible = [self.old_payment() for _ in range(3)]
+        recent = self.old_payment(paid_at=timezone.now())
+        confirmed = self.old_payment(delivery_confirmed=True)
+        pending = self.old_payment(status=Payment.PENDING)
+        out = StringIO()
+        call_command('auto_release_payments', '--chunk-size', '2', stdout=out)
+        self.assertIn("Submitted payouts for 3 payment(s), 0 failed.", out.getvalue())
+        for payment in eligible:
+            payment.refresh_from_db()
+            self.assertEqual(payment.status, Payment.RELEASING)
+            self.assertEqual(payment.payout.status, Payout.SUBMITTED)
+            self.assertEqual(payment.payout.originator_conversation_id, f"payout-{payment.payout.pk}")
+        for payment in (recent, confirmed, pending):
+            payment.refresh_from_db()
+            self.assertIsNone(payment.payout)
+        self.assertEqual(self.stub.calls[B2C_PATH], 3)
+        self.assertEqual(self.stub.calls[OAUTH_PATH], 1)
+
+    def test_rejected_payout_stays_held(self):
+        payment = self.old_payment()
+        DarajaAPI().get_access_token()
+        self.stub.status_codes[B2C_PATH] = 400
+        with self.assertLogs("payments.services", level="ERROR"):
+            self.assertEqual(auto_release_payments(), (0, 1))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.HELD)
+        self.assertIsNone(payment.payout)
+        self.assertEqual(Payout.objects.get().status, Payout.FAILED)
+
+    def test_unknown_outcome_stays_releasing(self):
+        payment = self.old_payment()
+        DarajaAPI().get_access_token()
+        self.stub.status_codes[B2C_PATH] = 500
+        with self.assertLogs("payments.services", level="WARNING"):
+            self.assertEqual(auto_release_payments(), (1, 0))
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.RELEASING)
+        self.assertEqual(payment.payout.status, Payout.SUBMITTED)
+        self.assertEqual(payment.payout.originator_conversation_id, f"payout-{payment.payout.pk}")
+        self.stub.status_codes.clear()
+        self.assertEqual(auto_release_payments(), (0, 0))
+        self.assertEqual(self.stub.calls[B2C_PATH], 1)
+
+    def test_interrupted_run_is_swept(self):
+        payment = self.old_payment()
+        with patch('payments.services._pay_out', side_effect=SystemExit):
+            with self.assertRaises(SystemExit):
+                auto_release_payments()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.RELEASING)
+        self.assertEqual(payment.payout.status, Payout.QUEUED)
+        self.assertEqual(auto_release_payments(), (0, 0))
+        with self.assertLogs("payments.services", level="WARNING"):
+            auto_release_payments(now=timezone.now() + timedelta(hours=1))
+        payment.payout.refresh_from_db()
+        self.assertEqual(payment.payout.status, Payout.SUBMITTED)
+        self.assertEqual(self.stub.calls[B2C_PATH], 0)
+
+    def test_query_count_does_not_grow_with_payments(self):
+        DarajaAPI().get_access_token()
+        for _ in range(2):
+            self.old_payment()
+        with CaptureQueriesContext(connection) as small:
+            auto_release_payments(chunk_size=10)
+        for _ in range(8):
+            self.old_payment()
+        with CaptureQueriesContext(connection) as large:
+            auto_release_payments(chunk_size=10)
+        self.assertEqual(len(small), len(large))
+
+    def test_eligible_rows_use_status_paid_at_index(self):
+        sql, params = releasable_payments().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = " ".join(str(row) for row in cursor.fetchall())
+        self.assertIn("payment_status_paid_at_idx", plan)
+
+
+def stk_callback_body(checkout_request_id, result_code=0, amount=1500, receipt="QKX123ABC"):
+    body = {"stkCallback": {
+        "MerchantRequestID": "29115-34620561-1",
+        "CheckoutRequestID": checkout_request_id,
+        "ResultCode": result_code,
+        "ResultDesc": "The service request is processed successfully.",
+    }}
+    if result_code == 0:
+        body["stkCallback"]["CallbackMetadata"] = {"Item": [
+            {"Name": "Amount", "Value": amount},
+            {"Name": "MpesaReceiptNumber", "Value": receipt},
+            {"Name": "PhoneNumber", "Value": 254708374149},
+        ]}
+    return {"Body": body}
+
+
+class DarajaCallbackInboxTests(PaymentFixturesMixin, TestCase):
+
+    def post_callback(self, body):
+        response = self.client.post(reverse('daraja-callback'), body, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["ResultCode"], 0)
+
+    def test_callback_is_stored_in_one_insert(self):
+        with self.assertNumQueries(1):
+            self.post_callback(stk_callback_body("ws_CO_1"))
+        callback = DarajaCallback.objects.get()
+        self.assertEqual(callback.reference, "ws_CO_1")
+        self.assertIsNone(callback.processed_at)
+
+    def test_successful_callback_applied(self):
+        payment = self.create_payment(checkout_request_id="ws_CO_1", status=Payment.PENDING)
+        self.post_callback(stk_callback_body("ws_CO_1"))
+        call_command('process_daraja_callbacks', '--once', stdout=StringIO())
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.HELD)
+        self.assertEqual(payment.mpesa_receipt_number, "QKX123ABC")
+        self.assertIsNotNone(payment.paid_at)
+        self.assertEqual(DarajaCallback.objects.get().outcome, DarajaCallback.APPLIED)
+
+    def test_amount_mismatch_is_flagged(self):
+        payment = self.create_payment(checkout_request_id="ws_CO_1", status=Payment.PENDING)
+        self.post_callback(stk_callback_body("ws_CO_1", amount=1400))
+        with self.assertLogs("payments.callbacks", level="ERROR"):
+            apply_callbacks()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.PENDING)
+        self.assertEqual(payment.amount, Decimal("1500.00"))
+        self.assertEqual(DarajaCallback.objects.get().outcome, DarajaCallback.AMOUNT_MISMATCH)
+
+    def test_transitions_table_is_respected(self):
+        payment = self.create_payment(checkout_request_id="ws_CO_1", status=Payment.RELEASABLE)
+        self.post_callback(stk_callback_body("ws_CO_1", result_code=1032))
+        apply_callbacks()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.RELEASABLE)
+        self.assertEqual(DarajaCallback.objects.get().outcome, DarajaCallback.DUPLICATE)
+
+    def test_replayed_callback_is_absorbed(self):
+        payment = self.create_payment(checkout_request_id="ws_CO_1", status=Payment.PENDING)
+        self.post_callback(stk_callback_body("ws_CO_1"))
+        self.post_callback(stk_callback_body("ws_CO_1"))
+        apply_callbacks()
+        self.post_callback(stk_callback_body("ws_CO_1", result_code=1032))
+        apply_callbacks()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.HELD)
+        self.assertEqual(
+            list(DarajaCallback.objects.order_by('id').values_list('outcome', flat=True)),
+            [DarajaCallback.APPLIED, DarajaCallback.DUPLICATE, DarajaCallback.DUPLICATE],
+        )
+
+    def test_failed_callback_fails_payment(self):
+        payment = self.create_payment(checkout_request_id="ws_CO_1", status=Payment.PENDING)
+        self.post_callback(stk_callback_body("ws_CO_1", result_code=1032))
+        apply_callbacks()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.FAILED)
+
+    def test_unmatched_and_invalid_callbacks_are_recorded(self):
+        self.post_callback(stk_callback_body("ws_CO_unknown"))
+        self.post_callback({"unexpected": True})
+        with self.assertLogs("payments.callbacks", level="WARNING"):
+            apply_callbacks(now=timezone.now() + timedelta(seconds=61))
+        self.assertEqual(
+            list(DarajaCallback.objects.order_by('id').values_list('outcome', flat=True)),
+            [DarajaCallback.UNMATCHED, DarajaCallback.INVALID],
+        )
+        self.assertFalse(DarajaCallback.objects.filter(processed_at__isnull=True).exists())
+
+    def test_batch_query_count_does_not_grow_with_callbacks(self):
+        def run(start, count):
+            for index in range(start, start + count):
+                self.create_payment(checkout_request_id=f"ws_CO_{index}", status=Payment.PENDING)
+                DarajaCallback.objects.create(
+                    kind=DarajaCallback.STK_PUSH, reference=f"ws_CO_{index}",
+                    payload=stk_callback_body(f"ws_CO_{index}", receipt=f"RCPT{index}"),
+                )
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(apply_callbacks(), count)
+            return len(queries)
+
+        self.assertEqual(run(0, 2), run(2, 10))
+
+    def test_early_callback_waits_for_checkout_request_id(self):
+        payment = self.create_payment(checkout_request_id="", status=Payment.PENDING)
+        self.post_callback(stk_callback_body("ws_CO_1"))
+        self.assertEqual(apply_callbacks(), 0)
+        callback = DarajaCallback.objects.get()
+        self.assertIsNone(callback.processed_at)
+        self.assertGreater(callback.apply_after, timezone.now())
+        Payment.objects.filter(pk=payment.pk).update(checkout_request_id="ws_CO_1")
+        self.assertEqual(apply_callbacks(now=callback.apply_after), 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.HELD)
+        self.assertEqual(DarajaCallback.objects.get().outcome, DarajaCallback.APPLIED)
+
+    def test_deferred_callbacks_do_not_fill_the_batch(self):
+        payment = self.create_payment(checkout_request_id="ws_CO_1", status=Payment.PENDING)
+        for index in range(2):
+            self.post_callback(stk_callback_body(f"ws_CO_early_{index}"))
+        self.assertEqual(apply_callbacks(batch_size=2), 0)
+        self.post_callback(stk_callback_body("ws_CO_1"))
+        self.assertEqual(apply_callbacks(batch_size=2), 1)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.HELD)
+        self.assertEqual(DarajaCallback.objects.filter(processed_at__isnull=True).count(), 2)
+
+
+def b2c_result_body(originator_conversation_id, result_code=0):
+    return {"Result": {
+        "ResultType": 0,
+        "ResultCode": result_code,
+        "ResultDesc": "The service request is processed successfully.",
+        "OriginatorConversationID": originator_conversation_id,
+        "ConversationID": "AG_20251018_0001",
+        "TransactionID": "NLJ41HAY6Q",
+    }}
+
+
+class PayoutSettlementTests(DarajaStubMixin, PaymentFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.payment = self.create_payment()
+
+    def confirm_delivery(self):
+        return self.client.post(reverse('daraja-delivery-confirm'), {"order_id": self.order.id}, format='json')
+
+    def submit_payout(self):
+        self.assertEqual(self.confirm_delivery().status_code, 202)
+        payment_jobs.run_pending()
+        self.payment.refresh_from_db()
+        return self.payment.payout
+
+    def post_result(self, name, body):
+        response = self.client.post(reverse(name), body, format='json')
+        self.assertEqual(response.status_code, 200)
+        apply_callbacks()
+
+    def test_confirm_queues_payout_without_calling_daraja(self):
+        response = self.confirm_delivery()
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["payout_status"], Payout.QUEUED)
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.delivery_confirmed)
+        self.assertEqual(self.payment.status, Payment.RELEASING)
+        self.assertTrue(self.payment.held_by_platform)
+        self.assertEqual(self.payment.payout.amount, Decimal("1500.00"))
+        self.assertEqual(self.payment.payout.jobs.get().kind, PaymentJob.B2C_PAYOUT)
+        self.assertEqual(sum(self.stub.calls.values()), 0)
+        self.assertEqual(self.confirm_delivery().status_code, 400)
+
+    def test_result_callback_settles_payout(self):
+        payout = self.submit_payout()
+        self.assertEqual(payout.status, Payout.SUBMITTED)
+        self.assertEqual(self.stub.calls[B2C_PATH], 1)
+        self.post_result('daraja-b2c-result', b2c_result_body(payout.originator_conversation_id))
+        payout.refresh_from_db()
+        self.payment.refresh_from_db()
+        self.assertEqual(payout.status, Payout.SETTLED)
+        self.assertEqual(payout.transaction_id, "NLJ41HAY6Q")
+        self.assertEqual(self.payment.status, Payment.RELEASED)
+        self.assertFalse(self.payment.held_by_platform)
+        self.assertIsNotNone(self.payment.released_at)
+
+    def test_failed_result_makes_payment_releasable_again(self):
+        payout = self.submit_payout()
+        self.post_result('daraja-b2c-result', b2c_result_body(payout.originator_conversation_id, result_code=2001))
+        payout.refresh_from_db()
+        self.payment.refresh_from_db()
+        self.assertEqual(payout.status, Payout.FAILED)
+        self.assertEqual(payout.result_code, "2001")
+        self.assertEqual(self.payment.status, Payment.RELEASABLE)
+        self.assertIsNone(self.payment.payout)
+
+    def test_failed_payout_is_paid_out_again(self):
+        failed = self.submit_payout()
+        self.post_result('daraja-b2c-timeout', b2c_result_body(failed.originator_conversation_id))
+        retry, = batch_payouts()
+        payment_jobs.run_pending()
+        retry.refresh_from_db()
+        self.assertEqual(retry.status, Payout.SUBMITTED)
+        self.assertEqual(self.stub.calls[B2C_PATH], 2)
+        self.post_result('daraja-b2c-result', b2c_result_body(retry.originator_conversation_id))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.RELEASED)
+        self.assertEqual(self.payment.payout, retry)
+
+    def test_rejected_payout_job_makes_payment_releasable_again(self):
+        self.stub.status_codes[B2C_PATH] = 400
+        self.assertEqual(self.confirm_delivery().status_code, 202)
+        with self.assertLogs("payments.jobs", level="ERROR"):
+            payment_jobs.run_pending()
+        self.payment.refresh_from_db()
+        self.assertEqual(Payout.objects.get().status, Payout.FAILED)
+        self.assertEqual(self.payment.status, Payment.RELEASABLE)
+        self.assertIsNone(self.payment.payout)
+
+    def test_unknown_outcome_leaves_payout_submitted(self):
+        self.stub.status_codes[B2C_PATH] = 500
+        self.assertEqual(self.confirm_delivery().status_code, 202)
+        with self.assertLogs("payments.jobs", level="WARNING"):
+            payment_jobs.run_pending()
+        payout = Payout.objects.get()
+        self.assertEqual(payout.status, Payout.SUBMITTED)
+        self.assertEqual(payout.originator_conversation_id, f"payout-{payout.pk}")
+        self.assertEqual(payout.jobs.get().status, PaymentJob.SUCCEEDED)
+        self.assertEqual(batch_payouts(), [])
+        self.post_result('daraja-b2c-result', b2c_result_body(payout.originator_conversation_id))
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.RELEASED)
+
+    def test_read_timeout_leaves_payout_submitted(self):
+        self.assertEqual(self.confirm_delivery().status_code, 202)
+        with patch('api.daraja.DarajaAPI.b2c_payment', side_effect=requests.ReadTimeout("timed out")):
+            with self.assertLogs("payments.jobs", level="WARNING"):
+                payment_jobs.run_pending()
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.payout.status, Payout.SUBMITTED)
+        self.assertEqual(self.payment.status, Payment.RELEASING)
+
+    def test_success_after_timeout_settles_and_is_flagged(self):
+        payout = self.submit_payout()
+        self.post_result('daraja-b2c-timeout', b2c_result_body(payout.originator_conversation_id))
+        with self.assertLogs("payments.callbacks", level="ERROR"):
+            self.post_result('daraja-b2c-result', b2c_result_body(payout.originator_conversation_id))
+        self.post_result('daraja-b2c-result', b2c_result_body(payout.originator_conversation_id))
+        payout.refresh_from_db()
+        self.assertEqual(payout.status, Payout.SETTLED)
+        self.assertEqual(payout.transaction_id, "NLJ41HAY6Q")
+        self.assertEqual(
+            list(DarajaCallback.objects.order_by('id').values_list('outcome', flat=True)),
+            [DarajaCallback.APPLIED, DarajaCallback.APPLIED, DarajaCallback.DUPLICATE],
+        )
+
+    def test_early_result_waits_for_submission(self):
+        self.post_result('daraja-b2c-result', b2c_result_body("not-yet-stored"))
+        self.assertIsNone(DarajaCallback.objects.get().processed_at)
+        with self.assertLogs("payments.callbacks", level="WARNING"):
+            apply_callbacks(now=timezone.now() + timedelta(seconds=61))
+        self.assertEqual(DarajaCallback.objects.get().outcome, DarajaCallback.UNMATCHED)
+
+
+class PaymentTransitionTests(PaymentFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.payment = self.create_payment()
+
+    def test_refund_only_once(self):
+        response = self.client.post(reverse('daraja-refund'), {"order_id": self.order.id, "reason": "Damaged"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, Payment.REFUNDED)
+        self.assertFalse(self.payment.held_by_platform)
+        response = self.client.post(reverse('daraja-refund'), {"order_id": self.order.id, "reason": "Damaged"}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_released_payment_cannot_be_refunded_or_paid_again(self):
+        confirm_delivery(self.order.id)
+        with self.assertRaises(TransitionError):
+            refund_order(self.order.id)
+        with self.assertRaises(TransitionError):
+            confirm_delivery(self.order.id)
+        self.assertEqual(Payout.objects.count(), 1)
+
+    def test_refunded_payment_cannot_be_released(self):
+        refund_order(self.order.id)
+        response = self.client.post(reverse('daraja-delivery-confirm'), {"order_id": self.order.id}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Payout.objects.exists())
+        self.order.refresh_from_db()
+        self.assertFalse(self.order.delivery_confirmed)
+
+    def test_confirm_payment_only_from_pending(self):
+        self.client.force_authenticate(self.buyer)
+        url = reverse('order-confirm-payment', args=[self.order.id])
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'completed')
+        self.assertEqual(self.client.post(url).status_code, 400)
+
+
+class PaymentTransitionConcurrencyTests(PaymentFixturesMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_payment()
+
+    def run_in_parallel(self, funcs):
+        barrier = threading.Barrier(len(funcs))
+        outcomes = []
+
+        def worker(func):
+            barrier.wait()
+            try:
+                for _attempt in range(50):
+                    try:
+                        func(self.order.id)
+                    except OperationalError:
+                        # SQLite reports lock contention instead of waiting; retry like a client would.
+                        time.sleep(0.01)
+                        continue
+                    except TransitionError:
+                        outcomes.append("rejected")
+                    else:
+                        outcomes.append("ok")
+                    return
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(func,)) for func in funcs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_parallel_delivery_confirmations_pay_out_once(self):
+        outcomes = self.run_in_parallel([confirm_delivery] * 8)
+        self.assertEqual(sorted(outcomes), ["ok"] + ["rejected"] * 7)
+        self.assertEqual(Payout.objects.count(), 1)
+        self.assertEqual(PaymentJob.objects.filter(kind=PaymentJob.B2C_PAYOUT).count(), 1)
+        self.assertEqual(Payment.objects.get().status, Payment.RELEASING)
+
+    def test_parallel_confirm_and_refund_pick_one(self):
+        outcomes = self.run_in_parallel([confirm_delivery, refund_order] * 4)
+        self.assertEqual(sorted(outcomes), ["ok"] + ["rejected"] * 7)
+        payment = Payment.objects.get()
+        if payment.status == Payment.REFUNDED:
+            self.assertFalse(Payout.objects.exists())
+        else:
+            self.assertEqual(payment.status, Payment.RELEASING)
+            self.assertEqual(Payout.objects.count(), 1)
+
+
+@override_settings(PAYOUT_BATCH_WINDOW=3600)
+class PayoutBatchingTests(PaymentFixturesMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_artisan = User.objects.create(
+            email="other@example.com", phone_number="0711000003", user_type=User.ARTISAN,
+        )
+
+    def delivered_payment(self, artisan, amount):
+        order = self.create_order(artisan=artisan, total_amount=amount)
+        payment = self.create_payment(order=order, amount=amount)
+        response = self.client.post(reverse('daraja-delivery-confirm'), {"order_id": order.id}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertNotIn("payout_id", response.data)
+        return payment
+
+    def test_confirmed_payments_wait_for_batch(self):
+        payment = self.delivered_payment(self.artisan, "100.00")
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, Payment.RELEASABLE)
+        self.assertIsNotNone(payment.releasable_at)
+        self.assertEqual(batch_payouts(), [])
+        self.assertFalse(Payout.objects.exists())
+        with self.assertRaises(TransitionError):
+            refund_order(payment.order_id)
+
+    def test_one_payout_per_artisan_after_window(self):
+        payments = [self.delivered_payment(self.artisan, amount) for amount in ("100.00", "250.00", "50.00")]
+        other = self.delivered_payment(self.other_artisan, "75.00")
+        out = StringIO()
+        with patch('payments.services.timezone.now', return_value=timezone.now() + timedelta(hours=2)):
+            call_command('batch_payouts', stdout=out)
+        self.assertIn("Queued 2 payout(s) covering 4 payment(s).", out.getvalue())
+        payout = Payout.objects.get(artisan=self.artisan)
+        self.assertEqual(payout.amount, Decimal("400.00"))
+        self.assertEqual(set(payout.payments.values_list('id', flat=True)), {payment.id for payment in payments})
+        self.assertEqual(payout.jobs.get().kind, PaymentJob.B2C_PAYOUT)
+        other.refresh_from_db()
+        self.assertEqual(other.payout.amount, Decimal("75.00"))
+        self.assertEqual(set(Payment.objects.values_list('status', flat=True)), {Payment.RELEASING})
+
+    def test_settled_batch_releases_every_member(self):
+        for amount in ("100.00", "250.00"):
+            self.delivered_payment(self.artisan, amount)
+        (payout,) = batch_payouts(now=timezone.now() + timedelta(hours=2))
+        Payout.objects.filter(id=payout.id).update(status=Payout.SUBMITTED, originator_conversation_id="batch-1")
+        DarajaCallback.objects.create(
+            kind=DarajaCallback.B2C_RESULT, reference="batch-1", payload=b2c_result_body("batch-1"),
+        )
+        apply_callbacks()
+        self.assertEqual(set(Payment.objects.values_list('status', flat=True)), {Payment.RELEASED})
+
+
+class ReconcilePaymentsTests(PaymentFixturesMixin, TestCase):
+    HEADER = ["Receipt No.", "Completion Time", "Initiation Time", "Details", "Transaction Status",
+              "Paid In", "Withdrawn", "Balance", "Other Party Info"]
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.statement_path = os.path.join(directory.name, "statement.csv")
+        self.report_path = os.path.join(directory.name, "report.csv")
+
+    def statement_payment(self, receipt, amount, status=Payment.HELD, paid_at="2025-10-01 10:00:00"):
+        return self.create_payment(
+            amount=amount, status=status, mpesa_receipt_number=receipt,
+            paid_at=timezone.make_aware(datetime.datetime.fromisoformat(paid_at)),
+        )
+
+    def write_statement(self, lines):
+        with open(self.statement_path, "w", newline="", encoding="utf-8") as statement:
+            writer = csv.writer(statement)
+            writer.writerow(["Account Holder:", "CraftCrest Ltd"])
+            writer.writerow(["Time Period:", "01 Oct 2025 - 31 Oct 2025"])
+            writer.writerow([])
+            writer.writerow(self.HEADER)
+            for receipt, completed, amount, status in lines:
+                writer.writerow([receipt, completed, completed, "Pay Bill from 2547****149", status,
+                                 amount, "", "100,000.00", "254708374149"])
+            writer.writerow([])
+
+    def read_report(self):
+        with open(self.report_path, newline="", encoding="utf-8") as report:
+            return {(row["kind"], row["receipt_number"]) for row in csv.DictReader(report)}
+
+    def test_reports_every_kind_of_mismatch(self):
+        self.statement_payment("QJA1", "1500.00")
+        self.statement_payment("QJA2", "700.00")
+        self.statement_payment("QJA3", "300.00", status=Payment.FAILED)
+        self.statement_payment("QJA4", "200.00", paid_at="2025-10-01 11:00:00")
+        self.statement_payment("QJA5", "200.00", paid_at="2025-12-01 11:00:00")
+        self.write_statement([
+            ("QJA1", "2025-10-01 09:00:00", "1,500.00", "Completed"),
+            ("QJA2", "2025-10-01 09:30:00", "750.00", "Completed"),
+            ("QJA3", "2025-10-01 10:00:00", "300.00", "Completed"),
+            ("QJA9", "2025-10-01 12:00:00", "50.00", "Completed"),
+        ])
+        out = StringIO()
+        call_command('reconcile_payments', self.statement_path, '--report', self.report_path, stdout=out)
+        self.assertIn("Checked 4 statement line(s); 4 mismatch(es)", out.getvalue())
+        self.assertEqual(self.read_report(), {
+            ("amount_mismatch", "QJA2"),
+            ("status_mismatch", "QJA3"),
+            ("missing_payment", "QJA9"),
+            ("missing_from_statement", "QJA4"),
+        })
+        self.assertFalse(StatementLine.objects.exists())
+        self.assertEqual(ReconciliationRun.objects.get().mismatches, 4)
+
+    def test_statement_is_streamed_and_loaded_in_chunks(self):
+        self.write_statement([
+            (f"QJB{index}", "2025-10-01 09:00:00", "10.00", "Completed") for index in range(5)
+        ])
+        with open(self.statement_path, newline="", encoding="utf-8") as statement:
+            rows = read_statement(statement)
+            self.assertEqual(next(rows)[1]["Receipt No."], "QJB0")
+        run = ReconciliationRun.objects.create(statement="statement.csv")
+        with open(self.statement_path, newline="", encoding="utf-8") as statement:
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(load_statement(run, statement, chunk_size=2), 5)
+        inserts = [query for query in queries if query["sql"].startswith("INSERT")]
+        self.assertEqual(len(inserts), 3)
+
+
+class ArtisanLedgerTests(PaymentFixturesMixin, TestCase):
+
+    def balance(self):
+        self.client.force_authenticate(self.artisan)
+        response = self.client.get(reverse('payments-balance'))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def assertBalance(self, held, released, refunded):
+        balance = ArtisanBalance.objects.get(artisan=self.artisan)
+        self.assertEqual(
+            (balance.held, balance.released, balance.refunded),
+            (Decimal(held), Decimal(released), Decimal(refunded)),
+        )
+        totals = LedgerEntry.objects.filter(artisan=self.artisan).aggregate(total=Sum('amount'))
+        self.assertEqual(totals['total'], balance.held)
+
+    def test_balance_follows_release_and_refund(self):
+        self.create_payment()
+        other = self.create_order(total_amount="800.00")
+        self.create_payment(order=other, amount="800.00")
+        self.assertBalance("2300.00", "0", "0")
+        payout = confirm_delivery(self.order.id)
+        self.assertBalance("2300.00", "0", "0")
+        transition_payments(payout.payments.all(), Payment.RELEASED)
+        refund_order(other.id)
+        self.assertBalance("0", "1500.00", "800.00")
+        self.assertEqual(
+            list(LedgerEntry.objects.order_by('id').values_list('entry_type', flat=True)),
+            [LedgerEntry.HOLD, LedgerEntry.HOLD, LedgerEntry.RELEASE, LedgerEntry.REFUND],
+        )
+
+    def test_stk_callback_holds_paid_amount(self):
+        self.create_payment(status=Payment.PENDING, checkout_request_id="ws_CO_1")
+        self.assertFalse(ArtisanBalance.objects.exists())
+        DarajaCallback.objects.create(
+            kind=DarajaCallback.STK_PUSH, reference="ws_CO_1", payload=stk_callback_body("ws_CO_1"),
+        )
+        apply_callbacks()
+        self.assertBalance("1500.00", "0", "0")
+
+    def test_failed_payout_keeps_money_held(self):
+        self.create_payment()
+        payout = confirm_delivery(self.order.id)
+        transition_payments(payout.payments.all(), Payment.HELD, payout=None)
+        self.assertBalance("1500.00", "0", "0")
+        self.assertFalse(LedgerEntry.objects.exclude(entry_type=LedgerEntry.HOLD).exists())
+
+    def test_balance_endpoint_reads_one_row(self):
+        for _ in range(20):
+            self.create_payment()
+        self.client.force_authenticate(self.artisan)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('payments-balance'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["held"], Decimal("30000.00"))
+        self.assertEqual(response.data["artisan"], self.artisan.id)
+
+    def test_balance_permissions(self):
+        self.assertEqual(self.balance()["held"], Decimal("0"))
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get(reverse('payments-balance')).status_code, 403)
+        admin = User.objects.create(email="admin@example.com", phone_number="0711000003", user_type=User.ADMIN)
+        self.create_payment()
+        self.client.force_authenticate(admin)
+        response = self.client.get(reverse('payments-balance'), {"artisan": self.artisan.id})
+        self.assertEqual(response.data["held"], Decimal("1500.00"))
+        superuser = User.objects.create_superuser("root@example.com", "TestPassword123", phone_number="0711000004")
+        self.client.force_authenticate(superuser)
+        response = self.client.get(reverse('payments-balance'), {"artisan": self.artisan.id})
+        self.assertEqual(response.data["held"], Decimal("1500.00"))
+
+    def test_admin_cannot_edit_the_ledger(self):
+        superuser = User.objects.create_superuser("root@example.com", "TestPassword123", phone_number="0711000004")
+        payment = self.create_payment()
+        self.client.force_login(superuser)
+        entry = LedgerEntry.objects.get()
+        self.assertEqual(self.client.get(reverse('admin:payments_ledgerentry_add')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('admin:payments_ledgerentry_delete', args=[entry.id])).status_code, 403)
+        self.assertEqual(self.client.post(reverse('admin:payments_ledgerentry_change', args=[entry.id]), {
+            "amount": "1.00",
+        }).status_code, 403)
+        self.assertEqual(self.client.get(reverse('admin:payments_artisanbalance_add')).status_code, 403)
+        request = RequestFactory().get('/')
+        request.user = superuser
+        self.assertEqual(admin.site._registry[Payment].get_readonly_fields(request, payment), ('status', 'amount'))
@@ -0,0 +1,131 @@
+"""
+Order and payment state transitions.
+
+Every transition runs in one transaction and writes only the fields it
+changes. Payment status moves use a conditional ``UPDATE ... WHERE status IN
+(...)`` so a transition only happens from a state that allows it; order
+transitions lock the order row with ``select_for_update`` first. A request
+that loses a race, or is retried, gets a ``TransitionError`` instead of
+paying out or refunding twice.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import Order
+from .ledger import record_changes
+from .models import Payment
+
+PAYMENT_TRANSITIONS = {
+    Payment.PENDING: {Payment.HELD, Payment.FAILED},
+    Payment.HELD: {Payment.RELEASABLE, Payment.RELEASING, Payment.REFUNDED},
+    Payment.RELEASABLE: {Payment.RELEASING},
+    Payment.RELEASING: {Payment.RELEASED, Payment.RELEASABLE, Payment.HELD},
+    Payment.RELEASED: set(),
+    Payment.REFUNDED: set(),
+    Payment.FAILED: set(),
+}
+
+
+class TransitionError(Exception):
+    """The object is not in a state that allows the requested transition."""
+
+
+def sources_for(target):
+    return [source for source, targets in PAYMENT_TRANSITIONS.items() if target in targets]
+
+
+def transition_payments(queryset, target, **fields):
+    """
+    Move the payments in ``queryset`` that may enter ``target`` to it,
+    setting ``fields`` as well, and record the change in the ledger.
+    Returns the number of rows changed.
+    """
+    sources = sources_for(target)
+    with transaction.atomic():
+        rows = list(
+            queryset.select_for_update().filter(status__in=sources).values_list('id', 'artisan_id', 'status', 'amount')
+        )
+        if not rows:
+            return 0
+        updated = Payment.objects.filter(id__in=[row[0] for row in rows], status__in=sources).update(
+            status=target, **fields,
+        )
+        record_changes([
+            (artisan_id, payment_id, status, amount, target, amount)
+            for payment_id, artisan_id, status, amount in rows
+        ])
+        return updated
+
+
+def return_failed_payouts(payout_ids):
+    """
+    Take the releasing payments off the failed payouts ``payout_ids``.
+    Payments of confirmed orders become ``releasable`` again, so the next
+    ``batch_payouts`` run queues a new payout; the rest go back on hold for
+    auto-release.
+    """
+    releasing = Payment.objects.filter(payout__in=payout_ids, status=Payment.RELEASING)
+    confirmed = list(releasing.filter(order__delivery_confirmed=True).values_list('id', flat=True))
+    with transaction.atomic():
+        transition_payments(
+            Payment.objects.filter(id__in=confirmed), Payment.RELEASABLE, payout=None, releasable_at=timezone.now(),
+        )
+        transition_payments(releasing, Payment.HELD, payout=None)
+
+
+def _locked_order(order_id):
+    order = Order.objects.select_for_update().select_related('artisan').filter(id=order_id).first()
+    if order is None:
+        raise Order.DoesNotExist(f"Order {order_id} does not exist.")
+    return order
+
+
+def confirm_delivery(order_id, transaction_desc="Delivery confirmed"):
+    """
+    Mark the order delivered and queue one payout for its held payments.
+    Returns the payout, or ``None`` when ``PAYOUT_BATCH_WINDOW`` is set and
+    the payments are left ``releasable`` for the next ``batch_payouts`` run.
+    """
+    from .services import queue_payout
+
+    with transaction.atomic():
+        order = _locked_order(order_id)
+        if order.delivery_confirmed:
+            raise TransitionError("Already confirmed.")
+        payments = list(order.payments.select_for_update().filter(status=Payment.HELD))
+        if not payments:
+            raise TransitionError("No held payment for this order.")
+        order.delivery_confirmed = True
+        order.status = 'completed'
+        order.save(update_fields=['delivery_confirmed', 'status', 'updated_at'])
+        if getattr(settings, 'PAYOUT_BATCH_WINDOW', 0):
+            transition_payments(
+                Payment.objects.filter(id__in=[payment.id for payment in payments]),
+                Payment.RELEASABLE, releasable_at=timezone.now(),
+            )
+            return None
+        return queue_payout(order.artisan, payments, transaction_desc=transaction_desc)
+
+
+def refund_order(order_id):
+    """Refund the order's held payments. Returns the number refunded."""
+    with transaction.atomic():
+        order = _locked_order(order_id)
+        refunded = transition_payments(
+            order.payments.all(), Payment.REFUNDED,
+            held_by_platform=False, released_at=timezone.now(),
+        )
+        if not refunded:
+            raise TransitionError("No refundable payment for this order.")
+        return refunded
+
+
+def confirm_order_payment(order_id):
+    """Move an order's payment status from pending to completed."""
+    with transaction.atomic():
+        updated = Order.objects.filter(id=order_id, payment_status='pending').update(
+            payment_status='completed', status='confirmed', updated_at=timezone.now(),
+        )
+        if not updated:
+            raise TransitionError("Payment is not pending.")
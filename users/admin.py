@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, ArtisanProfile, Profile, ArtisanPortfolio
+from .models import User, ArtisanProfile, Profile, ArtisanPortfolio, EmailOutbox
 
 @admin.register(ArtisanProfile)
 class ArtisanProfileAdmin(admin.ModelAdmin):
@@ -42,3 +42,12 @@ class ProfileAdmin(admin.ModelAdmin):
 class ArtisanPortfolioAdmin(admin.ModelAdmin):
     list_display = ('title', 'artisan_id', 'created_at')
     search_fields = ('artisan__email', 'title')
+
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('to_email', 'subject', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to_email',)
+    # The body carries one-time codes.
+    exclude = ('body',)
@@ -5,4 +5,5 @@ class UsersConfig(AppConfig):
     name = 'users'
 
     def ready(self):
-        import users.signals
\ No newline at end of file
+        import users.signals
+        import users.checks
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""
+Token authentication backed by the Django cache.
+
+``CachedTokenAuthentication`` behaves like DRF's ``TokenAuthentication`` but
+keeps the token and its user in the cache for ``AUTH_TOKEN_CACHE_TTL``
+seconds, so an authenticated request does not join ``authtoken_token`` to
+``users_user`` every time. Entries are dropped when the token is deleted and
+whenever the user is saved (which covers deactivation and password changes);
+the short TTL bounds staleness from queryset ``update()`` calls that bypass
+signals. Invalidation only reaches other worker processes through a shared
+cache, which the ``users.E001`` system check enforces; an
+``AUTH_TOKEN_CACHE_TTL`` of 0 turns the cache off.
+"""
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 60
+
+
+def token_cache_key(key):
+    return f"auth:token:{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}"
+
+
+def user_cache_key(user_id):
+    return f"auth:user-token:{user_id}"
+
+
+def forget_user(user_id):
+    """Drop the cached token of ``user_id``, if any."""
+    try:
+        key = cache.get(user_cache_key(user_id))
+        cache.delete_many([key, user_cache_key(user_id)] if key else [user_cache_key(user_id)])
+    except Exception:
+        logger.warning("Token cache unavailable", exc_info=True)
+
+
+def forget_token(key, user_id):
+    try:
+        cache.delete_many([token_cache_key(key), user_cache_key(user_id)])
+    except Exception:
+        logger.warning("Token cache unavailable", exc_info=True)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        ttl = getattr(settings, 'AUTH_TOKEN_CACHE_TTL', DEFAULT_TTL)
+        if not ttl:
+            return super().authenticate_credentials(key)
+        cache_key = token_cache_key(key)
+        try:
+            cached = cache.get(cache_key)
+        except Exception:
+            logger.warning("Token cache unavailable", exc_info=True)
+            return super().authenticate_credentials(key)
+        if cached is not None:
+            return cached
+        user, token = super().authenticate_credentials(key)
+        try:
+            cache.set_many({cache_key: (user, token), user_cache_key(user.pk): cache_key}, ttl)
+        except Exception:
+            logger.warning("Token cache unavailable", exc_info=True)
+        return user, token
@@ -0,0 +1,55 @@
+"""
+System checks for account features that keep state in the Django cache.
+
+gunicorn runs ``WEB_CONCURRENCY`` worker processes. With a process-local
+cache such as ``LocMemCache`` each worker has its own copy, so a write in one
+worker is invisible to the others. These checks fail when that would make a
+feature wrong rather than just slower.
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+from rest_framework.settings import api_settings
+
+from .authentication import DEFAULT_TTL
+from .throttling import ForgotPasswordThrottle, LoginThrottle, OTPVerificationThrottle, PasswordResetThrottle
+
+PROCESS_LOCAL_CACHES = {'django.core.cache.backends.locmem.LocMemCache'}
+
+
+def cache_is_shared():
+    """Whether every worker process sees the same default cache."""
+    return (
+        getattr(settings, 'WEB_CONCURRENCY', 1) <= 1
+        or settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES
+    )
+
+
+@register(Tags.caches)
+def check_token_cache(app_configs, **kwargs):
+    if not getattr(settings, 'AUTH_TOKEN_CACHE_TTL', DEFAULT_TTL) or cache_is_shared():
+        return []
+    return [Error(
+        "CachedTokenAuthentication needs a cache shared by all worker processes; "
+        "a logout or deactivation would only reach the worker that handled it.",
+        hint="Set CACHE_BACKEND to a shared backend such as Redis or Memcached, or AUTH_TOKEN_CACHE_TTL to 0.",
+        id='users.E001',
+    )]
+
+
+@register(Tags.caches)
+def check_throttle_cache(app_configs, **kwargs):
+    rates = api_settings.DEFAULT_THROTTLE_RATES
+    throttled = [
+        scope
+        for throttle in (LoginThrottle, OTPVerificationThrottle, ForgotPasswordThrottle, PasswordResetThrottle)
+        for scope in (throttle.scope, f"{throttle.scope}_ip")
+        if rates.get(scope)
+    ]
+    if not throttled or cache_is_shared():
+        return []
+    return [Error(
+        "The account throttles need a cache shared by all worker processes; "
+        "each worker would allow the full rate on its own.",
+        hint="Set CACHE_BACKEND to a shared backend such as Redis or Memcached.",
+        id='users.E002',
+    )]
@@ -0,0 +1,30 @@
+"""
+Password hashers whose cost comes from settings.
+
+Django rehashes a password on the next successful ``check_password`` when the
+stored parameters differ from the hasher's, so changing
+``PASSWORD_PBKDF2_ITERATIONS`` or the ``PASSWORD_ARGON2_*`` costs (or the
+``PASSWORD_HASH_PROFILE``) upgrades existing hashes as users log in.
+"""
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher, PBKDF2PasswordHasher
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_PBKDF2_ITERATIONS', None) or PBKDF2PasswordHasher.iterations
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    @property
+    def time_cost(self):
+        return getattr(settings, 'PASSWORD_ARGON2_TIME_COST', None) or Argon2PasswordHasher.time_cost
+
+    @property
+    def memory_cost(self):
+        return getattr(settings, 'PASSWORD_ARGON2_MEMORY_COST', None) or Argon2PasswordHasher.memory_cost
+
+    @property
+    def parallelism(self):
+        return getattr(settings, 'PASSWORD_ARGON2_PARALLELISM', None) or Argon2PasswordHasher.parallelism
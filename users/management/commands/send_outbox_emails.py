@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from users.outbox import send_pending
+
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+class Command(BaseCommand):
+    help = "Send queued emails from the outbox over one reused SMTP connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Send the emails due now, then exit.")
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=getattr(settings, 'EMAIL_OUTBOX_POLL_INTERVAL', DEFAULT_POLL_INTERVAL),
+            help="Seconds to wait when the outbox is empty.",
+        )
+
+    def handle(self, *args, **options):
+        connection = get_connection(fail_silently=False)
+        total = 0
+        try:
+            while True:
+                processed = send_pending(options['batch_size'], connection=connection)
+                total += processed
+                if processed:
+                    continue
+                if options['once']:
+                    break
+                # Don't hold the SMTP connection open while idle.
+                connection.close()
+                time.sleep(options['sleep'])
+        finally:
+            connection.close()
+        self.stdout.write(f"Processed {total} email(s).")
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:05
+
+from django.db import migrations, models
+
+from api.utils import geohash_encode
+
+
+def backfill_geohash(apps, schema_editor):
+    ArtisanProfile = apps.get_model("users", "ArtisanProfile")
+    profiles = ArtisanProfile.objects.filter(
+        latitude__isnull=False, longitude__isnull=False
+    ).only("id", "latitude", "longitude")
+    for profile in profiles.iterator():
+        profile.geohash = geohash_encode(profile.latitude, profile.longitude)
+        profile.save(update_fields=["geohash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0002_alter_user_user_type"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="artisanprofile",
+            name="geohash",
+            field=models.CharField(
+                blank=True, db_index=True, editable=False, max_length=12, null=True
+            ),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0003_artisanprofile_geohash"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="artisanprofile",
+            index=models.Index(
+                fields=["latitude", "longitude"], name="artisan_lat_lon_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0005_email_outbox"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="emailoutbox",
+            name="expires_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
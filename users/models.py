@@ -8,6 +8,7 @@ from django.utils import timezone
 from datetime import timedelta
 import random
 import logging
+from api.utils import geohash_encode
 
 logger = logging.getLogger(__name__)
 
@@ -99,10 +100,26 @@ class ArtisanProfile(models.Model):
     order_value_limit = models.DecimalField(max_digits=10, decimal_places=2, default=2000, null=True, blank=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
     longitude = models.DecimalField(max_digits=9, decimal_places=6, blank=True, null=True)
+    geohash = models.CharField(max_length=12, blank=True, null=True, db_index=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude'], name='artisan_lat_lon_idx'),
+        ]
 
     def __str__(self):
         return f"Artisan Profile for {self.user.email}"
 
+    def save(self, *args, **kwargs):
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = geohash_encode(self.latitude, self.longitude)
+        else:
+            self.geohash = None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = {*update_fields, 'geohash'}
+        super().save(*args, **kwargs)
+
     def clean(self):
         if self.user.user_type != 'ARTISAN':
             raise ValidationError("ArtisanProfile can only be linked to an artisan user.")
@@ -154,4 +171,43 @@ class PortfolioImage(models.Model):
 
     def __str__(self):
         return f"Image for {self.portfolio.title}"
-        
\ No newline at end of file
+        
+
+class EmailOutbox(models.Model):
+    """
+    An email queued by a request and delivered by the ``send_outbox_emails``
+    worker command, so requests never wait on SMTP. ``body`` is blanked once
+    the email is sent, has failed or is past ``expires_at``, so one-time codes
+    do not stay in the table.
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    send_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'send_after'], name='email_outbox_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.to_email} ({self.status})"
@@ -0,0 +1,124 @@
+"""
+Database outbox for account emails.
+
+Requests call ``queue_email`` and return; the ``send_outbox_emails`` command
+claims due rows with a conditional UPDATE, so several senders can share the
+table, and delivers them over one reused SMTP connection. Failed sends are
+retried with exponential backoff up to ``EMAIL_OUTBOX_MAX_ATTEMPTS``. Rows
+past ``expires_at`` are failed unsent, and the body of every finished row is
+blanked.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 30
+DEFAULT_LOCK_TIMEOUT = 300
+
+
+def queue_email(to_email, subject, body, from_email="", expires_at=None):
+    return EmailOutbox.objects.create(
+        to_email=to_email, subject=subject, body=body, from_email=from_email, expires_at=expires_at,
+    )
+
+
+def expire_emails(now=None):
+    """Fail unsent emails past ``expires_at`` and blank their body. Returns how many."""
+    now = now or timezone.now()
+    return EmailOutbox.objects.filter(
+        status__in=[EmailOutbox.PENDING, EmailOutbox.SENDING], expires_at__lt=now,
+    ).update(status=EmailOutbox.FAILED, body="", locked_at=None, last_error="Expired before it was sent")
+
+
+def claim_emails(batch_size=50):
+    """
+    Mark up to ``batch_size`` due emails as sending and return them. Rows left
+    sending longer than ``EMAIL_OUTBOX_LOCK_TIMEOUT`` by a dead sender are
+    claimed again. Expired emails are failed first and never claimed.
+    """
+    now = timezone.now()
+    expire_emails(now)
+    stale = now - timedelta(seconds=getattr(settings, 'EMAIL_OUTBOX_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT))
+    due = (
+        Q(status=EmailOutbox.PENDING, send_after__lte=now)
+        | Q(status=EmailOutbox.SENDING, locked_at__lt=stale)
+    )
+    claimed = []
+    for email_id, email_status, locked_at in EmailOutbox.objects.filter(due).order_by('send_after', 'id').values_list(
+        'id', 'status', 'locked_at',
+    )[:batch_size]:
+        updated = EmailOutbox.objects.filter(id=email_id, status=email_status, locked_at=locked_at).update(
+            status=EmailOutbox.SENDING,
+            locked_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if updated:
+            claimed.append(email_id)
+    return list(EmailOutbox.objects.filter(id__in=claimed).order_by('send_after', 'id'))
+
+
+def _retry_or_fail(email, exc):
+    email.last_error = str(exc)
+    email.locked_at = None
+    if email.attempts < getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS):
+        delay = getattr(settings, 'EMAIL_OUTBOX_RETRY_DELAY', DEFAULT_RETRY_DELAY) * 2 ** (email.attempts - 1)
+        email.status = EmailOutbox.PENDING
+        email.send_after = timezone.now() + timedelta(seconds=delay)
+        logger.warning("Email %s failed, retrying in %ss: %s", email.pk, delay, exc)
+    else:
+        email.status = EmailOutbox.FAILED
+        email.body = ""
+        logger.error("Email %s failed after %s attempts: %s", email.pk, email.attempts, exc)
+    email.save(update_fields=['status', 'send_after', 'locked_at', 'last_error', 'body'])
+
+
+def send_pending(batch_size=50, connection=None):
+    """
+    Claim and send one batch of due emails over ``connection`` (by default a
+    new one, closed afterwards). Returns how many were claimed.
+    """
+    emails = claim_emails(batch_size)
+    if not emails:
+        return 0
+    own_connection = connection is None
+    connection = connection or get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as exc:
+        for email in emails:
+            _retry_or_fail(email, exc)
+        return len(emails)
+    sent = []
+    try:
+        for email in emails:
+            message = EmailMessage(
+                subject=email.subject,
+                body=email.body,
+                from_email=email.from_email or settings.DEFAULT_FROM_EMAIL,
+                to=[email.to_email],
+                connection=connection,
+            )
+            try:
+                message.send()
+            except Exception as exc:
+                _retry_or_fail(email, exc)
+                # The server may have dropped us; the next send reconnects.
+                connection.close()
+            else:
+                sent.append(email.pk)
+    finally:
+        if own_connection:
+            connection.close()
+        EmailOutbox.objects.filter(id__in=sent).update(
+            status=EmailOutbox.SENT, sent_at=timezone.now(), locked_at=None, last_error="", body="",
+        )
+    return len(emails)
@@ -0,0 +1,53 @@
+"""
+Login as a single service call.
+
+``login_user`` loads the user and their token in one query (``email`` and
+``phone_number`` are unique, so both lookups use an index), creates the token
+only on the first login and writes ``last_login`` at most once per
+``LAST_LOGIN_UPDATE_INTERVAL`` seconds. A repeat login is one SELECT.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .models import User
+
+DEFAULT_LAST_LOGIN_UPDATE_INTERVAL = 5 * 60
+
+
+class LoginError(Exception):
+    """The credentials do not match an active user."""
+
+
+def touch_last_login(user, now=None):
+    """Record the login unless ``last_login`` is recent enough; return whether it was written."""
+    now = now or timezone.now()
+    interval = getattr(settings, 'LAST_LOGIN_UPDATE_INTERVAL', DEFAULT_LAST_LOGIN_UPDATE_INTERVAL)
+    if user.last_login and now - user.last_login < timedelta(seconds=interval):
+        return False
+    # update() rather than save(): no signals, so the cached token stays valid.
+    User.objects.filter(pk=user.pk).update(last_login=now)
+    user.last_login = now
+    return True
+
+
+def login_user(password, email=None, phone_number=None):
+    """Return ``(user, token)`` for valid credentials or raise ``LoginError``."""
+    lookup = {'email': email} if email else {'phone_number': phone_number}
+    user = User.objects.select_related('auth_token').filter(**lookup).first()
+    if user is None or not user.is_active or not user.check_password(password):
+        raise LoginError("Invalid email/phone or password.")
+    try:
+        token = user.auth_token
+    except Token.DoesNotExist:
+        try:
+            with transaction.atomic():
+                token = Token.objects.create(user=user)
+        except IntegrityError:
+            # A concurrent first login created it.
+            token = Token.objects.get(user=user)
+    touch_last_login(user)
+    return user, token
@@ -1,5 +1,7 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from users.authentication import forget_token, forget_user
 from users.models import User, Profile
 from users.models import ArtisanProfile
 
@@ -11,4 +13,13 @@ def create_profile(sender, instance, created, **kwargs):
 @receiver(post_save, sender=User)
 def create_artisan_profile(sender, instance, created, **kwargs):
     if created and instance.user_type == 'ARTISAN':
-        ArtisanProfile.objects.create(user=instance)
\ No newline at end of file
+        ArtisanProfile.objects.create(user=instance)
+
+@receiver(post_save, sender=User)
+def forget_cached_token(sender, instance, created, **kwargs):
+    if not created:
+        forget_user(instance.pk)
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    forget_token(instance.key, instance.user_id)
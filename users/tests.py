@@ -1,3 +1,289 @@
-from django.test import TestCase
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .authentication import token_cache_key
+from .checks import check_throttle_cache, check_token_cache
+from .models import EmailOutbox, User
+from .outbox import send_pending
+from .throttling import SlidingWindowLimiter
+
+
+class FlakyEmailBackend(LocmemEmailBackend):
+    """locmem backend that counts connections and rejects listed recipients."""
+    opened = 0
+    reject = set()
+
+    def open(self):
+        type(self).opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        for message in messages:
+            if self.reject.intersection(message.to):
+                raise ConnectionError("SMTP unavailable")
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND='users.tests.FlakyEmailBackend', DEFAULT_FROM_EMAIL='noreply@craftcrest.example',
+    EMAIL_OUTBOX_RETRY_DELAY=0, EMAIL_OUTBOX_MAX_ATTEMPTS=2,
+)
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        FlakyEmailBackend.opened = 0
+        FlakyEmailBackend.reject = set()
+        self.client = APIClient()
+
+    def register(self, email="buyer@example.com"):
+        return self.client.post(reverse("register"), {
+            "email": email, "password": "TestPassword123", "first_name": "John", "last_name": "Kinyanjui",
+            "phone_number": "1234567890", "user_type": "buyer",
+        }, format="json")
+
+    def test_registration_queues_email_without_sending(self):
+        self.assertEqual(self.register().status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        queued = EmailOutbox.objects.get()
+        self.assertEqual(queued.status, EmailOutbox.PENDING)
+        self.assertIn(User.objects.get().otp, queued.body)
+        self.assertEqual(queued.expires_at, User.objects.get().otp_exp)
+
+    def test_command_sends_batch_over_one_connection(self):
+        for index in range(5):
+            EmailOutbox.objects.create(to_email=f"user{index}@example.com", subject="Hi", body="Code: 123456")
+        call_command('send_outbox_emails', '--once', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(FlakyEmailBackend.opened, 1)
+        self.assertEqual(mail.outbox[0].from_email, 'noreply@craftcrest.example')
+        self.assertFalse(EmailOutbox.objects.exclude(status=EmailOutbox.SENT).exists())
+        self.assertFalse(EmailOutbox.objects.exclude(body="").exists())
+
+    def test_failed_send_is_retried_then_given_up(self):
+        FlakyEmailBackend.reject = {"down@example.com"}
+        EmailOutbox.objects.create(to_email="down@example.com", subject="Hi", body="Code")
+        EmailOutbox.objects.create(to_email="up@example.com", subject="Hi", body="Code")
+        with self.assertLogs("users.outbox", level="WARNING"):
+            self.assertEqual(send_pending(), 2)
+        failed = EmailOutbox.objects.get(to_email="down@example.com")
+        self.assertEqual((failed.status, failed.attempts), (EmailOutbox.PENDING, 1))
+        self.assertEqual(EmailOutbox.objects.get(to_email="up@example.com").status, EmailOutbox.SENT)
+        with self.assertLogs("users.outbox", level="ERROR"):
+            self.assertEqual(send_pending(), 1)
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, EmailOutbox.FAILED)
+        self.assertEqual(failed.last_error, "SMTP unavailable")
+        self.assertEqual(failed.body, "")
+        self.assertEqual([message.to for message in mail.outbox], [["up@example.com"]])
+
+    def test_expired_email_is_failed_unsent(self):
+        EmailOutbox.objects.create(
+            to_email="late@example.com", subject="Hi", body="Code: 123456",
+            expires_at=timezone.now() - timedelta(seconds=1),
+        )
+        EmailOutbox.objects.create(
+            to_email="on-time@example.com", subject="Hi", body="Code: 654321",
+            expires_at=timezone.now() + timedelta(minutes=10),
+        )
+        self.assertEqual(send_pending(), 1)
+        self.assertEqual([message.to for message in mail.outbox], [["on-time@example.com"]])
+        expired = EmailOutbox.objects.get(to_email="late@example.com")
+        self.assertEqual((expired.status, expired.body, expired.attempts), (EmailOutbox.FAILED, "", 0))
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.buyer = User.objects.create(
+            email="buyer@example.com", phone_number="0711000001", user_type=User.BUYER,
+        )
+        self.token = Token.objects.create(user=self.buyer)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.url = reverse('order-list')
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_token_lookup_is_cached(self):
+        first = self.count_queries()
+        self.assertEqual(self.count_queries(), first - 1)
+
+    def test_deactivated_user_is_rejected(self):
+        self.count_queries()
+        self.buyer.is_active = False
+        self.buyer.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_deleted_token_is_rejected(self):
+        self.count_queries()
+        self.token.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_user_changes_are_seen(self):
+        self.count_queries()
+        self.buyer.user_type = User.ARTISAN
+        self.buyer.save()
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+        self.count_queries()
+        user, _token = cache.get(token_cache_key(self.token.key))
+        self.assertEqual(user.user_type, User.ARTISAN)
+
+    @override_settings(AUTH_TOKEN_CACHE_TTL=0)
+    def test_zero_ttl_skips_the_cache(self):
+        self.assertEqual(self.count_queries(), self.count_queries())
+        self.assertIsNone(cache.get(token_cache_key(self.token.key)))
+
+    def test_process_local_cache_fails_check_with_several_workers(self):
+        self.assertEqual(check_token_cache(None), [])
+        with override_settings(WEB_CONCURRENCY=4):
+            self.assertEqual([error.id for error in check_token_cache(None)], ["users.E001"])
+            with override_settings(AUTH_TOKEN_CACHE_TTL=0):
+                self.assertEqual(check_token_cache(None), [])
+            shared = {"default": {"BACKEND": "django.core.cache.backends.db.DatabaseCache", "LOCATION": "cache"}}
+            with override_settings(CACHES=shared):
+                self.assertEqual(check_token_cache(None), [])
+
+
+class PasswordHashProfileTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(email="test@example.com", phone_number="1234567890", user_type=User.BUYER)
+
+    def login(self):
+        return self.client.post(reverse("login"), {"email": "test@example.com", "password": "TestPassword123"}, format="json")
+
+    def test_suite_uses_fast_profile(self):
+        self.assertEqual(settings.PASSWORD_HASH_PROFILE, "fast")
+        self.assertEqual(identify_hasher(make_password("TestPassword123")).algorithm, "md5")
+
+    def test_legacy_hash_upgraded_on_login(self):
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            self.user.password = make_password("TestPassword123", hasher="pbkdf2_sha256")
+        self.user.save()
+        self.assertEqual(self.login().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("md5$"))
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_changed_cost_rehashes_on_login(self):
+        with override_settings(PASSWORD_HASHERS=settings.PASSWORD_HASH_PROFILES["pbkdf2"]):
+            with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+                self.user.set_password("TestPassword123")
+                self.user.save()
+            with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+                self.assertEqual(self.login().status_code, 200)
+            self.user.refresh_from_db()
+            self.assertTrue(self.user.password.startswith("pbkdf2_sha256$2000$"))
+
+    def test_argon2_profile(self):
+        with override_settings(
+            PASSWORD_HASHERS=settings.PASSWORD_HASH_PROFILES["argon2"],
+            PASSWORD_ARGON2_MEMORY_COST=1024, PASSWORD_ARGON2_PARALLELISM=1,
+        ):
+            self.user.set_password("TestPassword123")
+            self.user.save()
+            self.assertTrue(self.user.password.startswith("argon2$"))
+            self.assertIn("m=1024", self.user.password)
+            self.assertEqual(self.login().status_code, 200)
+
+
+@override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {
+    'login': '3/min', 'login_ip': '5/min', 'forgot_password': '2/min', 'otp_verify': '2/min',
+    'password_reset': '2/min',
+}})
+class AccountThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.user = User.objects.create(email="test@example.com", phone_number="1234567890", user_type=User.BUYER)
+        self.user.set_password("TestPassword123")
+        self.user.save()
+
+    def login(self, email="test@example.com", password="WrongPassword", **extra):
+        return self.client.post(reverse("login"), {"email": email, "password": password}, format="json", **extra)
+
+    def test_login_limited_per_email_without_queries(self):
+        for _ in range(3):
+            self.assertEqual(self.login().status_code, 400)
+        # No token is sent, so authentication makes no queries either.
+        with self.assertNumQueries(0):
+            response = self.login(password="TestPassword123")
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("Retry-After", response)
+        # Another address from another client is unaffected.
+        self.assertEqual(self.login(email="other@example.com", REMOTE_ADDR="10.0.0.2").status_code, 400)
+
+    def test_email_case_does_not_reset_limit(self):
+        for email in ("test@example.com", "TEST@example.com", "Test@Example.com"):
+            self.assertEqual(self.login(email=email).status_code, 400)
+        self.assertEqual(self.login(email="tEsT@example.com").status_code, 429)
+
+    def test_login_limited_per_ip(self):
+        for index in range(5):
+            self.assertEqual(self.login(email=f"user{index}@example.com").status_code, 400)
+        self.assertEqual(self.login(email="fresh@example.com").status_code, 429)
+        self.assertEqual(self.login(email="fresh@example.com", REMOTE_ADDR="10.0.0.2").status_code, 400)
+
+    def test_forwarded_for_header_is_not_trusted(self):
+        for index in range(5):
+            response = self.login(email=f"user{index}@example.com", HTTP_X_FORWARDED_FOR=f"203.0.113.{index}")
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.login(email="fresh@example.com", HTTP_X_FORWARDED_FOR="203.0.113.99").status_code, 429)
+
+    def test_password_reset_is_limited(self):
+        url = reverse("reset-password")
+        data = {"email": "test@example.com", "new_password": "NewPassword123", "confirm_password": "NewPassword123"}
+        statuses = [self.client.post(url, data, format="json").status_code for _ in range(3)]
+        self.assertEqual(statuses, [400, 400, 429])
+
+    def test_forgot_password_flood_queues_no_more_email(self):
+        for _ in range(5):
+            self.client.post(reverse("forgot-password"), {"email": "test@example.com"}, format="json")
+        self.assertEqual(EmailOutbox.objects.count(), 2)
+
+    def test_otp_guessing_is_limited(self):
+        url = reverse("verify-otp")
+        statuses = [
+            self.client.post(url, {"email": "test@example.com", "otp": f"{guess:06d}"}, format="json").status_code
+            for guess in range(4)
+        ]
+        self.assertEqual(statuses, [400, 400, 429, 429])
+
+    def test_window_slides(self):
+        limiter = SlidingWindowLimiter(limit=4, window=60)
+        start = 6000.0
+        for _ in range(4):
+            self.assertIsNone(limiter.hit("key", now=start + 30))
+        self.assertIsNotNone(limiter.hit("key", now=start + 59))
+        # Half of the previous window still counts: 4 * 0.5 = 2 of 4 used.
+        self.assertIsNone(limiter.hit("key", now=start + 90))
+        self.assertIsNone(limiter.hit("key", now=start + 90))
+        self.assertIsNotNone(limiter.hit("key", now=start + 90))
+        self.assertIsNone(limiter.hit("key", now=start + 150))
+
+    def test_process_local_cache_fails_check_with_several_workers(self):
+        self.assertEqual(check_throttle_cache(None), [])
+        with override_settings(WEB_CONCURRENCY=4):
+            self.assertEqual([error.id for error in check_throttle_cache(None)], ["users.E002"])
+            with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, "DEFAULT_THROTTLE_RATES": {}}):
+                self.assertEqual(check_throttle_cache(None), [])
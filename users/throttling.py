@@ -0,0 +1,124 @@
+"""
+Sliding-window rate limiting for the unauthenticated account endpoints.
+
+``SlidingWindowLimiter`` keeps one counter per fixed window in the Django
+cache, incremented atomically with ``add``/``incr``, and estimates the rate
+over the last full window by weighting the previous counter by how much of it
+still overlaps. That is two cache reads and at most one write per check, with
+no per-request timestamps to store.
+
+``SlidingWindowThrottle`` applies it per client IP and per submitted email and
+phone number. DRF runs throttles before the view, so a rejected request does
+not run the view's queries; authentication runs before the throttles, though,
+and still looks up any token sent with the request. The client IP is
+``REMOTE_ADDR`` unless ``NUM_PROXIES`` says how many X-Forwarded-For entries
+to trust. Rates come from ``DEFAULT_THROTTLE_RATES``: ``<scope>`` for each
+email or phone number and ``<scope>_ip`` for each client address.
+The counters must live in a cache shared by every worker process, or each
+worker allows the full rate; the ``users.E002`` system check enforces this.
+"""
+import hashlib
+import logging
+import time
+
+from django.core.cache import cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_rate(rate):
+    """Parse a DRF-style rate such as ``"5/min"`` into ``(limit, seconds)``."""
+    limit, period = rate.split('/')
+    return int(limit), PERIODS[period[0]]
+
+
+class SlidingWindowLimiter:
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+
+    def _keys(self, key, bucket):
+        return f"throttle:{key}:{bucket}", f"throttle:{key}:{bucket - 1}"
+
+    def hit(self, key, now=None):
+        """
+        Count a request for ``key``. Returns ``None`` if it is allowed, or the
+        seconds to wait if the limit is reached (the request is not counted).
+        """
+        now = now or time.time()
+        bucket, offset = divmod(now, self.window)
+        current, previous = self._keys(key, int(bucket))
+        overlap = 1 - offset / self.window
+        try:
+            counts = cache.get_many([current, previous])
+            estimate = counts.get(current, 0) + counts.get(previous, 0) * overlap
+            if estimate >= self.limit:
+                return max(self.window - offset, 1)
+            if not cache.add(current, 1, self.window * 2):
+                try:
+                    cache.incr(current)
+                except ValueError:
+                    cache.set(current, 1, self.window * 2)
+        except Exception:
+            logger.warning("Throttle cache unavailable, allowing request", exc_info=True)
+        return None
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    scope = None
+    identity_fields = ('email', 'phone_number')
+
+    def __init__(self):
+        self._wait = None
+
+    def get_limiter(self, scope):
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if rate is None:
+            return None
+        return SlidingWindowLimiter(*parse_rate(rate))
+
+    def identities(self, request):
+        yield f"{self.scope}_ip", self.get_ident(request)
+        data = request.data if hasattr(request.data, 'get') else {}
+        for field in self.identity_fields:
+            value = data.get(field)
+            if value and isinstance(value, str):
+                yield self.scope, f"{field}:{value.strip().lower()}"
+
+    def allow_request(self, request, view):
+        waits = []
+        for scope, identity in self.identities(request):
+            limiter = self.get_limiter(scope)
+            if limiter is None:
+                continue
+            digest = hashlib.sha256(identity.encode('utf-8')).hexdigest()[:24]
+            wait = limiter.hit(f"{scope}:{digest}")
+            if wait is not None:
+                waits.append(wait)
+        if waits:
+            self._wait = max(waits)
+            return False
+        return True
+
+    def wait(self):
+        return self._wait
+
+
+class LoginThrottle(SlidingWindowThrottle):
+    scope = 'login'
+
+
+class OTPVerificationThrottle(SlidingWindowThrottle):
+    scope = 'otp_verify'
+
+
+class ForgotPasswordThrottle(SlidingWindowThrottle):
+    scope = 'forgot_password'
+
+
+class PasswordResetThrottle(SlidingWindowThrottle):
+    scope = 'password_reset'